@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 import environ
@@ -51,11 +52,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "main.middleware.MetricsMiddleware",
+    "main.middleware.VisitTrackingMiddleware",
+    "main.middleware.QueryStatsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "main.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -92,9 +97,62 @@ DATABASES = {
         "PASSWORD": env("DB_PASSWORD"),
         "HOST": env("DB_HOST", default="localhost"),
         "PORT": env("DB_PORT", default="5432"),
+        # Reuse connections across requests; checked before reuse
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE", default=60),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# A psycopg 3 connection pool instead of persistent connections (needs
+# psycopg[pool]). Prefer it under ASGI, where persistent connections are
+# not reused across requests.
+if env.bool("DB_POOL", default=False):
+    from psycopg_pool import ConnectionPool
+
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": env.int("DB_POOL_MIN_SIZE", default=2),
+            "max_size": env.int("DB_POOL_MAX_SIZE", default=10),
+            "timeout": env.int("DB_POOL_TIMEOUT", default=10),
+            "check": ConnectionPool.check_connection,
+        }
+    }
+
+# Read replica for stats and catalog reads, see main/routers.py. Unset
+# connection settings are taken from the primary.
+if env("DB_REPLICA_HOST", default=""):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": env("DB_REPLICA_NAME", default=DATABASES["default"]["NAME"]),
+        "USER": env("DB_REPLICA_USER", default=DATABASES["default"]["USER"]),
+        "PASSWORD": env("DB_REPLICA_PASSWORD", default=DATABASES["default"]["PASSWORD"]),
+        "HOST": env("DB_REPLICA_HOST"),
+        "PORT": env("DB_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["main.routers.ReplicaRouter"]
+DB_REPLICA_MAX_LAG = env.float("DB_REPLICA_MAX_LAG", default=5)
+DB_REPLICA_CHECK_INTERVAL = env.float("DB_REPLICA_CHECK_INTERVAL", default=5)
+
+# Cache shared by the web workers and the bot, see main/caching.py. Use
+# Redis in production (redis://host:6379/0, needs the redis package);
+# "check --deploy" warns otherwise. The default file cache is a stand-in
+# for development and tests: it is shared by the processes of one machine,
+# but lists its directory on every write. Past CACHE_MAX_ENTRIES it evicts
+# a third of its keys at random, rate-limit buckets included.
+CACHES = {
+    "default": env.cache(
+        "CACHE_URL",
+        default="filecache://" + os.path.join(tempfile.gettempdir(), "gos_landing_page_cache"),
+    ),
+}
+CACHES["default"].setdefault("KEY_PREFIX", "gos")
+if CACHES["default"]["BACKEND"].endswith("FileBasedCache"):
+    CACHES["default"].setdefault("OPTIONS", {}).setdefault(
+        "MAX_ENTRIES", env.int("CACHE_MAX_ENTRIES", default=10000)
+    )
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -137,6 +195,20 @@ STATICFILES_DIRS = [
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Identical catalog uploads share one file (see main.storage)
+STORAGES = {
+    "default": {"BACKEND": "main.storage.DeduplicatingFileSystemStorage"},
+    "staticfiles": {"BACKEND": "main.staticfiles.OptimizedStaticFilesStorage"},
+}
+
+# CSS concatenated at collectstatic time, see main/staticfiles.py and the
+# {% static_bundle %} tag; a bundle lives in the directory of its sources
+STATIC_BUNDLES = {
+    "css/common.bundle.css": ["css/base.css", "css/theme.css", "css/buttons.css"],
+    "css/catalog.bundle.css": ["css/catalog.css", "css/search.css"],
+    "css/search.bundle.css": ["css/category_detail.css", "css/search.css"],
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -147,6 +219,75 @@ TELEGRAM_BOT_TOKEN = env("TELEGRAM_BOT_TOKEN", default="your_bot_token_here")
 SITE_URL = env("SITE_URL", default="http://localhost:8000")
 API_TOKEN = env("API_TOKEN", default="your_api_token_here")
 
+# Local timezone used to bucket scan statistics (heatmaps, daily rollups)
+STATS_TIME_ZONE = env("STATS_TIME_ZONE", default="Asia/Tashkent")
+
+# Serve the landing page, QR visits and phone clicks with async views;
+# only worth it under ASGI (gos_landing_page/asgi.py), see the loadtest command
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
+# Token buckets for the public QR visit and phone-click endpoints, see
+# main/ratelimit.py. "<requests>/<period>" (period s, m or h): a bucket
+# holds <requests> tokens and refills them over <period>; empty disables it.
+RATE_LIMIT_ENABLED = env.bool("RATE_LIMIT_ENABLED", default=True)
+RATE_LIMITS = {
+    "visit": {
+        "ip": env("RATE_LIMIT_VISIT_IP", default="20/m"),
+        "location": env("RATE_LIMIT_VISIT_LOCATION", default="600/m"),
+    },
+    "click": {
+        "ip": env("RATE_LIMIT_CLICK_IP", default="20/m"),
+    },
+    "page_view": {
+        "ip": env("RATE_LIMIT_PAGE_VIEW_IP", default="120/m"),
+    },
+}
+# Header the reverse proxy puts the client address in (e.g. X-Real-IP).
+# The per-IP limits above only apply once it is set: behind a proxy every
+# visitor would share the proxy's address and bucket.
+CLIENT_IP_HEADER = env("CLIENT_IP_HEADER", default="")
+
+# Key of the signed tokens in QR code URLs, see main/qrcodes.py. Set a
+# dedicated key: printed codes must survive a SECRET_KEY change. To rotate
+# it, move the old key to the (comma-separated) fallbacks, which are still
+# accepted; codes rendered from then on are signed with the new key.
+QR_SIGNING_KEY = env("QR_SIGNING_KEY", default=SECRET_KEY)
+QR_SIGNING_KEY_FALLBACKS = env.list("QR_SIGNING_KEY_FALLBACKS", default=[])
+# Accept the unsigned /visit/<id>/ URLs of codes printed before the tokens
+QR_LEGACY_VISITS = env.bool("QR_LEGACY_VISITS", default=True)
+
+# Visit sessions and funnels (scan -> catalog -> item -> call), see
+# main/visits.py. Events are buffered per process and written every
+# VISIT_FLUSH_INTERVAL seconds or VISIT_FLUSH_SIZE pending visits; a visit
+# ends VISIT_SESSION_TIMEOUT seconds after its last page view.
+VISIT_TRACKING_ENABLED = env.bool("VISIT_TRACKING_ENABLED", default=True)
+VISIT_FLUSH_INTERVAL = env.int("VISIT_FLUSH_INTERVAL", default=5)
+VISIT_FLUSH_SIZE = env.int("VISIT_FLUSH_SIZE", default=500)
+VISIT_SESSION_TIMEOUT = env.int("VISIT_SESSION_TIMEOUT", default=30 * 60)
+
+# Prometheus metrics on /metrics/ (Authorization: Bearer <token>), see
+# main/metrics.py; nothing is recorded while the token is empty. Worker
+# processes and the bot share their counters through METRICS_DIR.
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+METRICS_DIR = env("METRICS_DIR", default="")
+METRICS_FLUSH_INTERVAL = env.int("METRICS_FLUSH_INTERVAL", default=10)
+
+# SQL fingerprints per view and bot command in the admin ("SQL query
+# statistics"), see main/querystats.py. Queries slower than the threshold
+# get their EXPLAIN plan sampled.
+QUERY_STATS_ENABLED = env.bool("QUERY_STATS_ENABLED", default=False)
+QUERY_STATS_EXPLAIN_THRESHOLD_MS = env.float("QUERY_STATS_EXPLAIN_THRESHOLD_MS", default=100)
+QUERY_STATS_FLUSH_INTERVAL = env.int("QUERY_STATS_FLUSH_INTERVAL", default=60)
+
+# Sampling profiler for requests and bot commands ("Profiles" in the admin),
+# see main/profiling.py. With the rate at 0 only staff requests sending an
+# X-Profile header are profiled.
+PROFILING_ENABLED = env.bool("PROFILING_ENABLED", default=False)
+PROFILING_SAMPLE_RATE = env.float("PROFILING_SAMPLE_RATE", default=0.0)
+PROFILING_INTERVAL_MS = env.float("PROFILING_INTERVAL_MS", default=5)
+PROFILING_MAX_STACKS = env.int("PROFILING_MAX_STACKS", default=1000)
+PROFILING_MAX_PROFILES = env.int("PROFILING_MAX_PROFILES", default=200)
+
 # REST Framework settings
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
@@ -1,39 +1,79 @@
 import datetime
-from io import BytesIO
-
-import qrcode
-from django.contrib import admin
-from django.db.models import Count
+from itertools import zip_longest
+
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.forms.models import BaseInlineFormSet
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.functions import ExtractHour
 from django.http import HttpResponse
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.utils.html import format_html
 
+from . import dedup, exports, location_import, profiling, qrcodes, querystats, stats
+from .changelists import (
+    ClickRollupDateFilter,
+    EstimatedCountPaginator,
+    KeysetPaginationMixin,
+    RollupDateFilter,
+)
 from .models import (
     FurnitureCategory,
     FurnitureImage,
     FurnitureItem,
     Location,
+    LocationHeatmapCell,
     PhoneClick,
+    Profile,
     QRCodeScan,
+    QueryStat,
+    VisitSession,
 )
+from .routers import use_replica
 
 # Register your models here.
 
 
+RECENT_SCANS_LIMIT = 20
+FUNNEL_LABELS = {"sessions": "Scan", "catalog": "Catalog", "item": "Item", "calls": "Phone call"}
+
+
+class RecentScansFormSet(BaseInlineFormSet):
+    """Only the latest scans; the full history is in the scan changelist."""
+
+    def get_queryset(self):
+        if not hasattr(self, "_recent_queryset"):
+            self._recent_queryset = super().get_queryset().order_by(
+                "-timestamp", "-id"
+            )[:RECENT_SCANS_LIMIT]
+        return self._recent_queryset
+
+
 class QRCodeScanInline(admin.TabularInline):
     model = QRCodeScan
+    formset = RecentScansFormSet
     extra = 0
     readonly_fields = ("timestamp", "ip_address", "user_agent")
     can_delete = False
     max_num = 0
     fields = ("timestamp", "ip_address")
+    verbose_name_plural = f"Последние {RECENT_SCANS_LIMIT} сканов"
 
     def has_add_permission(self, request, obj=None):
         return False
 
 
+class LocationImportForm(forms.Form):
+    file = forms.FileField(
+        help_text="CSV or XLSX with a header row: name, description, phones"
+    )
+
+
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
     list_display = (
@@ -46,21 +86,45 @@ class LocationAdmin(admin.ModelAdmin):
     )
     search_fields = ("name", "user__username", "user__phone_number")
     list_filter = ("user",)
+    actions = ("reissue_qr_codes",)
     inlines = [QRCodeScanInline]
-    readonly_fields = ("qr_code_preview",)
+    readonly_fields = ("qr_code_preview", "all_scans_link", "qr_version")
     fieldsets = (
         (None, {"fields": ("name", "description", "user")}),
+        ("Scans", {"fields": ("all_scans_link",)}),
         (
             "QR Code",
             {
-                "fields": ("qr_code_preview",),
+                "fields": ("qr_code_preview", "qr_version"),
                 "classes": ("collapse",),
             },
         ),
     )
 
+    def get_queryset(self, request):
+        # Scan totals come from the heatmap rollup (at most 168 rows per
+        # location) instead of counting the raw scans of every row.
+        scan_totals = (
+            LocationHeatmapCell.objects.filter(location=OuterRef("pk"))
+            .order_by()
+            .values("location")
+            .annotate(total=Sum("scans"))
+            .values("total")
+        )
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                scan_total=Coalesce(
+                    Subquery(scan_totals, output_field=IntegerField()), 0
+                )
+            )
+            .prefetch_related("user")
+        )
+
     def get_user(self, obj):
-        users = obj.user.all()
+        # Uses the prefetched users; slicing or counting the manager would query
+        users = list(obj.user.all())
         if users:
             # Display up to 2 users with their phone numbers
             user_strings = [
@@ -68,8 +132,8 @@ class LocationAdmin(admin.ModelAdmin):
             ]
             display = ", ".join(user_strings)
             # If there are more than 2 users, indicate that
-            if users.count() > 2:
-                display += f" +{users.count() - 2} more"
+            if len(users) > 2:
+                display += f" +{len(users) - 2} more"
             return display
         return "-"
 
@@ -88,13 +152,64 @@ class LocationAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.view_statistics_detail),
                 name="location-statistics",
             ),
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_locations),
+                name="location-import",
+            ),
         ]
         return custom_urls + urls
 
+    def import_locations(self, request):
+        """Bulk creation from an uploaded sheet, see main.location_import."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = LocationImportForm(request.POST or None, request.FILES or None)
+        report = None
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            try:
+                # No pre-rendering: a process pool has no place in a web
+                # request, the QR codes are rendered on first view instead
+                report = location_import.import_file(upload, upload.name)
+            except ValueError as exc:
+                form.add_error("file", str(exc))
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Import locations",
+            "opts": self.model._meta,
+            "form": form,
+            "report": report,
+        }
+        return TemplateResponse(request, "admin/main/location/import.html", context)
+
+    @admin.action(description="Reissue QR codes (printed codes stop working)")
+    def reissue_qr_codes(self, request, queryset):
+        location_ids = list(queryset.values_list("pk", flat=True))
+        Location.objects.filter(pk__in=location_ids).update(qr_version=F("qr_version") + 1)
+        qrcodes.forget_versions(location_ids)
+        self.message_user(
+            request, f"Reissued the QR codes of {len(location_ids)} locations."
+        )
+
     def get_scan_count(self, obj):
-        return obj.scans.count()
+        return obj.scan_total
 
     get_scan_count.short_description = "Scans"
+    get_scan_count.admin_order_field = "scan_total"
+
+    def all_scans_link(self, obj):
+        if not obj.pk:
+            return "-"
+        url = reverse("admin:main_qrcodescan_changelist")
+        return format_html(
+            '<a class="button" href="{}?location__id__exact={}">All scans ({})</a>',
+            url,
+            obj.pk,
+            obj.scan_total,
+        )
+
+    all_scans_link.short_description = "History"
 
     def view_qr_code(self, obj):
         url = reverse("admin:location-qrcode", args=[obj.pk])
@@ -124,24 +239,16 @@ class LocationAdmin(admin.ModelAdmin):
 
     def generate_qrcode(self, request, location_id, *args, **kwargs):
         location = self.get_object(request, location_id)
-        site_url = request.build_absolute_uri("/").rstrip("/")
-        redirect_url = f"{site_url}/visit/{location.id}/"
-
-        # Generate QR code
-        img = qrcode.make(redirect_url)
-
-        # Save QR code to BytesIO object
-        buffer = BytesIO()
-        img.save(buffer)
-        buffer.seek(0)
+        png = qrcodes.location_png(request.build_absolute_uri("/"), location)
 
         # Return the QR code as an image
-        response = HttpResponse(buffer, content_type="image/png")
+        response = HttpResponse(png, content_type="image/png")
         response["Content-Disposition"] = (
             f'inline; filename="qrcode_{location.name}.png"'
         )
         return response
 
+    @method_decorator(use_replica)
     def view_statistics_detail(self, request, location_id, *args, **kwargs):
         location = self.get_object(request, location_id)
 
@@ -160,17 +267,40 @@ class LocationAdmin(admin.ModelAdmin):
         ).count()
         total_count = location.scans.count()
 
-        # Get hourly distribution for today
+        # Get hourly distribution for today, in the local timezone
+        tz = stats.stats_timezone()
+        local_midnight = timezone.localtime(timezone=tz).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
         hourly_distribution = (
-            location.scans.filter(timestamp__date=today)
-            .extra({"hour": "EXTRACT(hour FROM timestamp)"})
+            location.scans.filter(timestamp__gte=local_midnight)
+            .annotate(hour=ExtractHour("timestamp", tzinfo=tz))
             .values("hour")
             .annotate(count=Count("id"))
             .order_by("hour")
         )
 
-        # Get site URL for testing QR code
-        site_url = request.build_absolute_uri("/").rstrip("/")
+        # Hour-of-week heatmap over the whole history, read from the rollup
+        matrix = stats.location_heatmap([location.id])
+        peak = max(cell["scans"] for row in matrix for cell in row)
+        heatmap = [
+            {
+                "day": day,
+                "cells": [
+                    dict(cell, alpha=round(cell["scans"] / peak, 2) if peak else 0)
+                    for cell in row
+                ],
+            }
+            for day, row in zip(stats.WEEKDAYS, matrix)
+        ]
+
+        # Visit funnel of the last 30 days, read from the daily rollup
+        funnel = stats.location_funnel([location.id], start=last_month)
+        for stage in funnel["stages"]:
+            stage["label"] = FUNNEL_LABELS[stage["key"]]
+
+        # Signed visit URL for testing the QR code
+        visit_url = qrcodes.visit_url(request.build_absolute_uri("/"), location)
 
         context = {
             "title": f"Statistics for {location.name}",
@@ -181,19 +311,62 @@ class LocationAdmin(admin.ModelAdmin):
             "last_month_count": last_month_count,
             "total_count": total_count,
             "hourly_distribution": hourly_distribution,
+            "heatmap": heatmap,
+            "heatmap_hours": range(24),
+            "heatmap_timezone": tz.key,
+            "funnel": funnel,
             "opts": self.model._meta,
-            "site_url": site_url,
+            "visit_url": visit_url,
         }
 
         return TemplateResponse(request, "admin/location_statistics.html", context)
 
 
 @admin.register(QRCodeScan)
-class QRCodeScanAdmin(admin.ModelAdmin):
+class QRCodeScanAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ("location", "timestamp", "ip_address", "user_agent")
-    list_filter = ("location", "timestamp")
-    date_hierarchy = "timestamp"
+    list_filter = ("location", RollupDateFilter)
+    list_select_related = ("location",)
     readonly_fields = ("location", "timestamp", "ip_address", "user_agent")
+    actions = ("export_csv", "export_ndjson")
+
+    @admin.action(description="Export selected scans to CSV")
+    def export_csv(self, request, queryset):
+        return exports.export_response(
+            queryset, "csv", compress=exports.accepts_gzip(request)
+        )
+
+    @admin.action(description="Export selected scans to NDJSON")
+    def export_ndjson(self, request, queryset):
+        return exports.export_response(
+            queryset, "ndjson", compress=exports.accepts_gzip(request)
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(VisitSession)
+class VisitSessionAdmin(admin.ModelAdmin):
+    list_display = (
+        "location",
+        "started_at",
+        "stage",
+        "returning",
+        "landing_views",
+        "catalog_views",
+        "category_views",
+        "item_views",
+        "calls",
+    )
+    list_filter = ("location", "returning", "stage")
+    list_select_related = ("location",)
+    ordering = ("-started_at",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def has_add_permission(self, request):
         return False
@@ -203,10 +376,10 @@ class QRCodeScanAdmin(admin.ModelAdmin):
 
 
 @admin.register(PhoneClick)
-class PhoneClickAdmin(admin.ModelAdmin):
+class PhoneClickAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ("get_scan_location", "get_scan_visit_id", "timestamp")
-    list_filter = ("scan__location", "timestamp")
-    date_hierarchy = "timestamp"
+    list_filter = ("scan__location", ClickRollupDateFilter)
+    list_select_related = ("scan__location",)
     readonly_fields = ("scan", "timestamp")
 
     def get_scan_location(self, obj):
@@ -231,6 +404,16 @@ class PhoneClickAdmin(admin.ModelAdmin):
     #    return False # If you don't want them to be deletable from admin
 
 
+def warn_near_duplicates(modeladmin, request, names):
+    """Point out uploads that look like images already in the catalog."""
+    for name, similar in dedup.near_duplicates([name for name in names if name]).items():
+        modeladmin.message_user(
+            request,
+            f"{name} looks like {', '.join(similar)}; consider reusing that image.",
+            messages.WARNING,
+        )
+
+
 class FurnitureImageInline(admin.TabularInline):
     model = FurnitureImage
     extra = 1
@@ -258,6 +441,11 @@ class FurnitureCategoryAdmin(admin.ModelAdmin):
         ),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if "image" in form.changed_data and obj.image:
+            warn_near_duplicates(self, request, [obj.image.name])
+
     def item_count(self, obj):
         return obj.furniture_items.count()
 
@@ -295,6 +483,21 @@ class FurnitureItemAdmin(admin.ModelAdmin):
         ),
     )
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        names = []
+        if "main_image" in form.changed_data:
+            names.append(form.instance.main_image.name)
+        for formset in formsets:
+            if formset.model is FurnitureImage:
+                names.extend(image.image.name for image in formset.new_objects)
+                names.extend(
+                    image.image.name
+                    for image, fields in formset.changed_objects
+                    if "image" in fields
+                )
+        warn_near_duplicates(self, request, names)
+
     def image_preview(self, obj):
         if obj.main_image:
             return format_html(
@@ -303,3 +506,185 @@ class FurnitureItemAdmin(admin.ModelAdmin):
         return "No Image"
 
     image_preview.short_description = "Preview"
+
+
+QUERY_REPORT_LIMIT = 50
+
+
+@admin.register(QueryStat)
+class QueryStatAdmin(admin.ModelAdmin):
+    list_display = (
+        "short_sql",
+        "source",
+        "count",
+        "total",
+        "mean",
+        "p95",
+        "maximum",
+        "has_plan",
+        "last_seen",
+    )
+    list_filter = ("source",)
+    search_fields = ("sql", "source", "fingerprint")
+    ordering = ("-total_ms",)
+    fields = (
+        "fingerprint",
+        "source",
+        "sql",
+        "count",
+        "total_ms",
+        "max_ms",
+        "p95",
+        "explain_sql",
+        "plan",
+        "explained_at",
+        "first_seen",
+        "last_seen",
+    )
+    readonly_fields = fields
+
+    def get_urls(self):
+        return [
+            path(
+                "fingerprints/",
+                self.admin_site.admin_view(self.fingerprint_report),
+                name="main_querystat_fingerprints",
+            ),
+        ] + super().get_urls()
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="SQL")
+    def short_sql(self, obj):
+        return obj.sql if len(obj.sql) <= 120 else obj.sql[:117] + "..."
+
+    @admin.display(description="Total, ms", ordering="total_ms")
+    def total(self, obj):
+        return round(obj.total_ms, 1)
+
+    @admin.display(description="Mean, ms")
+    def mean(self, obj):
+        return round(obj.total_ms / obj.count, 2) if obj.count else None
+
+    @admin.display(description="p95, ms")
+    def p95(self, obj):
+        return querystats.p95(obj.buckets)
+
+    @admin.display(description="Max, ms", ordering="max_ms")
+    def maximum(self, obj):
+        return round(obj.max_ms, 1)
+
+    @admin.display(description="Plan", boolean=True)
+    def has_plan(self, obj):
+        return bool(obj.explain_plan)
+
+    @admin.display(description="EXPLAIN plan")
+    def plan(self, obj):
+        return format_html("<pre>{}</pre>", obj.explain_plan) if obj.explain_plan else "-"
+
+    def fingerprint_report(self, request):
+        """Top fingerprints over all views and bot commands, by total time."""
+        rows = list(
+            QueryStat.objects.values("fingerprint")
+            .annotate(
+                total=Sum("total_ms"),
+                executions=Sum("count"),
+                slowest=Max("max_ms"),
+                sources=Count("id"),
+            )
+            .order_by("-total")[:QUERY_REPORT_LIMIT]
+        )
+        # SQL, sources and a summed histogram of the listed fingerprints
+        details = {}
+        for stat in QueryStat.objects.filter(
+            fingerprint__in=[row["fingerprint"] for row in rows]
+        ).only("fingerprint", "sql", "source", "buckets", "total_ms"):
+            detail = details.setdefault(
+                stat.fingerprint, {"sql": stat.sql, "buckets": [], "top_source": (0, "")}
+            )
+            detail["buckets"] = [
+                a + b for a, b in zip_longest(detail["buckets"], stat.buckets, fillvalue=0)
+            ]
+            detail["top_source"] = max(detail["top_source"], (stat.total_ms, stat.source))
+        for row in rows:
+            detail = details[row["fingerprint"]]
+            row["sql"] = detail["sql"]
+            row["p95"] = querystats.p95(detail["buckets"])
+            row["mean"] = row["total"] / row["executions"] if row["executions"] else None
+            row["top_source"] = detail["top_source"][1]
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Top SQL fingerprints",
+            "opts": self.model._meta,
+            "rows": rows,
+            "limit": QUERY_REPORT_LIMIT,
+        }
+        return TemplateResponse(request, "admin/main/querystat/fingerprints.html", context)
+
+
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ("source", "trigger", "started_at", "duration", "sample_count", "download")
+    list_filter = ("trigger", "source")
+    date_hierarchy = "started_at"
+    fields = ("source", "trigger", "started_at", "duration_ms", "sample_count", "hot", "download")
+    readonly_fields = fields
+    actions = ("download_merged",)
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:profile_id>/collapsed/",
+                self.admin_site.admin_view(self.collapsed),
+                name="main_profile_collapsed",
+            ),
+        ] + super().get_urls()
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Duration, ms", ordering="duration_ms")
+    def duration(self, obj):
+        return round(obj.duration_ms, 1)
+
+    @admin.display(description="Collapsed stacks")
+    def download(self, obj):
+        url = reverse("admin:main_profile_collapsed", args=[obj.pk])
+        return format_html('<a class="button" href="{}">Download</a>', url)
+
+    @admin.display(description="Hot functions (self samples)")
+    def hot(self, obj):
+        rows = profiling.hot_functions(obj.stacks)
+        return format_html(
+            "<pre>{}</pre>", "\n".join(f"{count:>6}  {name}" for name, count in rows)
+        )
+
+    def collapsed(self, request, profile_id):
+        profile = self.get_object(request, profile_id)
+        if profile is None:
+            return self._get_obj_does_not_exist_redirect(request, self.opts, str(profile_id))
+        return self._collapsed_response(
+            profiling.merge([profile.stacks]), f"profile-{profile.pk}.txt"
+        )
+
+    @admin.action(description="Download selected profiles merged (collapsed stacks)")
+    def download_merged(self, request, queryset):
+        return self._collapsed_response(
+            profiling.merge(queryset.values_list("stacks", flat=True).iterator()),
+            "profiles.txt",
+        )
+
+    @staticmethod
+    def _collapsed_response(text, filename):
+        # flamegraph.pl profile.txt > profile.svg, or open it in speedscope.app
+        response = HttpResponse(text, content_type="text/plain; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
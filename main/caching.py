@@ -0,0 +1,131 @@
+"""Namespaced application caching on top of the ``CACHES`` backends.
+
+Every feature gets a :class:`Namespace`, which sets its key prefix and
+default timeout and labels its hits and misses in :mod:`main.metrics`.
+Its methods take the key parts last, as separate arguments
+(``LOCATIONS.set(version, location_id)``), so a key reads the same in
+every call.
+The backend is configured with ``CACHE_URL``. Redis is shared by all
+processes. The default file cache is also shared by the processes of
+one machine, gunicorn workers and the bot included.
+
+:meth:`Namespace.get_or_set` protects expensive values against
+stampedes with probabilistic early expiration (XFetch, Vattani et al.).
+Each reader may recompute the value a little before it expires. The
+chance rises as expiry nears and as the last computation took longer.
+One reader then refreshes the value while the others are still served
+the cached copy, so they do not all miss at the same moment.
+"""
+
+from __future__ import annotations
+
+import math
+import random
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+from . import metrics
+
+# Higher values recompute earlier; 1 is the optimum from the paper
+XFETCH_BETA = 1.0
+
+
+class Namespace:
+    def __init__(self, name: str, timeout: int, alias: str = DEFAULT_CACHE_ALIAS):
+        self.name = name
+        self.timeout = timeout
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, *parts) -> str:
+        return ":".join([self.name, *map(str, parts)])
+
+    def get(self, *parts):
+        value = self.cache.get(self.key(*parts))
+        metrics.cache_lookup(self.name, value is not None)
+        return value
+
+    def set(self, value, *parts, timeout=None):
+        self.cache.set(self.key(*parts), value, self.timeout if timeout is None else timeout)
+
+    def delete(self, *parts):
+        self.cache.delete(self.key(*parts))
+
+    async def aget(self, *parts):
+        value = await self.cache.aget(self.key(*parts))
+        metrics.cache_lookup(self.name, value is not None)
+        return value
+
+    async def aset(self, value, *parts, timeout=None):
+        await self.cache.aset(
+            self.key(*parts), value, self.timeout if timeout is None else timeout
+        )
+
+    async def adelete(self, *parts):
+        await self.cache.adelete(self.key(*parts))
+
+    def _fresh(self, entry, beta) -> bool:
+        """Whether a ``(value, delta, expiry)`` entry is served or recomputed."""
+        if entry is None:
+            return False
+        _, delta, expiry = entry
+        # -log(u) for u in (0, 1] is an exponential draw: usually small
+        return time.time() - delta * beta * math.log(1 - random.random()) < expiry
+
+    def _entry(self, value, delta, timeout):
+        return (value, delta, time.time() + timeout)
+
+    def get_or_set(self, compute, *parts, timeout=None, beta=XFETCH_BETA):
+        """The cached value, computed by ``compute()`` on a miss or early refresh."""
+        entry = self.cache.get(self.key(*parts))
+        fresh = self._fresh(entry, beta)
+        metrics.cache_lookup(self.name, fresh)
+        if fresh:
+            return entry[0]
+        return self.refresh(compute, *parts, timeout=timeout)
+
+    def refresh(self, compute, *parts, timeout=None):
+        """Compute and store a :meth:`get_or_set` value unconditionally."""
+        started = time.perf_counter()
+        value = compute()
+        self.put(value, *parts, delta=time.perf_counter() - started, timeout=timeout)
+        return value
+
+    def put(self, value, *parts, delta, timeout=None):
+        """Store a :meth:`get_or_set` value computed elsewhere in ``delta`` seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        self.cache.set(self.key(*parts), self._entry(value, delta, timeout), timeout)
+
+    async def aget_or_set(self, compute, *parts, timeout=None, beta=XFETCH_BETA):
+        """Async :meth:`get_or_set`; ``compute`` is a coroutine function."""
+        timeout = self.timeout if timeout is None else timeout
+        key = self.key(*parts)
+        entry = await self.cache.aget(key)
+        fresh = self._fresh(entry, beta)
+        metrics.cache_lookup(self.name, fresh)
+        if fresh:
+            return entry[0]
+        started = time.perf_counter()
+        value = await compute()
+        await self.cache.aset(
+            key, self._entry(value, time.perf_counter() - started, timeout), timeout
+        )
+        return value
+
+
+# Rendered QR code images, by location and target URL
+QR_CODES = Namespace("qr", 24 * 60 * 60)
+# Page fragments: landing categories
+PAGES = Namespace("pages", 60)
+# Current qr_version of a location, for the QR visit redirect
+LOCATIONS = Namespace("locations", 5 * 60)
+# Scan of a visit id, for the phone click that follows the visit
+VISITS = Namespace("visits", 60 * 60)
+# Computed statistics served by the API
+STATS = Namespace("stats", 60)
+# Rate limiter buckets (main.ratelimit); expire with the bucket
+RATE_LIMITS = Namespace("ratelimit", 60)
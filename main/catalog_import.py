@@ -0,0 +1,133 @@
+"""Helpers shared by the furniture catalog import commands."""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Iterable, Iterator, Optional
+
+from django.utils.text import slugify
+
+from .models import FurnitureCategory, FurnitureItem
+
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """Character buffer over a text file, refilled on demand."""
+
+    def __init__(self, fp, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has already been consumed so the buffer stays small
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r}, found {found!r}")
+        self.pos += 1
+
+    def value(self, decoder: json.JSONDecoder):
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may be cut by the chunk boundary
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not isinstance(value, (dict, list, str)):
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_category_items(fp, chunk_size: int = 64 * 1024) -> Iterator[tuple[str, dict]]:
+    """Yield ``(category_name, item)`` from ``{"category": [item, ...], ...}``.
+
+    Only one item is decoded and held in memory at a time, so files far
+    larger than RAM can be imported.
+    """
+    reader = _Reader(fp, chunk_size)
+    decoder = json.JSONDecoder()
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        category = reader.value(decoder)
+        reader.expect(":")
+        reader.expect("[")
+        if reader.peek() != "]":
+            while True:
+                yield category, reader.value(decoder)
+                if reader.peek() == "]":
+                    break
+                reader.expect(",")
+        reader.expect("]")
+        if reader.peek() == "}":
+            return
+        reader.expect(",")
+
+
+class SlugRegistry:
+    """In-memory view of taken slugs used to resolve collisions in bulk.
+
+    Loads every slug of the model once instead of retrying saves on
+    ``IntegrityError``; callers release a slug when a row gives it up.
+    """
+
+    def __init__(self, model=FurnitureItem):
+        self.taken = set(model.objects.values_list("slug", flat=True))
+
+    def release(self, slug: str) -> None:
+        self.taken.discard(slug)
+
+    def claim(self, name: str, fallback: str, current: Optional[str] = None) -> str:
+        """Unique slug for ``name``; ``fallback`` is used when it slugifies to ''."""
+        base = slugify(name) or fallback
+        # Keep a slug that already derives from this base (including a
+        # de-duplicated "base-N"), so re-imports do not churn URLs.
+        if current is not None and re.fullmatch(rf"{re.escape(base)}(-\d+)?", current):
+            return current
+        slug = base
+        n = 2
+        while slug in self.taken:
+            slug = f"{base}-{n}"
+            n += 1
+        if current is not None:
+            self.release(current)
+        self.taken.add(slug)
+        return slug
+
+
+def categories_by_name(names: Optional[Iterable[str]] = None) -> dict:
+    categories = FurnitureCategory.objects.all()
+    if names is not None:
+        categories = categories.filter(name__in=list(names))
+    return {category.name: category for category in categories}
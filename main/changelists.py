@@ -0,0 +1,203 @@
+"""Admin changelist helpers for the large, append-only scan and click tables."""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from . import stats
+from .models import LocationHourlyStats
+
+CURSOR_VAR = "after"
+
+
+def estimate_count(queryset):
+    """Planner estimate of ``queryset.count()`` on PostgreSQL, else ``None``.
+
+    Unfiltered querysets read ``pg_class.reltuples``; filtered ones use the
+    row estimate of ``EXPLAIN``. Both are maintained by autovacuum/ANALYZE.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # -1 means the table has never been analyzed
+            return row[0] if row and row[0] >= 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids ``COUNT(*)`` over large result sets.
+
+    The exact count is only taken when the estimate is below
+    ``exact_threshold``, where it is cheap and the estimate least reliable.
+    """
+
+    exact_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_threshold:
+            return super().count
+        return estimate
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist paginated by ``(timestamp, id)`` instead of ``OFFSET``.
+
+    Active while the list uses the admin's default descending ordering; the
+    position is carried in the ``after`` query parameter. Sorting by a
+    column falls back to regular page numbers (with an estimated count).
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    @property
+    def keyset_enabled(self):
+        return ORDER_VAR not in self.params and ALL_VAR not in self.params
+
+    def _parse_cursor(self, value):
+        timestamp, _, pk = value.partition("|")
+        moment = parse_datetime(timestamp)
+        if moment is None or not pk.isdigit():
+            raise IncorrectLookupParameters
+        return moment, int(pk)
+
+    def get_results(self, request):
+        if not self.keyset_enabled:
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page
+        )
+        queryset = self.queryset.order_by("-timestamp", "-pk")
+        cursor = self.params.get(CURSOR_VAR)
+        if cursor:
+            timestamp, pk = self._parse_cursor(cursor)
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+            )
+        rows = list(queryset[: self.list_per_page + 1])
+        result_list = rows[: self.list_per_page]
+
+        self.keyset_next_url = None
+        if len(rows) > self.list_per_page:
+            last = result_list[-1]
+            self.keyset_next_url = self.get_query_string(
+                {CURSOR_VAR: f"{last.timestamp.isoformat()}|{last.pk}"}
+            )
+        self.keyset_first_url = (
+            self.get_query_string(remove=[CURSOR_VAR]) if cursor else None
+        )
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = bool(self.keyset_next_url or cursor)
+        self.paginator = paginator
+
+
+class KeysetPaginationMixin:
+    """ModelAdmin mixin wiring the keyset changelist and estimated counts."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ("-timestamp", "-id")
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class RollupDateFilter(admin.SimpleListFilter):
+    """Year → month → day drill-down built from the hourly rollup.
+
+    Replaces ``date_hierarchy``, whose ``dates()`` queries scan the whole
+    raw table. Periods are in ``STATS_TIME_ZONE``; ``rollup_field`` picks the
+    rollup counter that marks a period as non-empty.
+    """
+
+    title = "period"
+    parameter_name = "period"
+    rollup_field = "scans"
+
+    def _bounds(self, value):
+        tz = stats.stats_timezone()
+        parts = [int(part) for part in value.split("-")]
+        if len(parts) == 1:
+            start = _dt.datetime(parts[0], 1, 1, tzinfo=tz)
+            return start, start.replace(year=start.year + 1), "month"
+        if len(parts) == 2:
+            start = _dt.datetime(parts[0], parts[1], 1, tzinfo=tz)
+            end = (start + _dt.timedelta(days=32)).replace(day=1)
+            return start, end, "day"
+        start = _dt.datetime(parts[0], parts[1], parts[2], tzinfo=tz)
+        return start, start + _dt.timedelta(days=1), None
+
+    def lookups(self, request, model_admin):
+        tz = stats.stats_timezone()
+        rows = LocationHourlyStats.objects.filter(**{f"{self.rollup_field}__gt": 0})
+        value = self.value()
+        choices = []
+        try:
+            start, end, kind = self._bounds(value) if value else (None, None, "year")
+        except ValueError:
+            return []
+        if start:
+            # Links back up the hierarchy, then the selected period itself
+            parts = value.split("-")
+            for depth in range(1, len(parts)):
+                parent = "-".join(parts[:depth])
+                choices.append((parent, f"‹ {parent}"))
+            choices.append((value, value))
+            rows = rows.filter(hour__gte=start, hour__lt=end)
+        if kind is None:
+            return choices
+        for period in rows.datetimes("hour", kind, tzinfo=tz):
+            label = {
+                "year": f"{period:%Y}",
+                "month": f"{period:%Y-%m}",
+                "day": f"{period:%Y-%m-%d}",
+            }[kind]
+            choices.append((label, label))
+        return choices
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        try:
+            start, end, _ = self._bounds(value)
+        except ValueError:
+            raise IncorrectLookupParameters
+        return queryset.filter(timestamp__gte=start, timestamp__lt=end)
+
+
+class ClickRollupDateFilter(RollupDateFilter):
+    rollup_field = "clicks"
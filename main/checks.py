@@ -0,0 +1,36 @@
+"""System checks of the production settings, run by ``manage.py check --deploy``."""
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHES = ("FileBasedCache", "LocMemCache")
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # Rate-limit buckets, visit mappings and QR codes must outlive a worker
+    # and be seen by all of them
+    if settings.CACHES["default"]["BACKEND"].endswith(LOCAL_CACHES):
+        return [
+            Warning(
+                "The default cache is local to this machine and slows down as it fills.",
+                hint="Set CACHE_URL to Redis, e.g. redis://127.0.0.1:6379/1.",
+                id="main.W001",
+            )
+        ]
+    return []
+
+
+@register(deploy=True)
+def check_client_ip_header(app_configs, **kwargs):
+    per_ip = any("ip" in limits for limits in settings.RATE_LIMITS.values())
+    if settings.RATE_LIMIT_ENABLED and per_ip and not settings.CLIENT_IP_HEADER:
+        return [
+            Warning(
+                "Per-IP rate limits are off because CLIENT_IP_HEADER is not set.",
+                hint="Set CLIENT_IP_HEADER to the header your reverse proxy puts "
+                "the client address in, e.g. X-Real-IP.",
+                id="main.W002",
+            )
+        ]
+    return []
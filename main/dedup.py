@@ -0,0 +1,127 @@
+"""Lookups over the fingerprints of stored catalog images."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from django.db.models import Q
+
+from .images import PHASH_BANDS, hamming, phash_bands
+from .models import ImageFingerprint
+
+# Upload directories whose files are fingerprinted and shared
+DEDUP_PREFIXES = ("categories/", "furniture/", "furniture_gallery/")
+# Largest distance the band index is guaranteed to find
+MAX_SIMILAR_DISTANCE = PHASH_BANDS - 1
+
+
+def tracked(name: str) -> bool:
+    return name.startswith(DEDUP_PREFIXES)
+
+
+def band_fields(phash: str) -> dict:
+    bands = phash_bands(phash) if phash else [""] * PHASH_BANDS
+    return {f"phash_band{i}": band for i, band in enumerate(bands)}
+
+
+def build(name: str, sha256: str, phash: str, size: int) -> ImageFingerprint:
+    return ImageFingerprint(
+        name=name, sha256=sha256, phash=phash, size=size, **band_fields(phash)
+    )
+
+
+def record(name: str, sha256: str, phash: str, size: int) -> None:
+    ImageFingerprint.objects.update_or_create(
+        name=name,
+        defaults={"sha256": sha256, "phash": phash, "size": size, **band_fields(phash)},
+    )
+
+
+def forget(name: str) -> None:
+    ImageFingerprint.objects.filter(name=name).delete()
+
+
+def find_existing(sha256: str, storage) -> Optional[str]:
+    """Name of a stored file with exactly this content, if any."""
+    for name in ImageFingerprint.objects.filter(sha256=sha256).values_list(
+        "name", flat=True
+    ):
+        if storage.exists(name):
+            return name
+    return None
+
+
+def find_similar(phash: str, max_distance: int = MAX_SIMILAR_DISTANCE) -> list:
+    """``[(distance, fingerprint)]`` of images perceptually close to ``phash``.
+
+    Only rows sharing a band with ``phash`` are read, which by the pigeonhole
+    principle includes every hash within ``MAX_SIMILAR_DISTANCE`` bits.
+    """
+    if not phash:
+        return []
+    condition = Q()
+    for field, band in band_fields(phash).items():
+        condition |= Q(**{field: band})
+    matches = []
+    for fingerprint in ImageFingerprint.objects.filter(condition):
+        distance = hamming(phash, fingerprint.phash)
+        if distance <= max_distance:
+            matches.append((distance, fingerprint))
+    matches.sort(key=lambda match: (match[0], match[1].name))
+    return matches
+
+
+def near_duplicates(names, max_distance: int = MAX_SIMILAR_DISTANCE) -> dict:
+    """``{name: [similar names]}`` for stored files that look like other files.
+
+    Files with the same content are left out: the storage already shares them.
+    """
+    found = {}
+    for fingerprint in ImageFingerprint.objects.filter(name__in=names).exclude(phash=""):
+        similar = [
+            match.name
+            for _, match in find_similar(fingerprint.phash, max_distance)
+            if match.sha256 != fingerprint.sha256
+        ]
+        if similar:
+            found[fingerprint.name] = similar
+    return found
+
+
+def similar_groups(fingerprints, max_distance: int = MAX_SIMILAR_DISTANCE) -> list:
+    """Cluster fingerprints of different content that look alike.
+
+    Same band-bucket idea as :func:`find_similar`, kept in memory for a
+    full pass over the media library. Returns lists of fingerprints.
+    """
+    fingerprints = [fp for fp in fingerprints if fp.phash]
+    buckets = {}
+    for index, fingerprint in enumerate(fingerprints):
+        for i, band in enumerate(phash_bands(fingerprint.phash)):
+            buckets.setdefault((i, band), []).append(index)
+
+    parent = list(range(len(fingerprints)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for members in buckets.values():
+        for a_pos, a in enumerate(members):
+            for b in members[a_pos + 1 :]:
+                first, second = fingerprints[a], fingerprints[b]
+                if first.sha256 == second.sha256:
+                    continue
+                if hamming(first.phash, second.phash) <= max_distance:
+                    parent[root(a)] = root(b)
+
+    groups = {}
+    for index, fingerprint in enumerate(fingerprints):
+        groups.setdefault(root(index), []).append(fingerprint)
+    return [
+        group
+        for group in groups.values()
+        if len({fingerprint.sha256 for fingerprint in group}) > 1
+    ]
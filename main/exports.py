@@ -0,0 +1,160 @@
+"""Streaming export of raw scans with their phone-click counts."""
+
+from __future__ import annotations
+
+import csv
+import json
+import zlib
+from typing import Iterable, Iterator
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import PhoneClick, QRCodeScan
+
+EXPORT_FIELDS = (
+    "id",
+    "timestamp",
+    "location_id",
+    "location_name",
+    "ip_address",
+    "user_agent",
+    "visit_id",
+    "phone_clicks",
+)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+# Spreadsheets evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+# Rows fetched per round trip of the server-side cursor
+CHUNK_SIZE = 2000
+# Encoded bytes collected before a chunk is handed to the WSGI server
+FLUSH_BYTES = 64 * 1024
+
+
+def export_rows(queryset=None) -> Iterator[tuple]:
+    """Yield export tuples for ``queryset`` (all scans by default).
+
+    Click counts come from a correlated subquery rather than a GROUP BY, so
+    the database can stream rows in primary key order instead of
+    aggregating the whole range first. ``iterator()`` uses a server-side
+    cursor on PostgreSQL, keeping memory constant.
+    """
+    if queryset is None:
+        queryset = QRCodeScan.objects.all()
+    clicks = (
+        PhoneClick.objects.filter(scan=OuterRef("pk"))
+        .order_by()
+        .values("scan")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    rows = (
+        queryset.order_by("id")
+        .annotate(
+            phone_click_count=Coalesce(
+                Subquery(clicks, output_field=IntegerField()), 0
+            )
+        )
+        .values_list(
+            "id",
+            "timestamp",
+            "location_id",
+            "location__name",
+            "ip_address",
+            "user_agent",
+            "visit_id",
+            "phone_click_count",
+        )
+    )
+    return rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the value (for ``csv.writer``)."""
+
+    def write(self, value):
+        return value
+
+
+def _text_cell(value: str) -> str:
+    """Client-supplied text, quoted so Excel does not run it as a formula."""
+    if value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _encode_csv(rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield "\ufeff" + writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(
+            (
+                row[0],
+                row[1].isoformat(),
+                row[2],
+                _text_cell(row[3]),
+                row[4],
+                _text_cell(row[5]),
+                row[6] or "",
+                row[7],
+            )
+        )
+
+
+def _encode_ndjson(rows: Iterable[tuple]) -> Iterator[str]:
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record["timestamp"] = row[1].isoformat()
+        record["visit_id"] = str(row[6]) if row[6] else None
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def encode(rows: Iterable[tuple], fmt: str, *, compress: bool = False) -> Iterator[bytes]:
+    """Serialize rows to ``fmt`` in buffered chunks, optionally gzipped."""
+    lines = _encode_csv(rows) if fmt == "csv" else _encode_ndjson(rows)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer: list[bytes] = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    chunk = b"".join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def accepts_gzip(request) -> bool:
+    return "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+
+
+def export_response(queryset, fmt: str, *, compress: bool) -> StreamingHttpResponse:
+    """Streaming download of ``queryset`` as CSV or NDJSON."""
+    content_type, extension = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(
+        encode(export_rows(queryset), fmt, compress=compress),
+        content_type=content_type,
+    )
+    filename = f"scans_{timezone.now():%Y%m%d_%H%M%S}.{extension}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["Vary"] = "Accept-Encoding"
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    return response
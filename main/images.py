@@ -0,0 +1,192 @@
+"""Image normalisation and derivative generation for catalog photos.
+
+The processing functions only use Pillow and plain bytes, so they can run
+in worker processes without touching Django.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from io import BytesIO
+from typing import Iterable
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Longest side of the stored original and of each derivative, in pixels
+MAX_ORIGINAL_SIZE = 2000
+DERIVATIVE_SIZES = {
+    "thumb": 400,
+    "medium": 1200,
+}
+JPEG_QUALITY = 85
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+# The 64-bit perceptual hash is indexed as this many equal bands; two hashes
+# within ``PHASH_BANDS - 1`` bits of each other share at least one band.
+PHASH_BANDS = 4
+
+
+def file_hash(path) -> str:
+    """SHA-256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_sha256(file) -> str:
+    """SHA-256 of a Django ``File`` (e.g. an upload), read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def perceptual_hash(image: Image.Image) -> str:
+    """64-bit difference hash (dHash) as 16 hex digits.
+
+    Each bit compares two horizontally adjacent pixels of a 9×8 grayscale
+    thumbnail, so re-encoding, resizing or small edits flip only a few bits.
+    """
+    small = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = bits << 1 | (left > right)
+    return f"{bits:016x}"
+
+
+def phash_bands(phash: str) -> list[str]:
+    width = len(phash) // PHASH_BANDS
+    return [phash[i * width : (i + 1) * width] for i in range(PHASH_BANDS)]
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def fingerprint_bytes(data: bytes) -> tuple[str, str]:
+    """``(sha256, perceptual hash)``; the latter is '' for non-images."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(BytesIO(data)) as image:
+            phash = perceptual_hash(ImageOps.exif_transpose(image))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        phash = ""
+    return sha256, phash
+
+
+def fingerprint_file(path: str) -> dict:
+    """Worker entry point: fingerprint one stored file."""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    sha256, phash = fingerprint_bytes(data)
+    return {"sha256": sha256, "phash": phash, "size": len(data)}
+
+
+def _encode_jpeg(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(
+        buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+    )
+    return buffer.getvalue()
+
+
+def _fit(image: Image.Image, size: int) -> Image.Image:
+    if max(image.size) <= size:
+        return image
+    resized = image.copy()
+    resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return resized
+
+
+def normalize_image(data: bytes) -> tuple[Image.Image, bytes]:
+    """Apply EXIF orientation, convert to RGB and re-encode as a bounded JPEG."""
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode != "RGB":
+            # Flatten transparency onto white rather than black
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+        image = _fit(image, MAX_ORIGINAL_SIZE)
+        image.load()
+    return image, _encode_jpeg(image)
+
+
+def process_image_file(path: str, content_hash: str) -> dict:
+    """Worker entry point: normalise one photo and render its derivatives.
+
+    Unreadable files are reported through an ``"error"`` key instead of
+    raising, so one corrupt photo does not abort a whole import.
+    """
+    try:
+        with open(path, "rb") as fp:
+            data = fp.read()
+        image, original = normalize_image(data)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        return {"path": path, "content_hash": content_hash, "error": str(exc)}
+    return {
+        "path": path,
+        "content_hash": content_hash,
+        "original": original,
+        "derivatives": render_derivatives(image),
+    }
+
+
+def render_derivatives(image: Image.Image) -> dict[str, bytes]:
+    return {
+        name: _encode_jpeg(_fit(image, size))
+        for name, size in DERIVATIVE_SIZES.items()
+    }
+
+
+def derivative_name(content_hash: str, size: str) -> str:
+    """Storage name of a derivative; derived from the content hash only."""
+    return f"derivatives/{size}/{content_hash[:2]}/{content_hash}.jpg"
+
+
+def derivative_url(content_hash: str, size: str) -> str:
+    return default_storage.url(derivative_name(content_hash, size))
+
+
+def save_derivatives(content_hash: str, derivatives: dict[str, bytes]) -> None:
+    """Store rendered derivatives unless a previous run already did."""
+    for size, data in derivatives.items():
+        name = derivative_name(content_hash, size)
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(data))
+
+
+def ensure_derivatives(content_hash: str, file) -> None:
+    """Render and store the derivatives of an uploaded image if missing."""
+    if all(
+        default_storage.exists(derivative_name(content_hash, size))
+        for size in DERIVATIVE_SIZES
+    ):
+        return
+    data = b"".join(file.chunks())
+    file.seek(0)
+    try:
+        image, _ = normalize_image(data)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return
+    save_derivatives(content_hash, render_derivatives(image))
+
+
+def iter_image_files(paths: Iterable) -> list:
+    return sorted(
+        path
+        for path in paths
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+    )
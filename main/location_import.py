@@ -0,0 +1,210 @@
+"""Bulk creation of locations from a CSV or XLSX sheet.
+
+One row per location, with a header row naming the columns:
+
+* ``name`` (``название``), required;
+* ``description`` (``описание``);
+* ``phones`` (``телефоны``): phone numbers of the users the location is
+  shared with, separated by ``;`` or ``,``.
+
+Phones are matched on their 9-digit national number, so
+``+998 (90) 356-43-34`` and ``90 356 43 34`` are the same user. Locations whose name already
+exists are skipped, so an interrupted import can be run again. Locations
+and their user links are written with ``bulk_create`` in batches.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import re
+import time
+from dataclasses import dataclass, field
+
+from django.db import transaction
+
+from users.models import CustomUser
+
+from . import qrcodes
+from .models import Location
+
+COLUMNS = {
+    "name": ("name", "название"),
+    "description": ("description", "описание"),
+    "phones": ("phones", "phone", "телефоны", "телефон"),
+}
+PHONE_SEPARATORS = re.compile(r"[;,\n]")
+# Length of an Uzbek national number, without the +998 country code
+PHONE_DIGITS = 9
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: list = field(default_factory=list)
+    links: int = 0
+    # (line, message) of skipped rows and unmatched phones, in row order
+    problems: list = field(default_factory=list)
+    # phase: seconds
+    timings: dict = field(default_factory=dict)
+
+    def timed(self, phase, started):
+        self.timings[phase] = time.monotonic() - started
+
+
+def phone_key(phone: str) -> str:
+    """National number of ``phone``, ``""`` when it has too few digits."""
+    digits = re.sub(r"\D", "", phone)
+    return digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else ""
+
+
+def read_rows(fp, filename: str) -> list[dict]:
+    """``[{"line", "name", "description", "phones"}]`` of a CSV or XLSX upload.
+
+    Raises ``ValueError`` for unreadable files and missing columns.
+    """
+    if filename.lower().endswith(".xlsx"):
+        table = _xlsx_table(fp)
+    else:
+        table = _csv_table(fp)
+    header = next(table, None)
+    if header is None:
+        raise ValueError("The file is empty")
+    positions = {}
+    labels = [str(cell or "").strip().lower() for cell in header]
+    for column, aliases in COLUMNS.items():
+        for position, label in enumerate(labels):
+            if label in aliases:
+                positions[column] = position
+                break
+    if "name" not in positions:
+        raise ValueError("The header has no 'name' column")
+
+    rows = []
+    for line, cells in enumerate(table, 2):
+        values = {
+            column: str(cells[position] or "").strip() if position < len(cells) else ""
+            for column, position in positions.items()
+        }
+        if not any(values.values()):
+            continue
+        rows.append(
+            {
+                "line": line,
+                "name": values["name"],
+                "description": values.get("description", ""),
+                "phones": [
+                    phone.strip()
+                    for phone in PHONE_SEPARATORS.split(values.get("phones", ""))
+                    if phone.strip()
+                ],
+            }
+        )
+    return rows
+
+
+def _csv_table(fp):
+    data = fp.read()
+    if isinstance(data, bytes):
+        try:
+            data = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            data = data.decode("cp1251")  # Excel's "CSV" on Russian Windows
+    try:
+        dialect = csv.Sniffer().sniff(data[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(data), dialect)
+
+
+def _xlsx_table(fp):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Reading XLSX files requires openpyxl (pip install openpyxl)")
+    try:
+        workbook = load_workbook(fp, read_only=True, data_only=True)
+    except Exception as exc:  # zipfile and XML errors of a broken upload
+        raise ValueError(f"Not a readable XLSX file: {exc}")
+    # A read-only workbook keeps the file open until it is closed
+    try:
+        return iter(list(workbook.active.iter_rows(values_only=True)))
+    finally:
+        workbook.close()
+
+
+def import_file(fp, filename, site_url=None, batch_size=500, workers=None) -> ImportReport:
+    """Read, import and pre-render the QR codes (for ``site_url``) of a sheet.
+
+    Raises ``ValueError`` for unreadable files, before anything is written.
+    """
+    report = ImportReport()
+    started = time.monotonic()
+    rows = read_rows(fp, filename)
+    report.rows = len(rows)
+    report.timed("read", started)
+    import_locations(rows, batch_size, report)
+    if site_url and report.created:
+        started = time.monotonic()
+        qrcodes.prerender(site_url, report.created, workers)
+        report.timed("qr codes", started)
+    return report
+
+
+def import_locations(rows, batch_size: int = 500, report=None) -> ImportReport:
+    """Create the locations of :func:`read_rows` and link their users."""
+    report = report or ImportReport(rows=len(rows))
+
+    started = time.monotonic()
+    users = {}
+    for user_id, phone in CustomUser.objects.exclude(phone_number="").values_list(
+        "id", "phone_number"
+    ):
+        users.setdefault(phone_key(phone), []).append(user_id)
+    existing = set(Location.objects.values_list("name", flat=True))
+    max_length = Location._meta.get_field("name").max_length
+    planned = []
+    for row in rows:
+        if not row["name"]:
+            report.problems.append((row["line"], "no name"))
+            continue
+        if len(row["name"]) > max_length:
+            report.problems.append((row["line"], f"name longer than {max_length} characters"))
+            continue
+        if row["name"] in existing:
+            report.problems.append((row["line"], f"{row['name']!r} already exists"))
+            continue
+        existing.add(row["name"])
+        user_ids = []
+        for phone in row["phones"]:
+            key = phone_key(phone)
+            matches = users.get(key, []) if key else []
+            if len(matches) != 1:
+                problem = "no user" if not matches else f"{len(matches)} users"
+                report.problems.append((row["line"], f"{problem} with phone {phone}"))
+                continue
+            user_ids.extend(matches)
+        planned.append(
+            (Location(name=row["name"], description=row["description"]), user_ids)
+        )
+    report.timed("match", started)
+
+    started = time.monotonic()
+    Link = Location.user.through
+    for offset in range(0, len(planned), batch_size):
+        batch = planned[offset : offset + batch_size]
+        with transaction.atomic():
+            # Primary keys are set on PostgreSQL and SQLite 3.35+
+            created = Location.objects.bulk_create(location for location, _ in batch)
+            links = Link.objects.bulk_create(
+                (
+                    Link(location_id=location.pk, customuser_id=user_id)
+                    for location, (_, user_ids) in zip(created, batch)
+                    for user_id in dict.fromkeys(user_ids)
+                ),
+                batch_size=batch_size,
+            )
+        report.created.extend(created)
+        report.links += len(links)
+    report.timed("write", started)
+    return report
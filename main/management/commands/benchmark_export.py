@@ -0,0 +1,99 @@
+import time
+import tracemalloc
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main import exports
+from main.models import Location, PhoneClick, QRCodeScan
+
+
+class Command(BaseCommand):
+    help = "Measure throughput and memory of the streaming scan export"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=sorted(exports.EXPORT_FORMATS), default="csv"
+        )
+        parser.add_argument(
+            "--gzip", action="store_true", help="Compress the stream like the API does"
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Insert this many synthetic scans first; they are rolled back afterwards",
+        )
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            help="Report peak Python memory (slows the run down)",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["seed"]:
+                self._seed(options["seed"])
+            self._run(options)
+            # Never keep the synthetic rows
+            transaction.set_rollback(True)
+
+    def _seed(self, count):
+        location = Location.objects.order_by("id").first()
+        if location is None:
+            raise CommandError("Create at least one location before seeding scans")
+        started = time.monotonic()
+        batch = 5000
+        for offset in range(0, count, batch):
+            scans = QRCodeScan.objects.bulk_create(
+                QRCodeScan(
+                    location=location,
+                    ip_address="127.0.0.1",
+                    user_agent="benchmark",
+                    visit_id=uuid.uuid4(),
+                )
+                for _ in range(min(batch, count - offset))
+            )
+            PhoneClick.objects.bulk_create(
+                PhoneClick(scan=scan) for scan in scans[::10]
+            )
+        self.stdout.write(
+            f"Seeded {count} scans in {time.monotonic() - started:.2f}s"
+        )
+
+    def _run(self, options):
+        if options["trace_memory"]:
+            tracemalloc.start()
+        rows = 0
+
+        def counted(source):
+            nonlocal rows
+            for row in source:
+                rows += 1
+                yield row
+
+        started = time.monotonic()
+        first_chunk = None
+        total_bytes = 0
+        for chunk in exports.encode(
+            counted(exports.export_rows()), options["format"], compress=options["gzip"]
+        ):
+            if first_chunk is None:
+                first_chunk = time.monotonic() - started
+            total_bytes += len(chunk)
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {rows} rows, {total_bytes / 1e6:.2f} MB "
+                f"({options['format']}{', gzip' if options['gzip'] else ''}) "
+                f"in {elapsed:.2f}s: {rows / elapsed if elapsed else 0:.0f} rows/s, "
+                f"{total_bytes / 1e6 / elapsed if elapsed else 0:.2f} MB/s, "
+                f"first chunk after {(first_chunk or 0) * 1000:.0f} ms"
+            )
+        )
+        if options["trace_memory"]:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f"Peak Python memory: {peak / 1e6:.1f} MB")
@@ -0,0 +1,117 @@
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main import search
+from main.models import FurnitureCategory, FurnitureItem
+
+KINDS = ["Шкаф", "Кровать", "Комод", "Тумба", "Стол", "Стул", "Диван", "Кресло", "Стеллаж", "Полка"]
+STYLES = ["классический", "современный", "лофт", "минимализм", "скандинавский", "детский", "офисный"]
+COLORS = ["белый", "дуб", "орех", "венге", "серый", "черный", "бежевый"]
+MATERIALS = ["ЛДСП", "МДФ", "массив дуба", "металл", "стекло", "экокожа", "ткань", "шпон"]
+PHRASES = [
+    "вместительный и удобный",
+    "для спальни и гостиной",
+    "с плавным закрыванием",
+    "подходит для небольших комнат",
+    "прочная фурнитура",
+    "легко собирается",
+    "с зеркалом",
+    "на заказ по вашим размерам",
+]
+QUERIES = ["шкаф", "шкафы купе", "белый комод", "дуб", "кровать с", "детский стол", "зеркал", "офисное кресло"]
+
+
+class Command(BaseCommand):
+    help = "Measure index build time, memory and query latency of the catalog search"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--items",
+            type=int,
+            default=50000,
+            help="Synthetic items to insert first; they are rolled back afterwards (0 uses the real catalog)",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=20, help="Times each query is run"
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Random seed")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["items"]:
+                self._seed(options["items"], random.Random(options["seed"]))
+            self._run(options)
+            # Never keep the synthetic rows
+            transaction.set_rollback(True)
+
+    def _seed(self, count, rng):
+        started = time.monotonic()
+        categories = FurnitureCategory.objects.bulk_create(
+            FurnitureCategory(name=f"Бенчмарк {kind}", slug=f"benchmark-{i}")
+            for i, kind in enumerate(KINDS)
+        )
+        batch = 5000
+        for offset in range(0, count, batch):
+            items = []
+            for n in range(offset, min(offset + batch, count)):
+                kind = rng.randrange(len(KINDS))
+                price = rng.choice([None, Decimal(rng.randrange(300, 20000) * 1000)])
+                items.append(
+                    FurnitureItem(
+                        category=categories[kind],
+                        name=f"{KINDS[kind]} {rng.choice(STYLES)} {rng.choice(COLORS)} {n}",
+                        slug=f"benchmark-item-{n}",
+                        description=" ".join(rng.sample(PHRASES, 3)),
+                        materials=", ".join(rng.sample(MATERIALS, rng.randint(1, 3))),
+                        price=price,
+                        discount_price=price * Decimal("0.9") if price and rng.random() < 0.2 else None,
+                        main_image="furniture/benchmark.jpg",
+                    )
+                )
+            FurnitureItem.objects.bulk_create(items)
+        self.stdout.write(f"Seeded {count} items in {time.monotonic() - started:.2f}s")
+
+    def _run(self, options):
+        started = time.monotonic()
+        index = search.CatalogIndex.build(search.catalog_version())
+        build = time.monotonic() - started
+        # Built a second time for the memory figure; tracing slows it down
+        tracemalloc.start()
+        search.CatalogIndex.build(search.catalog_version())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"Indexed {len(index.ids)} items, {len(index.postings)} terms in "
+            f"{build:.2f}s (peak {peak / 1e6:.1f} MB)"
+        )
+
+        started = time.monotonic()
+        for _ in range(options["repeat"]):
+            search.catalog_version()
+        version_ms = (time.monotonic() - started) * 1000 / options["repeat"]
+        self.stdout.write(f"Version check: {version_ms:.2f} ms")
+
+        cases = [(query, {}) for query in QUERIES]
+        cases.append(("", {}))
+        cases.append(("шкаф", {"band": "1m-3m", "material": "лдсп"}))
+        for query, filters in cases:
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                result = index.search(query, **filters)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            label = query or "(all)"
+            if filters:
+                label += " " + " ".join(f"{key}={value}" for key, value in filters.items())
+            self.stdout.write(
+                f"{label:<36} {result.total:>7} hits  "
+                f"p50 {statistics.median(timings):7.2f} ms  p95 {p95:7.2f} ms"
+            )
@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from main import routers
+from main.models import QRCodeScan
+
+
+class Command(BaseCommand):
+    help = (
+        "Show how each database alias connects (persistent or pooled), its "
+        "round-trip time, and whether stats reads currently go to the replica"
+    )
+
+    def handle(self, *args, **options):
+        for alias, config in settings.DATABASES.items():
+            pool = (config.get("OPTIONS") or {}).get("pool")
+            if pool:
+                reuse = f"pool {pool.get('min_size', 4)}-{pool.get('max_size', 'unbounded')}"
+            elif config.get("CONN_MAX_AGE") is None:
+                reuse = "persistent, unlimited"
+            else:
+                reuse = f"persistent {config.get('CONN_MAX_AGE', 0)}s"
+            if config.get("CONN_HEALTH_CHECKS"):
+                reuse += ", health checks"
+            try:
+                started = time.perf_counter()
+                with connections[alias].cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                status = f"{(time.perf_counter() - started) * 1000:.1f} ms"
+            except DatabaseError as exc:
+                status = self.style.ERROR(f"unreachable: {exc}")
+            self.stdout.write(f"{alias}: {connections[alias].vendor}, {reuse}, {status}")
+
+        if not routers.configured():
+            self.stdout.write("No replica configured; all reads go to the primary")
+            return
+        lag = routers.replica_lag()
+        if lag is None:
+            self.stdout.write(self.style.ERROR("Replica unreachable; stats reads use the primary"))
+            return
+        self.stdout.write(
+            f"Replica lag: {lag:.2f}s (limit {settings.DB_REPLICA_MAX_LAG}s)"
+        )
+        with routers.replica_reads():
+            used = QRCodeScan.objects.all().db
+        style = self.style.SUCCESS if used == routers.REPLICA else self.style.WARNING
+        self.stdout.write(style(f"Stats reads go to: {used}"))
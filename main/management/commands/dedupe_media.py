@@ -0,0 +1,179 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from main import dedup
+from main.images import fingerprint_file, hamming
+from main.models import FurnitureCategory, FurnitureImage, FurnitureItem, ImageFingerprint
+
+# (model, file field) pairs that reference catalog media
+IMAGE_FIELDS = [
+    (FurnitureCategory, "image"),
+    (FurnitureItem, "main_image"),
+    (FurnitureImage, "image"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fingerprint existing catalog media and report exact and near-duplicate "
+        "images. With --apply, rows are pointed at one copy of each identical "
+        "file and the redundant copies are deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--apply",
+            action="store_true",
+            help="Merge exact duplicates and delete the redundant files",
+        )
+        parser.add_argument(
+            "--delete-orphans",
+            action="store_true",
+            help="With --apply, also delete catalog files no row references",
+        )
+        parser.add_argument(
+            "--distance",
+            type=int,
+            default=dedup.MAX_SIMILAR_DISTANCE,
+            help="Maximum perceptual hash distance (bits) for near-duplicates",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of processes used to fingerprint files",
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options["distance"] <= dedup.MAX_SIMILAR_DISTANCE:
+            raise CommandError(
+                f"--distance must be between 0 and {dedup.MAX_SIMILAR_DISTANCE}"
+            )
+
+        self._fingerprint(self._list_files(), options["workers"])
+        references = self._references()
+        fingerprints = list(ImageFingerprint.objects.order_by("name"))
+
+        by_content = defaultdict(list)
+        for fingerprint in fingerprints:
+            by_content[fingerprint.sha256].append(fingerprint)
+        exact = [group for group in by_content.values() if len(group) > 1]
+        wasted = sum(fp.size for group in exact for fp in group[1:])
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Exact duplicates"))
+        for group in exact:
+            canonical = self._canonical(group, references)
+            self.stdout.write(f"  {canonical.name}")
+            for fingerprint in group:
+                if fingerprint is not canonical:
+                    self.stdout.write(
+                        f"    = {fingerprint.name} "
+                        f"({len(references.get(fingerprint.name, []))} references)"
+                    )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Near duplicates"))
+        near = dedup.similar_groups(fingerprints, options["distance"])
+        for group in near:
+            first = group[0]
+            self.stdout.write(f"  {first.name}")
+            for fingerprint in group[1:]:
+                distance = hamming(first.phash, fingerprint.phash)
+                self.stdout.write(f"    ~ {fingerprint.name} (distance {distance})")
+
+        orphans = [fp for fp in fingerprints if fp.name not in references]
+        self.stdout.write(
+            f"{len(fingerprints)} files, {len(exact)} exact duplicate groups "
+            f"({wasted / 1024 / 1024:.1f} MB redundant), {len(near)} near-duplicate "
+            f"groups, {len(orphans)} unreferenced files"
+        )
+
+        if not options["apply"]:
+            self.stdout.write("Dry run; pass --apply to merge exact duplicates.")
+            return
+
+        removed = self._merge(exact, references)
+        if options["delete_orphans"]:
+            for fingerprint in orphans:
+                if default_storage.exists(fingerprint.name):
+                    default_storage.delete(fingerprint.name)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(f"Deleted {removed} redundant files"))
+
+    def _list_files(self):
+        names = []
+        pending = [prefix.rstrip("/") for prefix in dedup.DEDUP_PREFIXES]
+        while pending:
+            directory = pending.pop()
+            if not default_storage.exists(directory):
+                continue
+            subdirs, files = default_storage.listdir(directory)
+            pending.extend(f"{directory}/{subdir}" for subdir in subdirs)
+            names.extend(f"{directory}/{file}" for file in files)
+        return names
+
+    def _fingerprint(self, names, workers):
+        # Drop fingerprints of files removed outside the storage API
+        ImageFingerprint.objects.exclude(name__in=names).delete()
+        known = set(ImageFingerprint.objects.values_list("name", flat=True))
+        missing = [name for name in names if name not in known]
+        if not missing:
+            return
+        self.stdout.write(f"Fingerprinting {len(missing)} files...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                fingerprint_file,
+                [default_storage.path(name) for name in missing],
+                chunksize=16,
+            )
+            ImageFingerprint.objects.bulk_create(
+                (
+                    dedup.build(name, result["sha256"], result["phash"], result["size"])
+                    for name, result in zip(missing, results)
+                ),
+                batch_size=500,
+            )
+
+    def _references(self):
+        """``{file name: [(model, field, pk)]}`` for every catalog image row."""
+        references = defaultdict(list)
+        for model, field in IMAGE_FIELDS:
+            for pk, name in model.objects.exclude(**{field: ""}).values_list("pk", field):
+                if name:
+                    references[name].append((model, field, pk))
+        return references
+
+    def _canonical(self, group, references):
+        # Prefer a referenced file, then the name without a random suffix
+        return min(
+            group,
+            key=lambda fp: (fp.name not in references, len(fp.name), fp.name),
+        )
+
+    def _merge(self, exact, references):
+        removed = 0
+        for group in exact:
+            canonical = self._canonical(group, references)
+            duplicates = [fp.name for fp in group if fp is not canonical]
+            with transaction.atomic():
+                # Touched so the catalog ETags, the static export and the
+                # search index stop serving URLs of the deleted copies
+                now = timezone.now()
+                for model, field in IMAGE_FIELDS:
+                    rows = model.objects.filter(**{f"{field}__in": duplicates})
+                    if model is FurnitureImage:
+                        # Gallery images have no timestamp; their item's counts
+                        FurnitureItem.objects.filter(images__in=rows).update(updated_at=now)
+                        rows.update(**{field: canonical.name})
+                    else:
+                        rows.update(**{field: canonical.name}, updated_at=now)
+            for name in duplicates:
+                default_storage.delete(name)
+                self.stdout.write(f"Merged {name} into {canonical.name}")
+                removed += 1
+        return removed
@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.static_export import StaticExporter, affected_paths, all_pages, brotli
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the catalog (categories and items) to static HTML with .gz/.br "
+        "siblings. By default only pages affected by changes "
+        "since the last build are rendered; see main/static_export.py for nginx."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=str(settings.BASE_DIR / "static_catalog"),
+            help="Directory the pages are written to",
+        )
+        parser.add_argument(
+            "--full", action="store_true", help="Render every page, not only changed ones"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4, help="Number of rendering threads"
+        )
+        parser.add_argument(
+            "--base-url",
+            default=settings.SITE_URL,
+            help="Host (and scheme) absolute URLs in the pages are built with",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        exporter = StaticExporter(options["output"], options["base_url"])
+        manifest = exporter.load_manifest()
+        hashes = manifest.get("pages", {})
+        # Taken before querying so changes made during the build are
+        # picked up by the next one
+        build_time = timezone.now()
+
+        pages = all_pages()
+        last_build = parse_datetime(manifest.get("built_at", "")) if manifest else None
+        if options["full"] or last_build is None:
+            todo = set(pages)
+        else:
+            todo = (affected_paths(last_build) | (pages.keys() - hashes.keys())) & pages.keys()
+        removed = sorted(hashes.keys() - pages.keys())
+
+        todo = sorted(todo)
+        chunk_size = max(1, min(25, len(todo) // (options["workers"] * 4) or 1))
+        chunks = [todo[i : i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        written = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for results in pool.map(
+                lambda chunk: exporter.build_chunk(chunk, pages, hashes), chunks
+            ):
+                for path, digest, changed in results:
+                    hashes[path] = digest
+                    written += changed
+
+        for path in removed:
+            exporter.remove(path)
+            hashes.pop(path, None)
+
+        exporter.save_manifest({"built_at": build_time.isoformat(), "pages": hashes})
+
+        if brotli is None:
+            self.stdout.write(
+                self.style.WARNING("brotli is not installed; only .gz siblings were written")
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered {len(todo)} of {len(pages)} pages, wrote {written}, "
+                f"removed {len(removed)} in {time.monotonic() - started:.2f}s "
+                f"→ {options['output']}"
+            )
+        )
@@ -0,0 +1,256 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from main.catalog_import import SlugRegistry, categories_by_name, iter_category_items
+from main.images import file_hash, iter_image_files, process_image_file, save_derivatives
+from main.models import FurnitureCategory, FurnitureImage, FurnitureItem
+
+# Photo folders shipped with the project: folder -> (category, item name prefix).
+# The prefixes match the "old_name" keys of all_files.json.
+FOLDER_CATEGORIES = {
+    "detskaya mebel": ("Детская мебель", "children_furniture"),
+    "ofisnaya mebel": ("Офисная мебель", "office_furniture"),
+    "pod_tv": ("Под ТВ", "pod_tv"),
+    "spalni": ("Спальни", "spalni"),
+    "shkaf": ("Шкафы", "shkaf"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Import furniture photos from category folders. Each image becomes an item; "
+        "a sub-folder becomes one item whose first image is the main one and the "
+        "rest its gallery. Re-running skips photos already imported (by content hash)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("root", type=str, help="Directory containing the category folders")
+        parser.add_argument(
+            "--folder",
+            action="append",
+            dest="folders",
+            help="Only import this folder (can be repeated); unknown folders use their name as category",
+        )
+        parser.add_argument(
+            "--metadata",
+            type=str,
+            help="JSON file in the all_files.json format to take names and descriptions from",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of image processing processes",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Items written per transaction; a crash loses at most one batch",
+        )
+
+    def handle(self, *args, **options):
+        root = Path(options["root"])
+        if not root.is_dir():
+            raise CommandError(f"Directory {root} does not exist")
+        self.batch_size = options["batch_size"]
+        timings = {}
+
+        started = time.monotonic()
+        folders = self._collect(root, options["folders"])
+        metadata = self._load_metadata(options["metadata"])
+        timings["scan"] = time.monotonic() - started
+
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            started = time.monotonic()
+            paths = [
+                path
+                for _, _, items in folders
+                for _, item_paths in items
+                for path in item_paths
+            ]
+            hashes = dict(zip(paths, pool.map(file_hash, paths, chunksize=16)))
+            existing = set(
+                FurnitureItem.objects.filter(
+                    content_hash__in=set(hashes.values())
+                ).values_list("content_hash", flat=True)
+            )
+            timings["hash"] = time.monotonic() - started
+
+            started = time.monotonic()
+            categories = self._ensure_categories(folders)
+            self.slugs = SlugRegistry()
+            tasks = []
+            skipped = 0
+            for folder, (category_name, prefix), items in folders:
+                for name, item_paths in items:
+                    if hashes[item_paths[0]] in existing:
+                        skipped += 1
+                        continue
+                    new_name, description = metadata.get(
+                        (category_name, name), (name, "")
+                    )
+                    tasks.append(
+                        (categories[category_name], new_name, description, name, item_paths)
+                    )
+            timings["plan"] = time.monotonic() - started
+
+            started = time.monotonic()
+            todo = [path for task in tasks for path in task[4]]
+            results = pool.map(
+                process_image_file,
+                [str(path) for path in todo],
+                [hashes[path] for path in todo],
+                chunksize=2,
+            )
+            created_items = created_images = 0
+            batch = []
+            for task in tasks:
+                processed = [next(results) for _ in task[4]]
+                batch.append((task, processed))
+                if len(batch) >= self.batch_size:
+                    items, images = self._write(batch)
+                    created_items += items
+                    created_images += images
+                    batch = []
+            if batch:
+                items, images = self._write(batch)
+                created_items += items
+                created_images += images
+            timings["process+write"] = time.monotonic() - started
+
+        self.stdout.write(
+            ", ".join(f"{phase}: {seconds:.2f}s" for phase, seconds in timings.items())
+        )
+        total = sum(timings.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Catalog import completed! Items created: {created_items}, "
+                f"gallery images: {created_images}, already imported: {skipped} "
+                f"({len(todo)} photos processed, "
+                f"{len(todo) / total if total else 0:.1f} photos/s overall)"
+            )
+        )
+
+    def _collect(self, root, only):
+        """Return ``[(folder, (category, prefix), [(item_name, [paths])])]``."""
+        folders = []
+        for folder in sorted(path for path in root.iterdir() if path.is_dir()):
+            if only:
+                if folder.name not in only:
+                    continue
+                info = FOLDER_CATEGORIES.get(
+                    folder.name, (folder.name, folder.name.replace(" ", "_"))
+                )
+            elif folder.name in FOLDER_CATEGORIES:
+                info = FOLDER_CATEGORIES[folder.name]
+            else:
+                continue
+
+            entries = sorted(folder.iterdir())
+            items = []
+            n = 0
+            for entry in entries:
+                item_paths = (
+                    iter_image_files(entry.iterdir())
+                    if entry.is_dir()
+                    else iter_image_files([entry])
+                )
+                if item_paths:
+                    n += 1
+                    items.append((f"{info[1]}_{n}", item_paths))
+            self.stdout.write(f"Found {len(items)} items in {folder.name}")
+            folders.append((folder, info, items))
+        return folders
+
+    def _load_metadata(self, path):
+        if not path:
+            return {}
+        with open(path, "r", encoding="utf-8") as file:
+            return {
+                (category, item["old_name"]): (
+                    item.get("new_name") or item["old_name"],
+                    item.get("description", ""),
+                )
+                for category, item in iter_category_items(file)
+                if item.get("old_name")
+            }
+
+    def _ensure_categories(self, folders):
+        categories = categories_by_name(info[0] for _, info, _ in folders)
+        missing = [(folder, info) for folder, info, _ in folders if info[0] not in categories]
+        if missing:
+            slugs = SlugRegistry(FurnitureCategory)
+            order = (FurnitureCategory.objects.aggregate(m=Max("order"))["m"] or 0) + 1
+            created = FurnitureCategory.objects.bulk_create(
+                FurnitureCategory(
+                    name=category_name,
+                    slug=slugs.claim(folder.name, prefix),
+                    order=order + i,
+                )
+                for i, (folder, (category_name, prefix)) in enumerate(missing)
+            )
+            for category in created:
+                categories[category.name] = category
+                self.stdout.write(self.style.SUCCESS(f"Created category: {category.name}"))
+        return categories
+
+    def _store(self, upload_to, result):
+        # Names derive from the content hash, so a resumed run reuses files
+        # written before an interruption instead of storing copies.
+        name = f"{upload_to}{result['content_hash']}.jpg"
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(result["original"]))
+        save_derivatives(result["content_hash"], result["derivatives"])
+        return name
+
+    def _write(self, batch):
+        items = []
+        gallery = []
+        for (category, name, description, source_name, _), processed in batch:
+            for result in processed:
+                if "error" in result:
+                    self.stdout.write(
+                        self.style.WARNING(f"Skipping {result['path']}: {result['error']}")
+                    )
+            processed = [result for result in processed if "error" not in result]
+            if not processed:
+                continue
+            main, *rest = processed
+            items.append(
+                FurnitureItem(
+                    category=category,
+                    name=name,
+                    slug=self.slugs.claim(name, source_name.replace("_", "-")),
+                    description=description,
+                    main_image=self._store("furniture/", main),
+                    content_hash=main["content_hash"],
+                )
+            )
+            gallery.append(
+                [
+                    (self._store("furniture_gallery/", result), result["content_hash"])
+                    for result in rest
+                ]
+            )
+
+        with transaction.atomic():
+            items = FurnitureItem.objects.bulk_create(items)
+            images = FurnitureImage.objects.bulk_create(
+                FurnitureImage(
+                    furniture=item, image=image, content_hash=image_hash, order=order
+                )
+                for item, item_gallery in zip(items, gallery)
+                for order, (image, image_hash) in enumerate(item_gallery, 1)
+            )
+        for item in items:
+            self.stdout.write(f"Imported {item.name}")
+        return len(items), len(images)
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.location_import import import_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Create locations from a CSV or XLSX file (columns: name, description, "
+        "phones), link the users with those phones and pre-render the QR codes. "
+        "Rows whose location name exists are skipped, so an import can be re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or XLSX file with a header row")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Locations written per transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="QR rendering processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--site-url",
+            default=settings.SITE_URL,
+            help="Host the QR codes are rendered for (default: SITE_URL)",
+        )
+        parser.add_argument(
+            "--no-qr", action="store_true", help="Do not pre-render the QR codes"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], "rb") as fp:
+                report = import_file(
+                    fp,
+                    options["path"],
+                    site_url=None if options["no_qr"] else options["site_url"],
+                    batch_size=options["batch_size"],
+                    workers=options["workers"],
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        for line, problem in report.problems:
+            self.stdout.write(self.style.WARNING(f"Line {line}: {problem}"))
+        self.stdout.write(
+            ", ".join(f"{phase}: {seconds:.2f}s" for phase, seconds in report.timings.items())
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Locations created: {len(report.created)} of {report.rows} rows, "
+                f"user links: {report.links}"
+            )
+        )
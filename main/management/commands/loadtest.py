@@ -0,0 +1,458 @@
+import asyncio
+import json
+import random
+import statistics
+import subprocess
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from django.db.models import Max
+from django.utils import timezone
+
+from main import qrcodes
+from main.models import Location, PhoneClick, QRCodeScan
+
+SCENARIOS = ["landing", "visit", "click", "funnel"]
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client.
+
+    A full client library costs more CPU per request than the views under
+    test, which would make the load generator the bottleneck.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        if body:
+            lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            return await self._read_response()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, headers, bytes(body)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the public endpoints of a running deployment and report "
+        "requests/sec and latency percentiles. Run it against the WSGI and "
+        "the ASGI deployment (ASYNC_VIEWS=True) on the same machine and "
+        "compare the saved results with --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL")
+        parser.add_argument("--scenario", choices=SCENARIOS, default="funnel")
+        parser.add_argument(
+            "--location",
+            type=int,
+            action="append",
+            help="Location id(s) the QR visits go to (default: 1)",
+        )
+        parser.add_argument(
+            "--legacy-urls",
+            action="store_true",
+            help="Visit the unsigned /visit/<id>/ URLs instead of the signed tokens",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Open connections; with --rate, the most scenarios in flight",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help=(
+                "Start scenarios at this rate (per second, Poisson arrivals) "
+                "instead of as fast as the connections allow"
+            ),
+        )
+        parser.add_argument("--duration", type=float, default=30, help="Seconds")
+        parser.add_argument(
+            "--warmup", type=float, default=3, help="Seconds excluded from the results"
+        )
+        parser.add_argument(
+            "--click-rate",
+            type=float,
+            default=0.1,
+            help="Share of funnel visits that end with a phone click",
+        )
+        parser.add_argument(
+            "--db-writes",
+            action="store_true",
+            help="Report scans and clicks written per second; the database "
+            "settings must point at the database of the tested deployment",
+        )
+        parser.add_argument("--label", default="", help="Name of the deployment tested")
+        parser.add_argument("--output", help="Save the results as JSON")
+        parser.add_argument(
+            "--compare",
+            nargs="+",
+            metavar="RESULTS",
+            help="Print saved results side by side instead of running a test",
+        )
+
+    def handle(self, *args, **options):
+        if options["compare"]:
+            self.compare(options["compare"])
+            return
+
+        url = urlsplit(options["url"])
+        if url.scheme != "http" or not url.hostname:
+            raise CommandError("Only plain http:// URLs are supported")
+        self.host, self.port = url.hostname, url.port or 80
+        self.visit_paths = self.visit_paths_for(options["location"] or [1], options["legacy_urls"])
+        self.click_rate = options["click_rate"]
+        self.visit_ids = []
+        self.refused = 0
+
+        results = asyncio.run(self.run(options))
+        results.update(
+            label=options["label"] or options["url"],
+            url=options["url"],
+            scenario=options["scenario"],
+            concurrency=options["concurrency"],
+            target_rate=options["rate"],
+            commit=self.commit(),
+            finished_at=timezone.now().isoformat(timespec="seconds"),
+        )
+        self.report(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fp:
+                json.dump(results, fp, indent=1)
+            self.stdout.write(f"Saved to {options['output']}")
+
+    async def run(self, options):
+        latencies = {}
+        errors = {}
+        scenario = getattr(self, f"scenario_{options['scenario']}")
+        started = time.perf_counter()
+        measure_from = started + options["warmup"]
+        deadline = measure_from + options["duration"]
+
+        async def timed(connection, name, method, path, since=None, **kwargs):
+            # since: when the request should have started, to count queueing
+            begin = time.perf_counter() if since is None else since
+            try:
+                status, headers, body = await connection.request(method, path, **kwargs)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as exc:
+                status, headers, body = type(exc).__name__, {}, b""
+            end = time.perf_counter()
+            if begin >= measure_from and end <= deadline:
+                latencies.setdefault(name, []).append(end - begin)
+                if not isinstance(status, int) or status >= 400:
+                    errors[f"{name} {status}"] = errors.get(f"{name} {status}", 0) + 1
+            return status, headers, body
+
+        async def worker():
+            connection = Connection(self.host, self.port)
+            try:
+                while time.perf_counter() < deadline:
+                    await scenario(connection, timed)
+            finally:
+                connection.close()
+
+        writes = None
+        if options["db_writes"]:
+            writes = asyncio.create_task(self.count_writes(measure_from, deadline))
+        if options["rate"]:
+            schedule = await self.run_at_rate(
+                scenario, timed, options["rate"], options["concurrency"], deadline
+            )
+        else:
+            schedule = None
+            await asyncio.gather(*(worker() for _ in range(options["concurrency"])))
+        if self.refused:
+            # Redirected home without a scan: rate limited or an invalid code
+            errors["visit refused"] = self.refused
+        results = self.summarize(latencies, errors, options["duration"])
+        if writes is not None:
+            results["db_writes"] = await writes
+        if schedule is not None:
+            results["late_starts"] = schedule["late"]
+            results["unfinished"] = schedule["unfinished"]
+        return results
+
+    async def run_at_rate(self, scenario, timed, rate, concurrency, deadline):
+        """Open-loop load: scenarios start on schedule, however slow the server.
+
+        The first request of a scenario is timed from its scheduled start, so
+        waiting for a free connection counts as latency (no coordinated
+        omission). Returns how many scenarios started over 100 ms late and
+        how many had not finished by the deadline.
+        """
+        pool = asyncio.Queue()
+        for _ in range(concurrency):
+            pool.put_nowait(Connection(self.host, self.port))
+        tasks = set()
+        late = 0
+
+        async def start(scheduled):
+            nonlocal late
+            connection = await pool.get()
+            if time.perf_counter() - scheduled > 0.1:
+                late += 1
+            first = True
+
+            async def timed_from_schedule(conn, name, method, path, **kwargs):
+                nonlocal first
+                since, first = (scheduled if first else None), False
+                return await timed(conn, name, method, path, since=since, **kwargs)
+
+            try:
+                await scenario(connection, timed_from_schedule)
+            finally:
+                pool.put_nowait(connection)
+
+        scheduled = time.perf_counter()
+        while scheduled < deadline:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(start(scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += random.expovariate(rate)
+        # Scenarios still queued or running at the deadline are abandoned
+        unfinished = len(tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not pool.empty():
+            pool.get_nowait().close()
+        return {"late": late, "unfinished": unfinished}
+
+    async def count_writes(self, measure_from, deadline):
+        """Scans and clicks created per second during the measurement."""
+
+        async def last_ids():
+            scan = await QRCodeScan.objects.aaggregate(last=Max("id"))
+            click = await PhoneClick.objects.aaggregate(last=Max("id"))
+            return scan["last"] or 0, click["last"] or 0
+
+        try:
+            await asyncio.sleep(max(0, measure_from - time.perf_counter()))
+            before = await last_ids()
+            begin = time.perf_counter()
+            await asyncio.sleep(max(0, deadline - begin))
+            after = await last_ids()
+        except DatabaseError as exc:
+            self.stderr.write(f"Cannot count database writes: {exc}")
+            return None
+        elapsed = time.perf_counter() - begin
+        scans, clicks = after[0] - before[0], after[1] - before[1]
+        return {
+            "scans": scans,
+            "clicks": clicks,
+            "per_second": round((scans + clicks) / elapsed, 1),
+        }
+
+    @staticmethod
+    def visit_paths_for(location_ids, legacy):
+        """The QR code URLs of the locations, signed with this QR_SIGNING_KEY."""
+        if legacy:
+            return [f"/visit/{location_id}/" for location_id in location_ids]
+        versions = dict(
+            Location.objects.filter(pk__in=location_ids).values_list("pk", "qr_version")
+        )
+        missing = set(location_ids) - versions.keys()
+        if missing:
+            raise CommandError(f"No such locations: {sorted(missing)}")
+        return [
+            f"/v/{qrcodes.make_token(location_id, versions[location_id])}/"
+            for location_id in location_ids
+        ]
+
+    @staticmethod
+    def commit():
+        """Short hash of the checked-out commit, to compare runs across commits."""
+        try:
+            result = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout.strip() or None
+
+    async def scenario_landing(self, connection, timed):
+        await timed(connection, "landing", "GET", "/")
+
+    async def scenario_visit(self, connection, timed):
+        status, headers, _ = await timed(
+            connection, "visit", "GET", random.choice(self.visit_paths)
+        )
+        location_header = headers.get("location", "")
+        if "visit_id=" not in location_header:
+            if status == 302:
+                self.refused += 1
+        elif len(self.visit_ids) < 10000:
+            self.visit_ids.append(location_header.split("visit_id=", 1)[1])
+        return location_header
+
+    async def scenario_click(self, connection, timed):
+        if not self.visit_ids:
+            await self.scenario_visit(connection, timed)
+            return
+        await self._click(connection, timed, random.choice(self.visit_ids))
+
+    async def scenario_funnel(self, connection, timed):
+        """A QR scan: visit redirect, landing page, sometimes a phone click."""
+        redirect = await self.scenario_visit(connection, timed)
+        if not redirect:
+            return
+        target = urlsplit(redirect)
+        await timed(connection, "landing", "GET", f"{target.path}?{target.query}")
+        if "visit_id=" in redirect and random.random() < self.click_rate:
+            await self._click(connection, timed, redirect.split("visit_id=", 1)[1])
+
+    async def _click(self, connection, timed, visit_id):
+        await timed(
+            connection,
+            "click",
+            "POST",
+            "/api/record-phone-click/",
+            body=json.dumps({"visit_id": visit_id}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+
+    @staticmethod
+    def summarize(latencies, errors, duration):
+        def percentiles(values):
+            if len(values) < 2:
+                return {"p50": None, "p90": None, "p99": None}
+            cuts = statistics.quantiles(values, n=100, method="inclusive")
+            return {
+                "p50": round(cuts[49] * 1000, 2),
+                "p90": round(cuts[89] * 1000, 2),
+                "p99": round(cuts[98] * 1000, 2),
+            }
+
+        everything = [value for values in latencies.values() for value in values]
+        endpoints = {
+            name: {"requests": len(values), "rps": round(len(values) / duration, 1)}
+            | percentiles(values)
+            for name, values in sorted(latencies.items())
+        }
+        return {
+            "duration": duration,
+            "requests": len(everything),
+            "rps": round(len(everything) / duration, 1),
+            **percentiles(everything),
+            "endpoints": endpoints,
+            "errors": errors,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+        )
+        for name, row in [*results["endpoints"].items(), ("total", results)]:
+            self.stdout.write(
+                f"{name:<10}{row['requests']:>10}{row['rps']:>10}"
+                + "".join(f"{str(row[p]):>10}" for p in ("p50", "p90", "p99"))
+            )
+        if results.get("target_rate"):
+            self.stdout.write(
+                f"Target {results['target_rate']} scenarios/s, "
+                f"{results['late_starts']} started over 100 ms late, "
+                f"{results['unfinished']} unfinished at the end"
+            )
+        if results.get("db_writes"):
+            writes = results["db_writes"]
+            self.stdout.write(
+                f"DB writes: {writes['scans']} scans, {writes['clicks']} clicks "
+                f"({writes['per_second']}/s)"
+            )
+        if results["errors"]:
+            self.stdout.write(self.style.WARNING(f"Errors: {results['errors']}"))
+            if "visit refused" in results["errors"]:
+                self.stdout.write(
+                    self.style.WARNING(
+                        "Refused visits were redirected without recording a scan, so "
+                        "the results mostly measure the rate limiter. Load-test with "
+                        "RATE_LIMIT_ENABLED=False on the tested deployment."
+                    )
+                )
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{results['label']}: no errors"))
+
+    def compare(self, paths):
+        runs = []
+        for path in paths:
+            try:
+                with open(path, encoding="utf-8") as fp:
+                    runs.append(json.load(fp))
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"{path}: {exc}")
+        width = max(12, *(len(run["label"]) + 2 for run in runs))
+        self.stdout.write(f"{'':<16}" + "".join(f"{run['label']:>{width}}" for run in runs))
+        rows = [("req/s", "rps"), ("p50 ms", "p50"), ("p99 ms", "p99")]
+        for name in sorted({name for run in runs for name in run["endpoints"]}):
+            for title, key in rows:
+                self.stdout.write(
+                    f"{name + ' ' + title:<16}"
+                    + "".join(
+                        f"{str(run['endpoints'].get(name, {}).get(key, '-')):>{width}}"
+                        for run in runs
+                    )
+                )
+        for title, key in rows:
+            self.stdout.write(
+                f"{'total ' + title:<16}" + "".join(f"{str(run[key]):>{width}}" for run in runs)
+            )
+        self.stdout.write(
+            f"{'db writes/s':<16}"
+            + "".join(
+                f"{str((run.get('db_writes') or {}).get('per_second', '-')):>{width}}"
+                for run in runs
+            )
+        )
+        self.stdout.write(
+            f"{'commit':<16}" + "".join(f"{str(run.get('commit') or '-'):>{width}}" for run in runs)
+        )
+        errors = [run["label"] for run in runs if run["errors"]]
+        if errors:
+            self.stdout.write(self.style.WARNING("Runs with errors: " + ", ".join(errors)))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main import stats
+
+
+class Command(BaseCommand):
+    help = "Recompute precomputed statistics (heatmap, hourly rollup, visit funnel) from raw scans, clicks and visit sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--location",
+            type=int,
+            action="append",
+            dest="locations",
+            help="Only rebuild the given location id (can be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        location_ids = options["locations"]
+
+        for label, rebuild in (
+            ("Heatmap", stats.rebuild_heatmap),
+            ("Hourly rollup", stats.rebuild_hourly),
+            ("Visit funnel", stats.rebuild_funnel),
+        ):
+            started = time.monotonic()
+            rows = rebuild(location_ids)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{label} rebuilt: {rows} rows in {time.monotonic() - started:.2f}s"
+                )
+            )
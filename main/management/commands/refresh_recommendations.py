@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main import recommendations
+from main.models import FurnitureCategory
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute related-item recommendations for categories whose items "
+        "changed since the last run (or all with --full). Run --full periodically "
+        "to pick up new co-viewing data. Item views older than the co-viewing "
+        "window are deleted on every run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="Recompute every category"
+        )
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            default=recommendations.TOP_K,
+            help="Recommendations stored per item",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        purged = recommendations.purge_views()
+        if purged:
+            self.stdout.write(
+                f"Deleted {purged} item views older than {recommendations.COVIEW_DAYS} days"
+            )
+        category_ids = None if options["full"] else recommendations.stale_categories()
+        if category_ids == []:
+            self.stdout.write("Recommendations are up to date")
+            return
+
+        written = recommendations.refresh_categories(category_ids, options["top_k"])
+        names = dict(
+            FurnitureCategory.objects.filter(id__in=written).values_list("id", "name")
+        )
+        for category_id, rows in written.items():
+            self.stdout.write(f"{names.get(category_id, category_id)}: {rows} recommendations")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Refreshed {len(written)} categories in {time.monotonic() - started:.2f}s"
+            )
+        )
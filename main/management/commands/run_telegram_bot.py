@@ -13,7 +13,9 @@ from __future__ import annotations
 
 import datetime as _dt
 import logging
+import time
 import traceback
+from contextlib import nullcontext
 from enum import Enum
 from functools import wraps
 from typing import Callable, List, Optional
@@ -32,14 +34,41 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
 )
+from telegram.helpers import escape_markdown
 
+from main import metrics, profiling, querystats  # pylint: disable=import-error
 from main.models import Location, PhoneClick, QRCodeScan  # pylint: disable=import-error
+from main.routers import use_replica  # pylint: disable=import-error
+from main.stats import (  # pylint: disable=import-error
+    WEEKDAYS,
+    location_comparison,
+    location_funnel,
+    location_heatmap,
+    stats_timezone,
+)
 from users.models import CustomUser  # <-- Import user model
 
 logger = logging.getLogger(__name__)
 
 ADMIN_USERNAMES: set[str] = {"Iforce706", "subanovsh", "umurzakova8686"}
 
+# Locations per page of the comparison view; keeps messages well under
+# Telegram's 4096 character limit even with long location names.
+COMPARE_PAGE_SIZE = 15
+COMPARE_NAME_MAX = 40
+
+HEATMAP_SHADES = " ░▒▓█"
+
+FUNNEL_LABELS = {
+    "sessions": "📷 Сканирования",
+    "catalog": "📂 Каталог",
+    "item": "🪑 Товар",
+    "calls": "📞 Звонок",
+}
+
+# Callback actions recorded by name in the metrics; others count as "other"
+CALLBACK_ACTIONS = {"range", "compare", "back"}
+
 
 class Range(str, Enum):
     TODAY = "today"
@@ -91,20 +120,79 @@ class QRStatsBot:
     # ─── Handlers registration ────────────────────────────────────────────────
 
     def _register_handlers(self) -> None:
-        self.app.add_handler(CommandHandler("start", self.cmd_start))
-        self.app.add_handler(CommandHandler("help", self.cmd_help))
-        self.app.add_handler(CommandHandler("stats", self.cmd_stats))
-        self.app.add_handler(CommandHandler("allstats", self.cmd_allstats))
+        for name, handler in (
+            ("start", self.cmd_start),
+            ("help", self.cmd_help),
+            # Read-only statistics may come from the replica (main.routers)
+            ("stats", use_replica(self.cmd_stats)),
+            ("allstats", use_replica(self.cmd_allstats)),
+            ("dashboard", use_replica(self.cmd_dashboard)),
+            ("compare", use_replica(self.cmd_compare)),
+            ("heatmap", use_replica(self.cmd_heatmap)),
+            ("funnel", use_replica(self.cmd_funnel)),
+        ):
+            self.app.add_handler(CommandHandler(name, self._timed(name, handler)))
 
         from telegram.ext import MessageHandler, filters
 
-        self.app.add_handler(MessageHandler(filters.CONTACT, self.contact_handler))
+        self.app.add_handler(
+            MessageHandler(filters.CONTACT, self._timed("contact", self.contact_handler))
+        )
 
         # callback queries
-        self.app.add_handler(CallbackQueryHandler(self.cb_handler))
+        self.app.add_handler(
+            CallbackQueryHandler(self._timed("callback", use_replica(self.cb_handler)))
+        )
         # global error handler
         self.app.add_error_handler(self.error_handler)
 
+    @staticmethod
+    def _timed(name: str, handler: Callable) -> Callable:
+        """Record a handler in :mod:`main.metrics`, :mod:`main.querystats`
+        and :mod:`main.profiling`.
+
+        The handler is returned as is when all of them are disabled.
+        """
+        record_metrics, record_queries = metrics.enabled(), querystats.enabled()
+        record_profiles = profiling.enabled()
+        if not (record_metrics or record_queries or record_profiles):
+            return handler
+        if record_queries:
+            querystats.install_all()
+
+        @wraps(handler)
+        async def _wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            command = name
+            query = update.callback_query
+            if query and query.data:
+                action = query.data.split(":", 1)[0]
+                command = f"{name}:{action if action in CALLBACK_ACTIONS else 'other'}"
+            labels = (("command", command),)
+            # ORM calls run in executor threads, so every thread is sampled
+            sampler = profiling.Sampler() if record_profiles and profiling.sampled() else None
+            start = time.perf_counter()
+            try:
+                # sync_to_async carries the capture context into the ORM calls
+                with querystats.capture(f"bot:{command}" if record_queries else None):
+                    with sampler or nullcontext():
+                        return await handler(update, context)
+            except Exception:
+                if record_metrics:
+                    metrics.inc("gos_bot_command_errors_total", labels)
+                raise
+            finally:
+                if record_metrics:
+                    metrics.observe(
+                        "gos_bot_command_duration_seconds", labels, time.perf_counter() - start
+                    )
+                    metrics.maybe_flush()
+                if record_queries and querystats.flush_due():
+                    await sync_to_async(querystats.flush)()
+                if sampler is not None:
+                    await sync_to_async(profiling.save)(sampler, f"bot:{command}", "rate")
+
+        return _wrapper
+
     # ─── Commands ─────────────────────────────────────────────────────────────
 
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -173,12 +261,48 @@ class QRStatsBot:
     @admin_only
     async def cmd_dashboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         kb = self._build_dashboard_kb()
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "📊 *Панель статистики* — выберите диапазон:",
             reply_markup=InlineKeyboardMarkup(kb),
             parse_mode="Markdown",
         )
 
+    async def cmd_compare(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        rng = context.args[0] if context.args and context.args[0] in Range.list() else ""
+        await self._send_comparison(update, rng or Range.MONTH.value, 0)
+
+    async def cmd_heatmap(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        admin_scope = user is not None and user.username in ADMIN_USERNAMES
+        location_id = (
+            int(context.args[0]) if context.args and context.args[0].isdigit() else None
+        )
+        matrix = await sync_to_async(self._get_heatmap)(
+            None if admin_scope else str(user.id), location_id
+        )
+        if matrix is None:
+            await update.effective_message.reply_text(
+                "⛔ Локация не найдена или у вас нет к ней доступа."
+            )
+            return
+        await self._reply(update, self._format_heatmap(matrix))
+
+    async def cmd_funnel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        admin_scope = user is not None and user.username in ADMIN_USERNAMES
+        args = [arg for arg in context.args or [] if arg.isdigit()]
+        days = max(int(args[0]), 1) if args else 30
+        location_id = int(args[1]) if len(args) > 1 else None
+        funnel = await sync_to_async(self._get_funnel)(
+            None if admin_scope else str(user.id), location_id, days
+        )
+        if funnel is None:
+            await update.effective_message.reply_text(
+                "⛔ Локация не найдена или у вас нет к ней доступа."
+            )
+            return
+        await self._reply(update, self._format_funnel(funnel, days))
+
     # ─── Contact registration handler ─────────────────────────────────────────
 
     async def contact_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -226,6 +350,10 @@ class QRStatsBot:
             await self._send_stats(
                 update, self._range_to_days(arg[0]), admin_scope=True, edit=True
             )
+        elif action == "compare":
+            rng = arg[0] if arg and arg[0] in Range.list() else Range.MONTH.value
+            page = int(arg[1]) if len(arg) > 1 and arg[1].isdigit() else 0
+            await self._send_comparison(update, rng, page, edit=True)
         elif action == "back":
             await self.cmd_dashboard(update, context)
         await query.answer()
@@ -293,6 +421,185 @@ class QRStatsBot:
             logger.error(traceback.format_exc())
             return 0
 
+    def _get_comparison(
+        self, start: _dt.datetime, end: _dt.datetime, telegram_id: Optional[str]
+    ) -> Optional[list[dict]]:
+        """Comparison rows for all locations, or for the user's own ones.
+
+        Returns ``None`` when ``telegram_id`` does not belong to a registered user.
+        """
+        location_ids = None
+        if telegram_id is not None:
+            db_user = CustomUser.objects.filter(telegram_id=telegram_id).first()
+            if not db_user:
+                return None
+            location_ids = db_user.locations.values_list("id", flat=True)
+        return location_comparison(start, end, location_ids)
+
+    def _get_heatmap(
+        self, telegram_id: Optional[str], location_id: Optional[int]
+    ) -> Optional[list[list[dict]]]:
+        """Heatmap for one location or the whole scope of the user.
+
+        Returns ``None`` when the user is unknown or the location is out of scope.
+        """
+        locations = Location.objects.all()
+        if telegram_id is not None:
+            db_user = CustomUser.objects.filter(telegram_id=telegram_id).first()
+            if not db_user:
+                return None
+            locations = locations.filter(user=db_user)
+        if location_id is not None:
+            if not locations.filter(id=location_id).exists():
+                return None
+            return location_heatmap([location_id])
+        if telegram_id is None:
+            return location_heatmap()
+        return location_heatmap(locations.values("id"))
+
+    def _get_funnel(
+        self, telegram_id: Optional[str], location_id: Optional[int], days: int
+    ) -> Optional[dict]:
+        """Visit funnel of the last ``days`` days, scoped like :meth:`_get_heatmap`."""
+        locations = Location.objects.all()
+        if telegram_id is not None:
+            db_user = CustomUser.objects.filter(telegram_id=telegram_id).first()
+            if not db_user:
+                return None
+            locations = locations.filter(user=db_user)
+        start = timezone.localtime(timezone.now(), stats_timezone()).date() - _dt.timedelta(
+            days=days - 1
+        )
+        if location_id is not None:
+            if not locations.filter(id=location_id).exists():
+                return None
+            return location_funnel([location_id], start=start)
+        if telegram_id is None:
+            return location_funnel(start=start)
+        return location_funnel(locations.values("id"), start=start)
+
+    @staticmethod
+    def _format_funnel(funnel: dict, days: int) -> str:
+        if not funnel["sessions"]:
+            return f"🔻 За {days} дн. визитов по QR-кодам пока нет."
+        lines = [f"🔻 *Воронка визитов за {days} дн.*", ""]
+        lines.extend(
+            f"{FUNNEL_LABELS[stage['key']]}: {stage['count']} ({stage['percent']:.0f}%)"
+            for stage in funnel["stages"]
+        )
+        lines.append("")
+        lines.append(
+            f"🔁 Повторные посетители: {funnel['returning']} "
+            f"({funnel['returning'] / funnel['sessions'] * 100:.0f}%)"
+        )
+        lines.append(
+            f"📄 Страниц за визит: {funnel['page_views'] / funnel['sessions']:.1f}"
+        )
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_heatmap(matrix: list[list[dict]]) -> str:
+        peak = max(cell["scans"] for row in matrix for cell in row)
+        if not peak:
+            return "🕒 Пока нет сканирований для тепловой карты."
+        levels = len(HEATMAP_SHADES) - 1
+        lines = ["   0     6     12    18"]
+        for day, row in zip(WEEKDAYS, matrix):
+            shades = "".join(
+                HEATMAP_SHADES[-(-cell["scans"] * levels // peak)] for cell in row
+            )
+            lines.append(f"{day} {shades}")
+        top = sorted(
+            (
+                (cell["scans"], day, hour)
+                for day, row in zip(WEEKDAYS, matrix)
+                for hour, cell in enumerate(row)
+                if cell["scans"]
+            ),
+            reverse=True,
+        )[:3]
+        parts = [
+            f"🕒 *Сканирования по часам недели* ({stats_timezone().key})",
+            "```",
+            *lines,
+            "```",
+            "🔥 *Пиковые часы:*",
+        ]
+        parts.extend(
+            f"{day} {hour:02d}:00–{hour + 1:02d}:00 — {scans} 📷"
+            for scans, day, hour in top
+        )
+        return "\n".join(parts)
+
+    async def _send_comparison(
+        self, update: Update, rng: str, page: int, *, edit: bool = False
+    ):
+        try:
+            user = update.effective_user
+            admin_scope = user is not None and user.username in ADMIN_USERNAMES
+            start, end = self._range_bounds(rng)
+            rows = await sync_to_async(self._get_comparison)(
+                start, end, None if admin_scope else str(user.id)
+            )
+            if rows is None:
+                await update.effective_message.reply_text(
+                    "⛔ Сначала зарегистрируйтесь через /start."
+                )
+                return
+            if not rows:
+                await update.effective_message.reply_text(
+                    "⛔ У вас нет доступной локации."
+                )
+                return
+
+            pages = (len(rows) + COMPARE_PAGE_SIZE - 1) // COMPARE_PAGE_SIZE
+            page = min(page, pages - 1)
+            # The dashboard behind "back" is for admins only
+            kb = self._build_compare_kb(rng, page, pages, back=admin_scope)
+            await self._reply(
+                update,
+                self._format_comparison(rows, rng, page, pages),
+                edit=edit,
+                reply_markup=InlineKeyboardMarkup(kb),
+            )
+
+        except Exception as e:
+            logger.error(f"Error in _send_comparison: {str(e)}")
+            logger.error(traceback.format_exc())
+            await update.effective_message.reply_text(
+                "Ошибка при получении статистики. Пожалуйста, попробуйте позже."
+            )
+
+    def _format_comparison(self, rows: list[dict], rng: str, page: int, pages: int) -> str:
+        offset = page * COMPARE_PAGE_SIZE
+        parts = [f"📊 *Сравнение локаций {self._range_title(rng)}*"]
+        if pages > 1:
+            parts.append(f"Страница {page + 1} из {pages}")
+        parts.append("")
+        for i, row in enumerate(rows[offset : offset + COMPARE_PAGE_SIZE], offset + 1):
+            name = row["name"]
+            if len(name) > COMPARE_NAME_MAX:
+                name = name[: COMPARE_NAME_MAX - 1] + "…"
+            loc_conversion = (
+                f", конверсия {row['conversion']:.1f}%"
+                if row["conversion"] is not None
+                else ""
+            )
+            parts.append(
+                f"{i}. *{escape_markdown(name)}*: {row['scan_count']} 📷"
+                f"{self._format_change(row['scan_change'])} → "
+                f"{row['click_count']} 📞"
+                f"{self._format_change(row['click_change'])}{loc_conversion}"
+            )
+        parts.append("\n_Изменение — к предыдущему периоду той же длины._")
+        return "\n".join(parts)
+
+    @staticmethod
+    def _format_change(change: Optional[float]) -> str:
+        if change is None:
+            return ""
+        return f" ({change:+.0f}%)"
+
     async def _send_stats(
         self, update: Update, days: int, *, admin_scope: bool, edit: bool = False
     ):
@@ -424,6 +731,30 @@ class QRStatsBot:
         }
         return mapping.get(r, 30)
 
+    @classmethod
+    def _range_bounds(cls, r: str) -> tuple[_dt.datetime, _dt.datetime]:
+        """Half-open ``[start, end)`` window for a range, in whole ``STATS_TIME_ZONE`` days."""
+        today = timezone.localtime(timezone.now(), stats_timezone()).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        tomorrow = today + _dt.timedelta(days=1)
+        if r == Range.TODAY.value:
+            return today, tomorrow
+        if r == Range.YESTERDAY.value:
+            return today - _dt.timedelta(days=1), today
+        return tomorrow - _dt.timedelta(days=cls._range_to_days(r)), tomorrow
+
+    @staticmethod
+    def _range_title(r: str) -> str:
+        titles = {
+            Range.TODAY.value: "сегодня",
+            Range.YESTERDAY.value: "вчера",
+            Range.WEEK.value: "за 7 дней",
+            Range.MONTH.value: "за 30 дней",
+            Range.ALL.value: "за все время",
+        }
+        return titles.get(r, "за 30 дней")
+
     def _build_dashboard_kb(self) -> list[list[InlineKeyboardButton]]:
         buttons = [
             ("Сегодня", Range.TODAY),
@@ -442,11 +773,55 @@ class QRStatsBot:
         )
         return rows
 
-    async def _reply(self, update: Update, text: str, *, edit: bool = False):
+    def _build_compare_kb(
+        self, rng: str, page: int, pages: int, *, back: bool = False
+    ) -> list[list[InlineKeyboardButton]]:
+        ranges = [
+            ("Сегодня", Range.TODAY),
+            ("Вчера", Range.YESTERDAY),
+            ("7 дней", Range.WEEK),
+            ("30 дней", Range.MONTH),
+        ]
+        rows: list[list[InlineKeyboardButton]] = [
+            [
+                InlineKeyboardButton(
+                    f"• {text}" if r.value == rng else text,
+                    callback_data=f"compare:{r.value}:0",
+                )
+                for text, r in ranges
+            ]
+        ]
+        nav: list[InlineKeyboardButton] = []
+        if page > 0:
+            nav.append(
+                InlineKeyboardButton("◀️", callback_data=f"compare:{rng}:{page - 1}")
+            )
+        if page < pages - 1:
+            nav.append(
+                InlineKeyboardButton("▶️", callback_data=f"compare:{rng}:{page + 1}")
+            )
+        if nav:
+            rows.append(nav)
+        if back:
+            rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:")])
+        return rows
+
+    async def _reply(
+        self,
+        update: Update,
+        text: str,
+        *,
+        edit: bool = False,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ):
         if edit and update.callback_query:
-            await update.callback_query.edit_message_text(text, parse_mode="Markdown")
+            await update.callback_query.edit_message_text(
+                text, parse_mode="Markdown", reply_markup=reply_markup
+            )
         else:
-            await update.effective_message.reply_text(text, parse_mode="Markdown")
+            await update.effective_message.reply_text(
+                text, parse_mode="Markdown", reply_markup=reply_markup
+            )
 
     # ─── Error handler ────────────────────────────────────────────────────────
 
@@ -471,6 +846,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS("Starting Telegram bot..."))
+        metrics.set_role("bot")
         bot = QRStatsBot()
         bot.run()
 
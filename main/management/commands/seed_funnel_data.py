@@ -0,0 +1,189 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from faker import Faker
+
+from main import stats
+from main.models import Location, PhoneClick, QRCodeScan
+from users.models import CustomUser
+
+# Share of a day's scans per local hour: quiet nights, lunch and evening peaks
+HOUR_WEIGHTS = [
+    1, 1, 1, 1, 1, 2, 3, 5, 7, 9, 11, 13,
+    14, 13, 11, 10, 11, 13, 15, 14, 11, 8, 5, 2,
+]
+# Monday first; furniture is shopped for at weekends
+WEEKDAY_WEIGHTS = [0.8, 0.8, 0.85, 0.9, 1.0, 1.4, 1.3]
+BATCH_SIZE = 5000
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let ``bulk_create`` keep the given ``auto_now_add`` values."""
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now_add", False)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed realistic locations, users, scans and phone clicks for load "
+        "tests and demos: months of history with daily and weekly cycles"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--locations", type=int, default=30)
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--days", type=int, default=90, help="Days of scan history")
+        parser.add_argument(
+            "--scans-per-day",
+            type=float,
+            default=40,
+            help="Average daily scans of a location; popularity varies around it",
+        )
+        parser.add_argument(
+            "--click-rate", type=float, default=0.08, help="Share of scans followed by a phone click"
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Random seed")
+        parser.add_argument(
+            "--force", action="store_true", help="Seed even though DEBUG is off"
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options["force"]:
+            raise CommandError(
+                "Refusing to add fake scans to a DEBUG=False database; pass --force if this is intended"
+            )
+        self.rng = random.Random(options["seed"])
+        self.fake = Faker("ru_RU")
+        self.fake.seed_instance(options["seed"])
+
+        started = time.monotonic()
+        with transaction.atomic():
+            users = self._users(options["users"])
+            locations = self._locations(options["locations"], users)
+            scans, clicks = self._history(locations, options)
+        self.stdout.write(
+            f"Seeded {len(users)} users, {len(locations)} locations, {scans} scans and "
+            f"{clicks} clicks in {time.monotonic() - started:.1f}s"
+        )
+
+        started = time.monotonic()
+        location_ids = [location.pk for location in locations]
+        stats.rebuild_heatmap(location_ids)
+        stats.rebuild_hourly(location_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f"Statistics rebuilt in {time.monotonic() - started:.1f}s")
+        )
+
+    def _users(self, count):
+        users = []
+        taken = set(CustomUser.objects.values_list("username", flat=True))
+        while len(users) < count:
+            username = self.fake.user_name()
+            if username in taken:
+                continue
+            taken.add(username)
+            users.append(
+                CustomUser(
+                    username=username,
+                    first_name=self.fake.first_name(),
+                    last_name=self.fake.last_name(),
+                    email=self.fake.email(),
+                    phone_number=self.fake.phone_number()[:20],
+                    telegram_id=str(self.rng.randrange(10**8, 10**10)),
+                    password="!",  # unusable: seeded users cannot log in
+                )
+            )
+        return CustomUser.objects.bulk_create(users)
+
+    def _locations(self, count, users):
+        now = timezone.now()
+        locations = []
+        for _ in range(count):
+            location = Location(
+                name=f"{self.fake.city_name()}, {self.fake.street_address()}"[:100],
+                description=self.fake.sentence(nb_words=8),
+            )
+            location.created_at = now
+            locations.append(location)
+        with explicit_timestamps(Location):
+            locations = Location.objects.bulk_create(locations)
+        # Each owner has one to three locations
+        through = Location.user.through
+        links = set()
+        for location in locations:
+            if users:
+                owners = self.rng.sample(users, min(len(users), self.rng.randint(1, 3)))
+                links.update((location.pk, user.pk) for user in owners)
+        through.objects.bulk_create(
+            through(location_id=location_id, customuser_id=user_id)
+            for location_id, user_id in links
+        )
+        return locations
+
+    def _history(self, locations, options):
+        """Scans spread over ``--days`` with daily and weekly cycles."""
+        tz = stats.stats_timezone()
+        today = timezone.localtime(timezone.now(), tz).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        agents = [self.fake.user_agent() for _ in range(200)]
+        hours = range(24)
+        scan_total = click_total = 0
+        pending = []
+
+        def write():
+            nonlocal click_total
+            with explicit_timestamps(QRCodeScan, PhoneClick):
+                created = QRCodeScan.objects.bulk_create(pending)
+                clicks = []
+                for scan in created:
+                    if self.rng.random() < options["click_rate"]:
+                        # Most callers decide within the first minutes
+                        delay = timedelta(seconds=self.rng.expovariate(1 / 90))
+                        clicks.append(PhoneClick(scan=scan, timestamp=scan.timestamp + delay))
+                PhoneClick.objects.bulk_create(clicks)
+            click_total += len(clicks)
+            pending.clear()
+
+        for location in locations:
+            # Popularity differs a lot between locations
+            mean = options["scans_per_day"] * self.rng.lognormvariate(0, 0.6)
+            for day_offset in range(options["days"], 0, -1):
+                day = today - timedelta(days=day_offset)
+                expected = mean * WEEKDAY_WEIGHTS[day.weekday()]
+                count = max(0, round(self.rng.gauss(expected, math.sqrt(expected))))
+                for hour in self.rng.choices(hours, HOUR_WEIGHTS, k=count):
+                    timestamp = day + timedelta(hours=hour, seconds=self.rng.randrange(3600))
+                    pending.append(
+                        QRCodeScan(
+                            location=location,
+                            timestamp=timestamp,
+                            ip_address=self.fake.ipv4_public(),
+                            user_agent=self.rng.choice(agents),
+                        )
+                    )
+                scan_total += count
+                if len(pending) >= BATCH_SIZE:
+                    write()
+        if pending:
+            write()
+        return scan_total, click_total
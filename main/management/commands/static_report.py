@@ -0,0 +1,74 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.staticfiles import REPORT_NAME
+
+COLUMNS = ["original", "minified", "gzip", "brotli", "webp", "avif"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the per-asset byte sizes written by collectstatic: original, "
+        "minified, gzip/brotli and WebP/AVIF variants."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sort",
+            choices=COLUMNS,
+            default="original",
+            help="Column to sort by, largest first",
+        )
+
+    def handle(self, *args, **options):
+        path = f"{settings.STATIC_ROOT}/{REPORT_NAME}"
+        try:
+            with open(path, encoding="utf-8") as fp:
+                report = json.load(fp)
+        except OSError:
+            raise CommandError(f"{path} not found, run collectstatic first")
+
+        assets = report["assets"]
+        width = max((len(name) for name in assets), default=10)
+        self.stdout.write(
+            "asset".ljust(width) + "".join(column.rjust(11) for column in COLUMNS)
+        )
+        totals = dict.fromkeys(COLUMNS, 0)
+        # The smallest of what can be served for each asset
+        served = 0
+        for name, sizes in sorted(
+            assets.items(), key=lambda kv: -kv[1].get(options["sort"], 0)
+        ):
+            cells = []
+            for column in COLUMNS:
+                value = sizes.get(column)
+                cells.append(("-" if value is None else str(value)).rjust(11))
+                totals[column] += value or 0
+            served += min(
+                sizes.get(column, sizes.get("original", 0))
+                for column in COLUMNS
+                if column in sizes
+            )
+            self.stdout.write(name.ljust(width) + "".join(cells))
+        self.stdout.write(
+            "total".ljust(width) + "".join(str(totals[c]).rjust(11) for c in COLUMNS)
+        )
+
+        if report.get("missing"):
+            self.stdout.write(
+                self.style.WARNING(
+                    "Referenced but missing: " + ", ".join(report["missing"])
+                )
+            )
+        if not report.get("brotli"):
+            self.stdout.write(
+                self.style.WARNING("brotli is not installed; only .gz siblings were written")
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(assets)} assets: {totals['original']} bytes as authored, "
+                f"at best {served} bytes over the wire"
+            )
+        )
@@ -1,10 +1,16 @@
-import json
 import os
+import time
 
 from django.core.management.base import BaseCommand
-from django.utils.text import slugify
+from django.db import transaction
+from django.utils import timezone
 
-from main.models import FurnitureCategory, FurnitureItem
+from main.catalog_import import (
+    SlugRegistry,
+    categories_by_name,
+    iter_category_items,
+)
+from main.models import FurnitureItem
 
 
 class Command(BaseCommand):
@@ -17,96 +23,157 @@ class Command(BaseCommand):
             help="Path to JSON file with furniture data",
             default="/var/www/gos_landing_page/all_files.json",
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of items written per bulk_update transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show what would change without writing anything",
+        )
 
     def handle(self, *args, **options):
         json_file_path = options["json_file"]
+        self.dry_run = options["dry_run"]
+        self.batch_size = options["batch_size"]
+        self.verbosity = options["verbosity"]
 
         # Check if file exists
         if not os.path.exists(json_file_path):
             self.stdout.write(self.style.ERROR(f"File {json_file_path} does not exist"))
             return
 
-        # Read the JSON data
         self.stdout.write(f"Reading data from {json_file_path}")
-        with open(json_file_path, "r", encoding="utf-8") as file:
-            data = json.load(file)
+        started = time.monotonic()
 
         # Track statistics
-        stats = {
+        self.stats = {
+            "rows": 0,
             "updated": 0,
+            "unchanged": 0,
             "not_found": 0,
             "categories_processed": 0,
         }
-
-        # Process each category
-        for category_name, items in data.items():
-            stats["categories_processed"] += 1
-            self.stdout.write(f"Processing category: {category_name}")
-
-            # Try to find the category
-            try:
-                category = FurnitureCategory.objects.get(name=category_name)
-                self.stdout.write(
-                    self.style.SUCCESS(f"Found category: {category_name}")
-                )
-            except FurnitureCategory.DoesNotExist:
-                self.stdout.write(
-                    self.style.WARNING(
-                        f"Category {category_name} not found. Skipping items in this category."
-                    )
-                )
-                continue
-
-            # Process each item in the category
-            for item_data in items:
-                old_name = item_data.get("old_name", "")
-                new_name = item_data.get("new_name", "")
-                description = item_data.get("description", "")
-
-                if not old_name or not new_name:
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"Skipping item with missing old_name or new_name: {item_data}"
-                        )
-                    )
-                    continue
-
-                # Try to find the item by old_name
-                try:
-                    item = FurnitureItem.objects.get(name=old_name, category=category)
-
-                    # Update the item
-                    item.name = new_name
-                    item.description = description
-
-                    # Update slug if needed
-                    new_slug = slugify(new_name)
-                    if not new_slug:
-                        # If slugify produces an empty string (e.g., for non-Latin characters),
-                        # create a slug based on the item ID
-                        new_slug = f"item-{item.id}"
-
-                    item.slug = new_slug
-                    item.save()
-
-                    stats["updated"] += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(f"Updated item: {old_name} → {new_name}")
-                    )
-                except FurnitureItem.DoesNotExist:
-                    stats["not_found"] += 1
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"Item not found: {old_name} in category {category_name}"
-                        )
-                    )
+        self.categories = categories_by_name()
+        self.slugs = SlugRegistry()
+        self.pending = []
+
+        current_name = None
+        items = None
+        # The file is parsed incrementally; only the items of the current
+        # category and the pending batch are held in memory.
+        with open(json_file_path, "r", encoding="utf-8") as file:
+            for category_name, item_data in iter_category_items(file):
+                self.stats["rows"] += 1
+                if category_name != current_name:
+                    current_name = category_name
+                    items = self._start_category(category_name)
+                if items is not None:
+                    self._process_item(category_name, item_data, items)
+        self._flush()
+
+        elapsed = time.monotonic() - started
+        rate = self.stats["rows"] / elapsed if elapsed else 0
 
         # Print summary
         self.stdout.write(
             self.style.SUCCESS(
-                f"Furniture update completed! "
-                f"Categories processed: {stats['categories_processed']}, "
-                f"Items updated: {stats['updated']}, "
-                f"Items not found: {stats['not_found']}"
+                f"Furniture update {'dry run ' if self.dry_run else ''}completed! "
+                f"Categories processed: {self.stats['categories_processed']}, "
+                f"Items updated: {self.stats['updated']}, "
+                f"Items unchanged: {self.stats['unchanged']}, "
+                f"Items not found: {self.stats['not_found']} "
+                f"({self.stats['rows']} rows in {elapsed:.2f}s, {rate:.0f} rows/s)"
             )
         )
+
+    def _start_category(self, category_name):
+        """Return the category's items keyed by name, or None to skip it."""
+        self.stats["categories_processed"] += 1
+        self.stdout.write(f"Processing category: {category_name}")
+
+        category = self.categories.get(category_name)
+        if category is None:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Category {category_name} not found. Skipping items in this category."
+                )
+            )
+            return None
+        self.stdout.write(self.style.SUCCESS(f"Found category: {category_name}"))
+
+        # One query per category instead of one per item
+        return {
+            item.name: item
+            for item in FurnitureItem.objects.filter(category=category).only(
+                "id", "name", "description", "slug", "category_id"
+            )
+        }
+
+    def _process_item(self, category_name, item_data, items):
+        old_name = item_data.get("old_name", "")
+        new_name = item_data.get("new_name", "")
+        description = item_data.get("description", "")
+
+        if not old_name or not new_name:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Skipping item with missing old_name or new_name: {item_data}"
+                )
+            )
+            return
+
+        # Items renamed by a previous run are found by their new name,
+        # which makes the import idempotent.
+        item = items.get(old_name) or items.get(new_name)
+        if item is None:
+            self.stats["not_found"] += 1
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Item not found: {old_name} in category {category_name}"
+                )
+            )
+            return
+
+        if item.name == new_name and item.description == description:
+            self.stats["unchanged"] += 1
+            return
+
+        if self.dry_run or self.verbosity > 1:
+            self._write_diff(item, new_name, description)
+
+        items.pop(item.name, None)
+        item.name = new_name
+        item.description = description
+        # If slugify produces an empty string (e.g., for non-Latin characters),
+        # the slug is based on the item ID; collisions get a numeric suffix.
+        item.slug = self.slugs.claim(new_name, f"item-{item.id}", current=item.slug)
+        item.updated_at = timezone.now()
+        items[new_name] = item
+
+        self.stats["updated"] += 1
+        self.pending.append(item)
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def _write_diff(self, item, new_name, description):
+        if item.name != new_name:
+            self.stdout.write(f"  ~ {item.name} → {new_name}")
+        else:
+            self.stdout.write(f"  ~ {item.name}")
+        if item.description != description:
+            self.stdout.write(f"    - {item.description[:80]}")
+            self.stdout.write(f"    + {description[:80]}")
+
+    def _flush(self):
+        if not self.pending:
+            return
+        if not self.dry_run:
+            with transaction.atomic():
+                FurnitureItem.objects.bulk_update(
+                    self.pending, ["name", "description", "slug", "updated_at"]
+                )
+        self.pending = []
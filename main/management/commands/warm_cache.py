@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import qrcodes, stats
+from main.caching import LOCATIONS, PAGES, STATS
+from main.models import Location
+from main.views import LANDING_CATEGORIES, landing_categories
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the hot cache keys after a deploy: landing categories, "
+        "QR code images, QR versions and heatmaps"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--site-url",
+            default=settings.SITE_URL,
+            help="Host the QR codes are rendered for (default: SITE_URL)",
+        )
+
+    def handle(self, *args, **options):
+        locations = list(Location.objects.order_by("pk").only("pk", "qr_version"))
+        location_ids = [location.pk for location in locations]
+        steps = [
+            ("Landing categories", lambda: self._landing()),
+            ("QR codes", lambda: self._qr_codes(locations, options["site_url"])),
+            ("QR versions", lambda: self._versions(locations)),
+            ("Heatmaps", lambda: self._heatmaps(location_ids)),
+        ]
+        for label, step in steps:
+            started = time.monotonic()
+            count = step()
+            self.stdout.write(
+                self.style.SUCCESS(f"{label}: {count} keys in {time.monotonic() - started:.2f}s")
+            )
+
+    def _landing(self):
+        PAGES.refresh(lambda: list(landing_categories()), *LANDING_CATEGORIES)
+        return 1
+
+    def _qr_codes(self, locations, site_url):
+        return qrcodes.prerender(site_url, locations)
+
+    def _versions(self, locations):
+        for location in locations:
+            LOCATIONS.set(location.qr_version, location.pk)
+        return len(locations)
+
+    def _heatmaps(self, location_ids):
+        for location_id in location_ids:
+            STATS.refresh(lambda: stats.location_heatmap([location_id]), "heatmap", location_id)
+        return len(location_ids)
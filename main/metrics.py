@@ -0,0 +1,234 @@
+"""Per-process request, SQL, cache and bot metrics in Prometheus text format.
+
+Recording is lock-free: every thread writes to its own shard of plain
+dicts, and shards are only summed when the metrics are exported. Each
+process (gunicorn worker, ``run_telegram_bot``) also writes its totals to
+``METRICS_DIR`` every ``METRICS_FLUSH_INTERVAL`` seconds. The ``/metrics/``
+endpoint adds up those snapshots and its own live counters, so a scrape
+covers all processes whichever worker answers it.
+
+Nothing is recorded while ``METRICS_TOKEN`` is empty.
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "gos_http_request_duration_seconds": (
+        "histogram", "Time spent handling a request, by view", LATENCY_BUCKETS
+    ),
+    "gos_http_response_size_bytes_total": (
+        "counter", "Bytes of non-streaming response bodies", None
+    ),
+    "gos_db_queries_per_request": (
+        "histogram", "SQL queries executed by one request", QUERY_COUNT_BUCKETS
+    ),
+    "gos_db_query_duration_seconds_total": ("counter", "Time spent in SQL queries", None),
+    "gos_cache_requests_total": ("counter", "Application cache lookups by result", None),
+    "gos_bot_command_duration_seconds": (
+        "histogram", "Time spent handling a Telegram bot command", LATENCY_BUCKETS
+    ),
+    "gos_bot_command_errors_total": ("counter", "Telegram bot commands that failed", None),
+    "gos_rate_limited_requests_total": (
+        "counter", "Requests refused by the rate limiter, by endpoint and bucket", None
+    ),
+    "gos_qr_visits_total": (
+        "counter", "QR visit URLs by kind: token, fallback_key, legacy or invalid", None
+    ),
+}
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()  # only taken when a thread records for the first time
+_role = "web"
+_next_flush = 0.0
+
+
+def enabled() -> bool:
+    return bool(settings.METRICS_TOKEN)
+
+
+def set_role(role: str) -> None:
+    """Name the process in its ``METRICS_DIR`` snapshot (``web``, ``bot``)."""
+    global _role
+    _role = role
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = (defaultdict(float), {})
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def inc(name: str, labels: tuple = (), value: float = 1) -> None:
+    _shard()[0][(name, labels)] += value
+
+
+def observe(name: str, labels: tuple, value: float) -> None:
+    buckets = METRICS[name][2]
+    histograms = _shard()[1]
+    data = histograms.get((name, labels))
+    if data is None:
+        # Per-bucket counts, the +Inf bucket, then the sum
+        data = histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+    data[bisect_left(buckets, value)] += 1
+    data[-1] += value
+
+
+def cache_lookup(cache_name: str, hit: bool) -> None:
+    if enabled():
+        inc("gos_cache_requests_total", (("cache", cache_name), ("result", "hit" if hit else "miss")))
+
+
+def rate_limited(endpoint: str, bucket: str) -> None:
+    if enabled():
+        inc("gos_rate_limited_requests_total", (("endpoint", endpoint), ("bucket", bucket)))
+
+
+def qr_visit(kind: str) -> None:
+    if enabled():
+        inc("gos_qr_visits_total", (("kind", kind),))
+
+
+def collect() -> dict:
+    """Totals of this process as ``{"counters": [...], "histograms": [...]}``."""
+    counters = defaultdict(float)
+    histograms = {}
+    for shard_counters, shard_histograms in list(_shards):
+        # dict.copy() is atomic, unlike iterating a dict another thread writes
+        for key, value in shard_counters.copy().items():
+            counters[key] += value
+        for key, data in shard_histograms.copy().items():
+            total = histograms.setdefault(key, [0] * len(data))
+            for i, value in enumerate(list(data)):
+                total[i] += value
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, list(labels), data] for (name, labels), data in histograms.items()],
+    }
+
+
+def _snapshot_path() -> str:
+    return os.path.join(settings.METRICS_DIR, f"{_role}-{os.getpid()}.json")
+
+
+def flush() -> None:
+    path = _snapshot_path()
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(collect(), fp)
+    os.replace(tmp, path)
+
+
+def maybe_flush() -> None:
+    """Write this process's snapshot if the flush interval has passed."""
+    global _next_flush
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if now < _next_flush:
+        return
+    _next_flush = now + settings.METRICS_FLUSH_INTERVAL
+    try:
+        flush()
+    except OSError:
+        pass  # metrics must never break a request
+
+
+def merged() -> dict:
+    """Live totals of this process plus the snapshots of the other ones.
+
+    Snapshots of exited processes are kept so that counters never go
+    down; remove the files when redeploying to start from zero.
+    """
+    snapshots = [collect()]
+    if settings.METRICS_DIR:
+        own = _snapshot_path()
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path, encoding="utf-8") as fp:
+                    snapshots.append(json.load(fp))
+            except (OSError, ValueError):
+                continue
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, data in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(data))
+            for i, value in enumerate(data):
+                total[i] += value
+    return {"counters": counters, "histograms": histograms}
+
+
+def _labels(labels, extra=()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    data = merged()
+    by_name = defaultdict(list)
+    for (name, labels), value in data["counters"].items():
+        by_name[name].append((labels, value))
+    for (name, labels), value in data["histograms"].items():
+        by_name[name].append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted(by_name.get(name, []))
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, math.inf), value[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{_labels(labels, [('le', _number(float(bound)))])} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
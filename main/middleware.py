@@ -0,0 +1,230 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics, profiling, querystats, visits
+
+# Anything else is recorded as "other" so clients cannot add label values
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+class QueryTimer:
+    """Counts the queries of one request and their time."""
+
+    __slots__ = ("count", "duration")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+_current_timer = ContextVar("query_timer", default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection.
+
+    Connections are per thread, and async views run their queries in a
+    worker thread. The request's timer is found through a context
+    variable, which ``sync_to_async`` carries over, instead of wrapping
+    the connections of the request thread only.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.duration += time.perf_counter() - start
+        timer.count += 1
+
+
+def install_query_timer(connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class HybridMiddleware:
+    """Base of middleware that runs natively under both WSGI and ASGI."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Per-view latency, SQL, and response size metrics (see main.metrics).
+
+    Removed from the stack entirely while ``METRICS_TOKEN`` is empty.
+    Keep it first in ``MIDDLEWARE`` so the time of the others is included.
+    """
+
+    def __init__(self, get_response):
+        if not metrics.enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        connection_created.connect(install_query_timer, dispatch_uid="metrics_query_timer")
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = _current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        self._record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        token = _current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        self._record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _record(request, response, timer, duration):
+        match = request.resolver_match
+        view = match.view_name if match else "<unresolved>"
+        method = request.method if request.method in HTTP_METHODS else "other"
+        metrics.observe(
+            "gos_http_request_duration_seconds",
+            (("view", view), ("method", method), ("status", str(response.status_code))),
+            duration,
+        )
+        labels = (("view", view),)
+        metrics.observe("gos_db_queries_per_request", labels, timer.count)
+        if timer.count:
+            metrics.inc("gos_db_query_duration_seconds_total", labels, timer.duration)
+        if not response.streaming:
+            metrics.inc("gos_http_response_size_bytes_total", labels, len(response.content))
+        metrics.maybe_flush()
+
+
+class VisitTrackingMiddleware(HybridMiddleware):
+    """Add page views to the visit sessions they belong to (see main.visits).
+
+    Removed from the stack while ``VISIT_TRACKING_ENABLED`` is off. The
+    request that makes a flush due writes the buffered events before its
+    response is returned; idle and exiting workers flush on their own.
+    """
+
+    def __init__(self, get_response):
+        if not visits.enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        visits.track(request, response)
+        if visits.flush_due():
+            visits.flush()
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        visits.track(request, response)
+        if visits.flush_due():
+            await sync_to_async(visits.flush)()
+        return response
+
+
+class QueryStatsMiddleware(HybridMiddleware):
+    """Attribute the SQL of each request to its view (see main.querystats).
+
+    Removed from the stack while ``QUERY_STATS_ENABLED`` is off.
+    """
+
+    def __init__(self, get_response):
+        if not querystats.enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        querystats.install_all()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with querystats.capture(request):
+            response = self.get_response(request)
+        if querystats.flush_due():
+            querystats.flush()
+        return response
+
+    async def __acall__(self, request):
+        with querystats.capture(request):
+            response = await self.get_response(request)
+        if querystats.flush_due():
+            await sync_to_async(querystats.flush)()
+        return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """Sample the stacks of some requests (see main.profiling).
+
+    Removed from the stack while ``PROFILING_ENABLED`` is off. Place it
+    after ``AuthenticationMiddleware``: staff requests with an
+    ``X-Profile`` header are always profiled and get the stored profile's
+    id in an ``X-Profile-Id`` response header.
+    """
+
+    def __init__(self, get_response):
+        if not profiling.enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if profiling.sampled():
+            trigger = "rate"
+        elif profiling.PROFILE_HEADER in request.headers and request.user.is_staff:
+            trigger = "header"
+        else:
+            return self.get_response(request)
+        with profiling.Sampler({threading.get_ident()}) as sampler:
+            response = self.get_response(request)
+        self._save(request, response, sampler, trigger)
+        return response
+
+    async def __acall__(self, request):
+        if profiling.sampled():
+            trigger = "rate"
+        elif profiling.PROFILE_HEADER in request.headers and (await request.auser()).is_staff:
+            trigger = "header"
+        else:
+            return await self.get_response(request)
+        # The ORM calls of async views run in executor threads
+        with profiling.Sampler() as sampler:
+            response = await self.get_response(request)
+        await sync_to_async(self._save)(request, response, sampler, trigger)
+        return response
+
+    @staticmethod
+    def _save(request, response, sampler, trigger):
+        match = request.resolver_match
+        source = match.view_name if match else request.path
+        profile = profiling.save(sampler, f"{request.method} {source}", trigger)
+        if profile is not None and trigger == "header":
+            response["X-Profile-Id"] = str(profile.pk)
@@ -2,10 +2,13 @@ import uuid
 
 from django.db import models
 from django.db.models.deletion import ProtectedError
+from django.utils import timezone
 from django.utils.text import slugify
 
 from users.models import CustomUser
 
+from .images import ensure_derivatives, file_sha256
+
 # Create your models here.
 
 
@@ -19,6 +22,8 @@ class Location(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ManyToManyField(CustomUser, related_name="locations")
+    # Part of the signed QR token; bumping it revokes the printed codes
+    qr_version = models.PositiveIntegerField(default=1)
 
     objects = LocationQuerySet.as_manager()
 
@@ -36,11 +41,16 @@ class QRCodeScan(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    visit_id = models.UUIDField(default=uuid.uuid4, editable=False, null=True)
+    visit_id = models.UUIDField(
+        default=uuid.uuid4, editable=False, null=True, db_index=True
+    )
 
     class Meta:
         verbose_name = "Скан QR-кода"
         verbose_name_plural = "Сканы QR-кодов"
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="qrcodescan_timestamp_id_idx")
+        ]
 
 
 class PhoneClick(models.Model):
@@ -52,6 +62,9 @@ class PhoneClick(models.Model):
     class Meta:
         verbose_name = "Клик по номеру телефона"
         verbose_name_plural = "Клики по номерам телефонов"
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="phoneclick_timestamp_id_idx")
+        ]
 
 
 class FurnitureCategory(models.Model):
@@ -107,6 +120,13 @@ class FurnitureItem(models.Model):
     main_image = models.ImageField(
         upload_to="furniture/", verbose_name="Основное изображение"
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name="Хэш основного изображения",
+    )
     is_featured = models.BooleanField(default=False, verbose_name="Рекомендуемый товар")
     is_active = models.BooleanField(default=True, verbose_name="Активен")
     dimensions = models.CharField(max_length=100, blank=True, verbose_name="Размеры")
@@ -125,6 +145,9 @@ class FurnitureItem(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if self.main_image and not self.main_image._committed:
+            self.content_hash = file_sha256(self.main_image)
+            ensure_derivatives(self.content_hash, self.main_image)
         super().save(*args, **kwargs)
 
 
@@ -141,6 +164,13 @@ class FurnitureImage(models.Model):
     alt_text = models.CharField(
         max_length=100, blank=True, verbose_name="Альтернативный текст"
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name="Хэш изображения",
+    )
     order = models.PositiveIntegerField(default=0, verbose_name="Порядок отображения")
 
     class Meta:
@@ -150,3 +180,267 @@ class FurnitureImage(models.Model):
 
     def __str__(self):
         return f"Изображение для {self.furniture.name}"
+
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            self.content_hash = file_sha256(self.image)
+            ensure_derivatives(self.content_hash, self.image)
+        super().save(*args, **kwargs)
+
+
+class ImageFingerprint(models.Model):
+    """Exact and perceptual hash of one stored catalog file.
+
+    Maintained by the deduplicating storage; ``phash_band*`` split the
+    perceptual hash so near-duplicates are found through indexed equality
+    lookups instead of comparing against every image.
+    """
+
+    name = models.CharField(max_length=255, unique=True, verbose_name="Файл")
+    sha256 = models.CharField(max_length=64, db_index=True, verbose_name="SHA-256")
+    phash = models.CharField(max_length=16, blank=True, verbose_name="Перцептивный хэш")
+    phash_band0 = models.CharField(max_length=4, blank=True)
+    phash_band1 = models.CharField(max_length=4, blank=True)
+    phash_band2 = models.CharField(max_length=4, blank=True)
+    phash_band3 = models.CharField(max_length=4, blank=True)
+    size = models.PositiveIntegerField(default=0, verbose_name="Размер (байт)")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Отпечаток изображения"
+        verbose_name_plural = "Отпечатки изображений"
+        indexes = [
+            models.Index(fields=["phash_band0"], name="imagefp_band0_idx"),
+            models.Index(fields=["phash_band1"], name="imagefp_band1_idx"),
+            models.Index(fields=["phash_band2"], name="imagefp_band2_idx"),
+            models.Index(fields=["phash_band3"], name="imagefp_band3_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class FurnitureItemView(models.Model):
+    """One view of a furniture detail page, keyed by an anonymous visitor id.
+
+    Only used to derive "viewed together" recommendations.
+    """
+
+    item = models.ForeignKey(
+        FurnitureItem, on_delete=models.CASCADE, related_name="views"
+    )
+    visitor_id = models.UUIDField(db_index=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Просмотр товара"
+        verbose_name_plural = "Просмотры товаров"
+
+
+class RelatedItem(models.Model):
+    """Precomputed recommendation shown on an item's detail page.
+
+    Rows are rebuilt per category by ``refresh_recommendations``;
+    ``computed_at`` is compared with the items' ``updated_at`` to find
+    categories that need a refresh.
+    """
+
+    item = models.ForeignKey(
+        FurnitureItem, on_delete=models.CASCADE, related_name="recommendations"
+    )
+    related = models.ForeignKey(
+        FurnitureItem, on_delete=models.CASCADE, related_name="+"
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Рекомендация"
+        verbose_name_plural = "Рекомендации"
+        ordering = ["item", "rank"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["item", "rank"], name="unique_related_item_rank"
+            )
+        ]
+
+
+class LocationHeatmapCell(models.Model):
+    """Scan and click counters for one hour-of-week slot of a location.
+
+    Slots are in ``settings.STATS_TIME_ZONE``; ``weekday`` is 0 for Monday.
+    Rows are bumped as scans and clicks are recorded, so a 7×24 heatmap is
+    read from at most 168 rows regardless of how much history exists.
+    """
+
+    location = models.ForeignKey(
+        Location, on_delete=models.CASCADE, related_name="heatmap_cells"
+    )
+    weekday = models.PositiveSmallIntegerField()
+    hour = models.PositiveSmallIntegerField()
+    scans = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Ячейка тепловой карты"
+        verbose_name_plural = "Тепловая карта по часам недели"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["location", "weekday", "hour"],
+                name="unique_location_heatmap_cell",
+            )
+        ]
+
+
+class LocationHourlyStats(models.Model):
+    """Scan and click counters of a location for one UTC hour.
+
+    Maintained alongside the heatmap; coarser time series (days, weeks,
+    months in any timezone) are summed from these rows instead of the raw
+    scans. ``updated_at`` serves as the watermark for conditional requests.
+    """
+
+    location = models.ForeignKey(
+        Location, on_delete=models.CASCADE, related_name="hourly_stats"
+    )
+    hour = models.DateTimeField()
+    scans = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Почасовая статистика"
+        verbose_name_plural = "Почасовая статистика"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["location", "hour"], name="unique_location_hourly_stats"
+            )
+        ]
+        indexes = [models.Index(fields=["hour"])]
+
+
+class VisitSession(models.Model):
+    """What one QR visit did after the scan, keyed by ``QRCodeScan.visit_id``.
+
+    Page views and phone clicks are buffered in memory and added in
+    batches by :mod:`main.visits`. ``stage`` is the furthest funnel stage
+    reached (0 scan, 1 catalog, 2 item, 3 call); it is ``None`` until the
+    session is counted in ``LocationFunnelStats``. ``visitor_hash`` is a
+    keyed hash of the visitor cookie. Statically exported catalog pages
+    count only through their JavaScript beacon (see
+    :mod:`main.static_export`).
+    """
+
+    visit_id = models.UUIDField(unique=True)
+    location = models.ForeignKey(
+        Location, on_delete=models.CASCADE, related_name="visit_sessions"
+    )
+    started_at = models.DateTimeField(db_index=True, verbose_name="Начало")
+    last_seen_at = models.DateTimeField(verbose_name="Последнее действие")
+    visitor_hash = models.CharField(max_length=32, blank=True, db_index=True)
+    returning = models.BooleanField(default=False, verbose_name="Повторный посетитель")
+    landing_views = models.PositiveIntegerField(default=0, verbose_name="Главная")
+    catalog_views = models.PositiveIntegerField(default=0, verbose_name="Каталог")
+    category_views = models.PositiveIntegerField(default=0, verbose_name="Категории")
+    item_views = models.PositiveIntegerField(default=0, verbose_name="Товары")
+    calls = models.PositiveIntegerField(default=0, verbose_name="Звонки")
+    stage = models.PositiveSmallIntegerField(null=True, verbose_name="Этап воронки")
+
+    class Meta:
+        verbose_name = "Визит"
+        verbose_name_plural = "Визиты"
+
+
+class LocationFunnelStats(models.Model):
+    """Funnel counters of a location for one day in ``STATS_TIME_ZONE``.
+
+    Sessions count on the day they started; each stage counts the
+    sessions that reached at least that stage. Maintained by
+    :mod:`main.visits` and rebuilt from ``VisitSession`` by
+    ``rebuild_stats``.
+    """
+
+    location = models.ForeignKey(
+        Location, on_delete=models.CASCADE, related_name="funnel_stats"
+    )
+    day = models.DateField()
+    sessions = models.PositiveIntegerField(default=0)
+    returning = models.PositiveIntegerField(default=0)
+    catalog = models.PositiveIntegerField(default=0)
+    item = models.PositiveIntegerField(default=0)
+    calls = models.PositiveIntegerField(default=0)
+    page_views = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Воронка по дням"
+        verbose_name_plural = "Воронка по дням"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["location", "day"], name="unique_location_funnel_day"
+            )
+        ]
+        indexes = [models.Index(fields=["day"])]
+
+
+class QueryStat(models.Model):
+    """Aggregated timings of one SQL fingerprint issued by one view or bot command.
+
+    Written by :mod:`main.querystats`; ``buckets`` counts executions per
+    ``querystats.BUCKETS_MS`` latency bucket, the last one being the overflow.
+    """
+
+    fingerprint = models.CharField(max_length=16, verbose_name="Отпечаток")
+    source = models.CharField(max_length=200, verbose_name="Источник")
+    sql = models.TextField(verbose_name="SQL")
+    count = models.PositiveBigIntegerField(default=0, verbose_name="Выполнений")
+    total_ms = models.FloatField(default=0, verbose_name="Всего, мс")
+    max_ms = models.FloatField(default=0, verbose_name="Максимум, мс")
+    buckets = models.JSONField(default=list, verbose_name="Гистограмма")
+    explain_sql = models.TextField(blank=True, verbose_name="Запрос для EXPLAIN")
+    explain_plan = models.TextField(blank=True, verbose_name="План выполнения")
+    explained_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата плана")
+    first_seen = models.DateTimeField(auto_now_add=True, verbose_name="Впервые")
+    last_seen = models.DateTimeField(default=timezone.now, verbose_name="Последний раз")
+
+    class Meta:
+        verbose_name = "Статистика SQL-запроса"
+        verbose_name_plural = "Статистика SQL-запросов"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["fingerprint", "source"], name="unique_querystat_fingerprint_source"
+            )
+        ]
+        indexes = [models.Index(fields=["-total_ms"], name="querystat_total_idx")]
+
+    def __str__(self):
+        return f"{self.source}: {self.sql[:80]}"
+
+
+class Profile(models.Model):
+    """Collapsed stack samples of one profiled request or bot command.
+
+    Written by :mod:`main.profiling`; ``stacks`` has one ``frame;frame count``
+    line per distinct stack, the input format of flamegraph.pl and speedscope.
+    """
+
+    TRIGGER_CHOICES = [
+        ("rate", "Случайная выборка"),
+        ("header", "Заголовок X-Profile"),
+    ]
+
+    source = models.CharField(max_length=200, verbose_name="Источник")
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES, verbose_name="Причина")
+    started_at = models.DateTimeField(db_index=True, verbose_name="Начало")
+    duration_ms = models.FloatField(verbose_name="Длительность, мс")
+    sample_count = models.PositiveIntegerField(verbose_name="Замеров")
+    stacks = models.TextField(verbose_name="Стеки")
+
+    class Meta:
+        verbose_name = "Профиль"
+        verbose_name_plural = "Профили"
+        ordering = ["-started_at"]
+
+    def __str__(self):
+        return f"{self.source} ({self.started_at:%Y-%m-%d %H:%M:%S})"
@@ -0,0 +1,171 @@
+"""Opt-in sampling profiler for requests and bot commands.
+
+A profiled request or command gets a sampler thread that reads the
+interpreter stacks every ``PROFILING_INTERVAL_MS`` and counts them in the
+collapsed format of flamegraph.pl and speedscope (``a;b;c 12``). Nothing is
+traced, so the profiled code runs at full speed apart from the sampling.
+
+``PROFILING_SAMPLE_RATE`` of the requests and bot commands are profiled,
+plus the requests of staff users that send an ``X-Profile`` header. Each
+one becomes a :class:`~main.models.Profile`. At most
+``PROFILING_MAX_STACKS`` distinct stacks are kept per profile and
+``PROFILING_MAX_PROFILES`` profiles overall. The oldest are deleted.
+
+While ``PROFILING_ENABLED`` is off the middleware is removed and bot
+handlers are not wrapped.
+
+Sync requests sample only their own thread. Async requests and bot
+commands sample every thread, because their ORM calls run in executor
+threads. Concurrent requests therefore show up in their stacks too.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+PROFILE_HEADER = "X-Profile"
+MAX_DEPTH = 128
+TRUNCATED = "[truncated]"
+
+# Leaf frames of threads that are waiting for work, not doing any
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+
+def enabled() -> bool:
+    return settings.PROFILING_ENABLED
+
+
+def sampled() -> bool:
+    rate = settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def _frame_name(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_qualname}"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def collapse(frame) -> str:
+    """``root;...;leaf`` for a frame, keeping the innermost ``MAX_DEPTH``."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Counts the stacks of ``thread_ids`` (all other threads if ``None``)."""
+
+    def __init__(self, thread_ids=None, interval_ms=None):
+        self.thread_ids = thread_ids
+        self.interval = (interval_ms or settings.PROFILING_INTERVAL_MS) / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def __enter__(self):
+        self.started_at = timezone.now()
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if self.thread_ids is None:
+                    if _is_idle(frame):
+                        continue
+                elif thread_id not in self.thread_ids:
+                    continue
+                if self._stop.is_set():
+                    return  # the profiled code is done and waiting for us
+                self.stacks[collapse(frame)] += 1
+
+    def collapsed(self, limit=None) -> str:
+        """The stacks in collapsed format, the rarest merged past ``limit``."""
+        limit = limit or settings.PROFILING_MAX_STACKS
+        common = self.stacks.most_common()
+        kept, rest = common[:limit], common[limit:]
+        lines = [f"{stack} {count}" for stack, count in kept]
+        if rest:
+            lines.append(f"{TRUNCATED} {sum(count for _, count in rest)}")
+        return "\n".join(lines)
+
+
+def save(sampler: Sampler, source: str, trigger: str):
+    """Store a finished profile and delete the oldest ones past the limit."""
+    from .models import Profile
+
+    if not sampler.stacks:
+        return None
+    try:
+        profile = Profile.objects.create(
+            source=source[:200],
+            trigger=trigger,
+            started_at=sampler.started_at,
+            duration_ms=sampler.duration * 1000,
+            sample_count=sampler.samples,
+            stacks=sampler.collapsed(),
+        )
+        stale = list(
+            Profile.objects.order_by("-started_at", "-pk").values_list("pk", flat=True)[
+                settings.PROFILING_MAX_PROFILES :
+            ]
+        )
+        if stale:
+            Profile.objects.filter(pk__in=stale).delete()
+    except DatabaseError:
+        return None  # profiling must never break a request
+    return profile
+
+
+def merge(collapsed_texts) -> str:
+    """Add up several collapsed profiles into one."""
+    totals = Counter()
+    for text in collapsed_texts:
+        for line in text.splitlines():
+            stack, _, count = line.rpartition(" ")
+            if stack and count.isdigit():
+                totals[stack] += int(count)
+    return "\n".join(f"{stack} {count}" for stack, count in totals.most_common()) + "\n"
+
+
+def hot_functions(collapsed_text: str, limit: int = 20) -> list[tuple[str, int]]:
+    """Functions with the most samples at the top of the stack (self time)."""
+    totals = Counter()
+    for line in collapsed_text.splitlines():
+        stack, _, count = line.rpartition(" ")
+        if stack and count.isdigit():
+            totals[stack.rsplit(";", 1)[-1]] += int(count)
+    return totals.most_common(limit)
@@ -0,0 +1,159 @@
+"""QR codes of locations: the signed visit URLs they encode and their images.
+
+A QR code points to ``/v/<token>/``. The token carries the location id
+and its ``qr_version``, both base62, and a truncated HMAC of the two:
+``"g7.1.Xk2c9Qe1Rt0a"``. The signature alone proves the location exists
+(locations are never deleted), so a scan needs no ``Location`` query.
+Only the current version is read, from the shared cache. Bumping
+``qr_version`` revokes the printed codes of a location.
+
+Tokens are signed with ``QR_SIGNING_KEY`` and also accepted under the
+keys in ``QR_SIGNING_KEY_FALLBACKS``. To rotate the key, move the old
+one to the fallbacks. Keep it there as long as codes signed with it
+are still in use.
+
+Codes printed before the tokens point to ``/visit/<id>/``. Their ids are
+checked against the database once per process and then kept in memory.
+"""
+
+from __future__ import annotations
+
+import base64
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.core.signing import b62_decode, b62_encode
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from . import metrics
+from .caching import LOCATIONS, QR_CODES
+from .models import Location
+
+SALT = "main.qrcodes.visit"
+# 72 bits: 12 URL-safe base64 characters, out of reach of online guessing
+SIGNATURE_BYTES = 9
+TOKEN_RE = re.compile(r"([0-9A-Za-z]{1,11})\.([0-9A-Za-z]{1,6})\.([\w-]{12})")
+
+# Ids of existing locations, for the unsigned /visit/<id>/ URLs
+_known_ids = set()
+
+
+def _signature(payload: str, key: str) -> str:
+    digest = salted_hmac(SALT, payload, secret=key, algorithm="sha256").digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode()
+
+
+def make_token(location_id: int, version: int) -> str:
+    payload = f"{b62_encode(location_id)}.{b62_encode(version)}"
+    return f"{payload}.{_signature(payload, settings.QR_SIGNING_KEY)}"
+
+
+def read_token(token: str) -> tuple[int, int] | None:
+    """``(location id, version)`` of a validly signed token, else ``None``."""
+    match = TOKEN_RE.fullmatch(token)
+    if match is None:
+        metrics.qr_visit("invalid")
+        return None
+    location_id, version, signature = match.groups()
+    payload = f"{location_id}.{version}"
+    for kind, key in [
+        ("token", settings.QR_SIGNING_KEY),
+        *(("fallback_key", key) for key in settings.QR_SIGNING_KEY_FALLBACKS),
+    ]:
+        if constant_time_compare(signature, _signature(payload, key)):
+            metrics.qr_visit(kind)
+            return b62_decode(location_id), b62_decode(version)
+    metrics.qr_visit("invalid")
+    return None
+
+
+def current_version(location_id: int) -> int | None:
+    """The location's ``qr_version``, cached; ``None`` if there is no such location."""
+    version = LOCATIONS.get(location_id)
+    if version is None:
+        version = (
+            Location.objects.filter(id=location_id).values_list("qr_version", flat=True).first()
+        )
+        if version is not None:
+            LOCATIONS.set(version, location_id)
+    return version
+
+
+async def acurrent_version(location_id: int) -> int | None:
+    """Async :func:`current_version`."""
+    version = await LOCATIONS.aget(location_id)
+    if version is None:
+        version = await (
+            Location.objects.filter(id=location_id).values_list("qr_version", flat=True).afirst()
+        )
+        if version is not None:
+            await LOCATIONS.aset(version, location_id)
+    return version
+
+
+def forget_versions(location_ids) -> None:
+    """Drop cached versions after ``qr_version`` was changed."""
+    LOCATIONS.cache.delete_many([LOCATIONS.key(location_id) for location_id in location_ids])
+
+
+def location_exists(location_id: int) -> bool:
+    """Whether an unsigned ``/visit/<id>/`` URL is for an existing location."""
+    if location_id not in _known_ids and Location.objects.filter(id=location_id).exists():
+        _known_ids.add(location_id)
+    return _legacy(location_id)
+
+
+async def alocation_exists(location_id: int) -> bool:
+    """Async :func:`location_exists`."""
+    if location_id not in _known_ids and await Location.objects.filter(id=location_id).aexists():
+        _known_ids.add(location_id)
+    return _legacy(location_id)
+
+
+def _legacy(location_id) -> bool:
+    # Never invalidated: locations cannot be deleted
+    known = location_id in _known_ids
+    metrics.qr_visit("legacy" if known else "invalid")
+    return known
+
+
+def visit_url(site_url: str, location: Location) -> str:
+    """The URL a location's QR code points to."""
+    return f"{site_url.rstrip('/')}/v/{make_token(location.id, location.qr_version)}/"
+
+
+def render_png(url: str) -> bytes:
+    buffer = BytesIO()
+    qrcode.make(url).save(buffer)
+    return buffer.getvalue()
+
+
+def _render_timed(url):
+    started = time.perf_counter()
+    return render_png(url), time.perf_counter() - started
+
+
+def location_png(site_url: str, location: Location) -> bytes:
+    """PNG of a location's QR code, rendered on a cache miss."""
+    url = visit_url(site_url, location)
+    # Keyed by URL too: the admin and the public page may use other hosts,
+    # and a new version or signing key changes the URL
+    return QR_CODES.get_or_set(lambda: render_png(url), location.id, url)
+
+
+def prerender(site_url: str, locations, workers: int | None = None) -> int:
+    """Render the QR codes of many locations into the cache, in parallel.
+
+    Rendering is pure Python, so it is spread over ``workers`` processes
+    (default: one per CPU).
+    """
+    urls = [visit_url(site_url, location) for location in locations]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_render_timed, urls, chunksize=8)
+        for location, url, (png, seconds) in zip(locations, urls, results):
+            QR_CODES.put(png, location.id, url, delta=seconds)
+    return len(urls)
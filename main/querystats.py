@@ -0,0 +1,238 @@
+"""Slow-query capture: SQL fingerprints aggregated per view and bot command.
+
+An execute wrapper on every connection times each query issued inside a
+:func:`capture` block. Requests get one from ``QueryStatsMiddleware``,
+keyed by the resolved view name; bot handlers use ``bot:<command>``. The
+wrapper normalises the SQL into a fingerprint, with literals, placeholder
+lists and savepoint names replaced. Count, total, maximum and a latency
+histogram (for p95) are aggregated in memory. Every
+``QUERY_STATS_FLUSH_INTERVAL`` seconds they are added to ``QueryStat``
+rows.
+
+The slowest execution above ``QUERY_STATS_EXPLAIN_THRESHOLD_MS`` is kept
+with its parameters. At flush time its plan is stored, at most once per
+``EXPLAIN_INTERVAL`` per fingerprint and process, and only for SELECTs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+EXPLAIN_INTERVAL = 60 * 60
+SQL_MAX_LENGTH = 4000
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SAVEPOINT = re.compile(r'"s\d+_x\d+"')
+_NUMBER = re.compile(r"(?<![\w\"])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROW_LIST = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+# None outside capture(); a string, or the request whose view is resolved lazily
+_source = ContextVar("query_source", default=None)
+_pending = {}
+_pending_lock = threading.Lock()
+_explained = {}
+_next_flush = 0.0
+
+
+def enabled() -> bool:
+    return settings.QUERY_STATS_ENABLED
+
+
+def normalize(sql: str) -> str:
+    sql = _STRING.sub("?", sql)
+    sql = _SAVEPOINT.sub("?", sql)
+    sql = _NUMBER.sub("?", sql.replace("%s", "?"))
+    sql = _PLACEHOLDER_LIST.sub("(...)", sql)
+    sql = _ROW_LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+@lru_cache(maxsize=4096)  # ORM SQL repeats verbatim, only the params differ
+def fingerprint(sql: str) -> tuple[str, str]:
+    """``(digest, normalised SQL)``; equal for queries differing only in values."""
+    normalized = normalize(sql)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16], normalized
+
+
+def _current_source():
+    source = _source.get()
+    if source is None or isinstance(source, str):
+        return source
+    match = source.resolver_match
+    return match.view_name if match else "<middleware>"
+
+
+@contextmanager
+def capture(source):
+    """Attribute the queries run inside the block to ``source``."""
+    token = _source.set(source)
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection (see :func:`install`)."""
+    source = _current_source()
+    if source is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        _add(source, sql, None if many else params, context["connection"].alias, elapsed)
+
+
+def _add(source, sql, params, alias, elapsed):
+    source = source[:200]
+    digest, normalized = fingerprint(sql)
+    with _pending_lock:
+        entry = _pending.get((digest, source))
+        if entry is None:
+            entry = _pending[(digest, source)] = {
+                "sql": normalized[:SQL_MAX_LENGTH],
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "buckets": [0] * (len(BUCKETS_MS) + 1),
+                "sample": None,
+            }
+        entry["count"] += 1
+        entry["total"] += elapsed
+        entry["buckets"][bisect_left(BUCKETS_MS, elapsed)] += 1
+        if elapsed > entry["max"]:
+            entry["max"] = elapsed
+            if elapsed >= settings.QUERY_STATS_EXPLAIN_THRESHOLD_MS:
+                entry["sample"] = (sql, params, alias)
+
+
+def install(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_all():
+    """Wrap new connections and those already open in this thread."""
+    connection_created.connect(install, dispatch_uid="querystats_record_query")
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+
+
+def p95(buckets) -> float | None:
+    """Upper bound (ms) of the bucket holding the 95th percentile."""
+    total = sum(buckets)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip((*BUCKETS_MS, float("inf")), buckets):
+        seen += count
+        if seen >= 0.95 * total:
+            return bound
+    return float("inf")
+
+
+def explain(sql, params, alias) -> str:
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {sql}", params)
+        return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+
+def flush_due() -> bool:
+    """True once per ``QUERY_STATS_FLUSH_INTERVAL``; the caller then flushes."""
+    global _next_flush
+    now = time.monotonic()
+    if now < _next_flush:
+        return False
+    _next_flush = now + settings.QUERY_STATS_FLUSH_INTERVAL
+    return True
+
+
+def flush() -> int:
+    """Add the pending aggregates to ``QueryStat``; returns rows written."""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+    # Our own reads and writes are not captured
+    token = _source.set(None)
+    try:
+        written = 0
+        for (digest, source), entry in pending.items():
+            plan = _sample_plan(digest, entry["sample"])
+            try:
+                _merge(digest, source, entry, plan)
+                written += 1
+            except DatabaseError:
+                continue  # statistics must never break a request
+        return written
+    finally:
+        _source.reset(token)
+
+
+def _sample_plan(digest, sample):
+    if sample is None:
+        return None
+    sql, params, alias = sample
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    if time.monotonic() < _explained.get(digest, 0):
+        return None
+    _explained[digest] = time.monotonic() + EXPLAIN_INTERVAL
+    try:
+        return sql, explain(sql, params, alias)
+    except DatabaseError:
+        return None
+
+
+def _merge(digest, source, entry, plan):
+    from .models import QueryStat
+
+    with transaction.atomic():
+        row = QueryStat.objects.select_for_update().filter(
+            fingerprint=digest, source=source
+        ).first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    row = QueryStat.objects.create(
+                        fingerprint=digest,
+                        source=source,
+                        sql=entry["sql"],
+                        buckets=[0] * len(entry["buckets"]),
+                    )
+            except IntegrityError:
+                # Another process created it between our read and insert
+                row = QueryStat.objects.select_for_update().get(
+                    fingerprint=digest, source=source
+                )
+        row.count += entry["count"]
+        row.total_ms += entry["total"]
+        row.max_ms = max(row.max_ms, entry["max"])
+        if len(row.buckets) != len(entry["buckets"]):
+            row.buckets = [0] * len(entry["buckets"])  # BUCKETS_MS changed
+        row.buckets = [a + b for a, b in zip(row.buckets, entry["buckets"])]
+        row.last_seen = timezone.now()
+        if plan is not None:
+            row.explain_sql, row.explain_plan = plan
+            row.explained_at = timezone.now()
+        row.save()
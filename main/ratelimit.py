@@ -0,0 +1,149 @@
+"""Token-bucket rate limiting of the public QR visit and phone-click endpoints.
+
+Limits come from ``settings.RATE_LIMITS``: per endpoint, one bucket per
+key (the client IP, the location), e.g. ``{"visit": {"ip": "20/m"}}``.
+The ``ip`` buckets only apply once ``CLIENT_IP_HEADER`` names the header
+of the reverse proxy: behind a proxy ``REMOTE_ADDR`` is the proxy's own
+address, and one bucket for everybody would turn away real visitors.
+Buckets use the generic cell rate algorithm (GCRA). This is a token
+bucket that stores one timestamp per key: the moment the bucket will be
+full again. All buckets of a request are read in one ``get_many`` and
+written in one ``set_many`` on the shared cache, before any database work.
+
+Reading and writing are separate steps, so concurrent requests may each
+take the same last token. The limit can be exceeded by the number of
+requests in flight at once, which is fine for abuse protection. Requests
+are let through while the cache is unavailable.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import metrics
+from .caching import RATE_LIMITS
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60}
+
+
+@lru_cache(maxsize=64)
+def parse(spec: str) -> tuple[int, float] | None:
+    """``"20/m"`` -> ``(20, 60.0)``; ``None`` for an empty (disabled) limit."""
+    if not spec:
+        return None
+    count, _, period = spec.partition("/")
+    try:
+        count = int(count)
+        seconds = PERIODS[period[-1:]] * float(period[:-1] or 1)
+    except (KeyError, ValueError):
+        raise ImproperlyConfigured(f"Invalid rate limit {spec!r}, expected e.g. '20/m'")
+    if count <= 0 or seconds <= 0:
+        raise ImproperlyConfigured(f"Invalid rate limit {spec!r}")
+    return count, seconds
+
+
+def client_ip(request) -> str:
+    if settings.CLIENT_IP_HEADER:
+        forwarded = request.headers.get(settings.CLIENT_IP_HEADER, "")
+        # X-Forwarded-For: the last address is the one our proxy saw
+        address = forwarded.split(",")[-1].strip()
+        if address:
+            return address
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _buckets(endpoint, values):
+    """``(name, cache key, capacity, seconds per token)`` of the configured limits."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return []
+    buckets = []
+    for name, spec in settings.RATE_LIMITS.get(endpoint, {}).items():
+        limit = parse(spec)
+        if limit is None or name not in values:
+            continue
+        if name == "ip" and not settings.CLIENT_IP_HEADER:
+            continue
+        count, seconds = limit
+        key = RATE_LIMITS.key(endpoint, name, values[name])
+        buckets.append((name, key, count, seconds / count))
+    return buckets
+
+
+def _take(buckets, stored, now):
+    """Take a token from every bucket: ``(retry_after, limited bucket, updates)``.
+
+    ``retry_after`` is ``None`` when the request is allowed; ``updates`` are
+    then the new bucket states to store.
+    """
+    updates = {}
+    retry_after = limited = None
+    for name, key, capacity, interval in buckets:
+        # The moment the bucket will be full again, if not full already
+        full_at = max(stored.get(key) or now, now)
+        new_full_at = full_at + interval
+        allowed_at = new_full_at - capacity * interval
+        if now < allowed_at:
+            if retry_after is None or allowed_at - now > retry_after:
+                retry_after, limited = allowed_at - now, name
+        else:
+            updates[key] = new_full_at
+    return retry_after, limited, updates
+
+
+def check(endpoint: str, **values) -> float | None:
+    """Seconds until ``endpoint`` may be called again for ``values``, or ``None``.
+
+    ``values`` name the bucket keys, e.g. ``ip="1.2.3.4", location=7``. An
+    allowed call takes a token from each bucket.
+    """
+    buckets = _buckets(endpoint, values)
+    if not buckets:
+        return None
+    cache = RATE_LIMITS.cache
+    now = time.time()
+    try:
+        stored = cache.get_many([key for _, key, _, _ in buckets])
+        retry_after, limited, updates = _take(buckets, stored, now)
+        if retry_after is None:
+            cache.set_many(updates, _timeout(updates, now))
+    except Exception:  # the cache backend's own errors, e.g. Redis down
+        logger.warning("Rate limiter unavailable, request allowed", exc_info=True)
+        return None
+    return _limited(endpoint, retry_after, limited)
+
+
+async def acheck(endpoint: str, **values) -> float | None:
+    """Async :func:`check`."""
+    buckets = _buckets(endpoint, values)
+    if not buckets:
+        return None
+    cache = RATE_LIMITS.cache
+    now = time.time()
+    try:
+        stored = await cache.aget_many([key for _, key, _, _ in buckets])
+        retry_after, limited, updates = _take(buckets, stored, now)
+        if retry_after is None:
+            await cache.aset_many(updates, _timeout(updates, now))
+    except Exception:  # the cache backend's own errors, e.g. Redis down
+        logger.warning("Rate limiter unavailable, request allowed", exc_info=True)
+        return None
+    return _limited(endpoint, retry_after, limited)
+
+
+def _timeout(updates, now) -> int:
+    # A bucket that is full again carries no state and may expire
+    return max(1, math.ceil(max(updates.values()) - now))
+
+
+def _limited(endpoint, retry_after, bucket):
+    if retry_after is not None:
+        metrics.rate_limited(endpoint, bucket)
+    return retry_after
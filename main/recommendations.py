@@ -0,0 +1,264 @@
+"""Offline related-item recommendations for the furniture detail page.
+
+Scores combine TF-IDF text similarity within a category, price
+proximity, and "viewed together" counts from ``FurnitureItemView``.
+Co-viewed items may come from other categories. Results are written to
+``RelatedItem``, one category at a time. Views older than ``COVIEW_DAYS``
+no longer count and are deleted by :func:`purge_views`.
+"""
+
+from __future__ import annotations
+
+import datetime
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from .models import FurnitureItem, FurnitureItemView, RelatedItem
+from .search import FIELD_WEIGHTS, tokenize
+
+TOP_K = 8
+WEIGHTS = {"text": 0.5, "price": 0.2, "coview": 0.3}
+# Price similarity used when either item has no price
+UNKNOWN_PRICE_SIMILARITY = 0.5
+COVIEW_DAYS = 90
+# Visitors who viewed more items than this add noise (and quadratic pairs)
+MAX_ITEMS_PER_VISITOR = 50
+# Rows of the similarity matrix computed at once
+BLOCK_SIZE = 512
+
+
+def tfidf_matrix(documents: list[dict]) -> np.ndarray:
+    """L2-normalised TF-IDF rows for documents given as ``{field: text}``."""
+    vocabulary = {}
+    counts = []
+    for document in documents:
+        weights = Counter()
+        for field, text in document.items():
+            for term in tokenize(text or ""):
+                weights[term] += FIELD_WEIGHTS[field]
+        for term in weights:
+            vocabulary.setdefault(term, len(vocabulary))
+        counts.append(weights)
+
+    matrix = np.zeros((len(documents), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, weights in enumerate(counts):
+        for term, weight in weights.items():
+            matrix[row, vocabulary[term]] = weight
+    document_frequency = np.count_nonzero(matrix, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    matrix = np.log1p(matrix) * idf.astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def price_similarity(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """``1 / (1 + |log(a / b)|)`` for every pair; NaN prices are neutral."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        distance = np.abs(np.log(left)[:, None] - np.log(right)[None, :])
+        similarity = 1 / (1 + distance)
+    return np.where(np.isnan(similarity), UNKNOWN_PRICE_SIMILARITY, similarity)
+
+
+def coview_scores(since: datetime.datetime, item_ids=None) -> dict:
+    """``{item: {other: cosine}}`` of items viewed by the same visitors.
+
+    With ``item_ids``, only the scores of those items are computed, from
+    the views of the visitors who saw at least one of them.
+    """
+    recent = FurnitureItemView.objects.filter(timestamp__gte=since)
+    views = recent
+    if item_ids is not None:
+        item_ids = set(item_ids)
+        views = views.filter(
+            visitor_id__in=recent.filter(item_id__in=item_ids).values("visitor_id")
+        )
+    views = views.values_list("visitor_id", "item_id").distinct().order_by("visitor_id")
+    pairs = defaultdict(Counter)
+    viewers = Counter()
+    current, items = None, []
+
+    def flush():
+        if 1 < len(items) <= MAX_ITEMS_PER_VISITOR:
+            for item in items:
+                if item_ids is not None and item not in item_ids:
+                    continue
+                for other in items:
+                    if other != item:
+                        pairs[item][other] += 1
+        viewers.update(items)
+
+    for visitor, item in views.iterator(chunk_size=5000):
+        if visitor != current:
+            flush()
+            current, items = visitor, []
+        items.append(item)
+    flush()
+
+    if item_ids is not None:
+        # Co-viewed items also had visitors outside the ones read above
+        others = {other for counts in pairs.values() for other in counts} - item_ids
+        for other, count in (
+            recent.filter(item_id__in=others)
+            .values("item_id")
+            .annotate(n=Count("visitor_id", distinct=True))
+            .values_list("item_id", "n")
+            .order_by()
+        ):
+            viewers[other] = count
+
+    return {
+        item: {
+            other: count / np.sqrt(viewers[item] * viewers[other])
+            for other, count in others.items()
+        }
+        for item, others in pairs.items()
+    }
+
+
+def stale_categories() -> list:
+    """Ids of categories whose recommendations are missing or out of date."""
+    current = {
+        row["category"]: row
+        for row in FurnitureItem.objects.filter(is_active=True)
+        .values("category")
+        .annotate(changed=Max("updated_at"), items=Count("id"))
+    }
+    computed = {
+        row["item__category"]: row
+        for row in RelatedItem.objects.values("item__category").annotate(
+            computed=Min("computed_at"), items=Count("item", distinct=True)
+        )
+    }
+    stale = []
+    for category in current.keys() | computed.keys():
+        now, done = current.get(category), computed.get(category)
+        if now is None or done is None:
+            # Emptied categories are cleared; single-item ones have nothing to show
+            if done is not None or (now and now["items"] > 1):
+                stale.append(category)
+        elif now["items"] != done["items"] or now["changed"] > done["computed"]:
+            stale.append(category)
+    return sorted(stale)
+
+
+def purge_views(batch_size: int = 10000) -> int:
+    """Delete the item views too old to count as co-views, in batches."""
+    expired = FurnitureItemView.objects.filter(
+        timestamp__lt=timezone.now() - datetime.timedelta(days=COVIEW_DAYS)
+    )
+    deleted = 0
+    while True:
+        batch = list(expired.values_list("id", flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += FurnitureItemView.objects.filter(id__in=batch).delete()[0]
+
+
+def _effective_price(price, discount):
+    value = discount if discount is not None else price
+    return float(value) if value else np.nan
+
+
+def refresh_categories(category_ids=None, top_k: int = TOP_K) -> dict:
+    """Recompute recommendations of the given (default: all) categories.
+
+    Returns ``{category_id: rows written}``.
+    """
+    items = list(
+        FurnitureItem.objects.filter(is_active=True).values_list(
+            "id",
+            "category_id",
+            "name",
+            "description",
+            "materials",
+            "price",
+            "discount_price",
+        )
+    )
+    prices = {pk: _effective_price(price, discount) for pk, _, _, _, _, price, discount in items}
+    by_category = defaultdict(list)
+    for row in items:
+        by_category[row[1]].append(row)
+    if category_ids is None:
+        # Includes categories that lost all their items, to clear them
+        category_ids = sorted(
+            set(by_category)
+            | set(RelatedItem.objects.values_list("item__category", flat=True))
+        )
+        scope = None
+    else:
+        # Incremental runs only need the co-views of the refreshed items
+        scope = [row[0] for category_id in category_ids for row in by_category.get(category_id, [])]
+    coviews = coview_scores(timezone.now() - datetime.timedelta(days=COVIEW_DAYS), scope)
+
+    written = {}
+    for category_id in category_ids:
+        rows = by_category.get(category_id, [])
+        recommendations = _category_recommendations(rows, prices, coviews, top_k)
+        computed_at = timezone.now()
+        with transaction.atomic():
+            RelatedItem.objects.filter(item__category_id=category_id).delete()
+            RelatedItem.objects.bulk_create(
+                RelatedItem(
+                    item_id=item,
+                    related_id=related,
+                    rank=rank,
+                    score=score,
+                    computed_at=computed_at,
+                )
+                for item, ranked in recommendations.items()
+                for rank, (related, score) in enumerate(ranked, 1)
+            )
+        written[category_id] = sum(len(ranked) for ranked in recommendations.values())
+    return written
+
+
+def _category_recommendations(rows, prices, coviews, top_k) -> dict:
+    """``{item: [(related, score)]}`` for the active items of one category."""
+    if not rows:
+        return {}
+    ids = np.array([row[0] for row in rows])
+    position = {pk: i for i, pk in enumerate(ids.tolist())}
+    text = tfidf_matrix(
+        [{"name": row[2], "description": row[3], "materials": row[4]} for row in rows]
+    )
+    price = np.array([prices[pk] for pk in ids.tolist()])
+
+    result = {}
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = slice(start, min(start + BLOCK_SIZE, len(rows)))
+        scores = (
+            WEIGHTS["text"] * (text[block] @ text.T)
+            + WEIGHTS["price"] * price_similarity(price[block], price)
+        )
+        for offset, item in enumerate(ids[block].tolist()):
+            row = scores[offset]
+            row[start + offset] = -np.inf
+            candidates = {}
+            for other, similarity in coviews.get(item, {}).items():
+                if other in position:
+                    row[position[other]] += WEIGHTS["coview"] * similarity
+                elif other in prices:
+                    # Viewed together across categories: no text similarity
+                    pair = price_similarity(
+                        np.array([prices[item]]), np.array([prices[other]])
+                    )
+                    candidates[other] = (
+                        WEIGHTS["coview"] * similarity
+                        + WEIGHTS["price"] * float(pair[0, 0])
+                    )
+            count = min(top_k, len(rows) - 1)
+            if count > 0:
+                best = np.argpartition(-row, count - 1)[:count]
+                candidates.update(
+                    (int(ids[index]), float(row[index])) for index in best
+                )
+            ranked = sorted(candidates.items(), key=lambda kv: (-kv[1], kv[0]))[:top_k]
+            if ranked:
+                result[item] = ranked
+    return result
@@ -0,0 +1,160 @@
+"""Send the reads of stats and catalog code to a read replica.
+
+Reads go to the ``replica`` database alias only inside :func:`replica_reads`
+(or a function decorated with :func:`use_replica`). Everything else,
+notably the QR visit and phone-click flow, keeps reading its own writes
+from the primary. Even inside the block a read falls back to the primary:
+
+* once the block has written anything, so it sees its own writes;
+* inside a transaction on the primary;
+* while the replica is unreachable or lags behind by more than
+  ``DB_REPLICA_MAX_LAG`` seconds. This is checked at most every
+  ``DB_REPLICA_CHECK_INTERVAL`` seconds per process.
+
+Without a ``replica`` alias in ``DATABASES`` the router does nothing.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.template.response import SimpleTemplateResponse
+
+REPLICA = "replica"
+
+# PostgreSQL standby: seconds behind the primary, 0 when fully replayed
+# (an idle primary sends no new transactions to measure against)
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class _Reads:
+    __slots__ = ("wrote",)
+
+    def __init__(self):
+        self.wrote = False
+
+
+_reads = ContextVar("replica_reads", default=None)
+_health = {"checked": None, "available": False, "lag": None}
+_health_lock = threading.Lock()
+
+
+@contextmanager
+def replica_reads():
+    """Let the reads of the block go to the replica (see module docstring)."""
+    token = _reads.set(_Reads())
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+def _rendered(result):
+    # Templates run their queries when rendered, after the view returns
+    if isinstance(result, SimpleTemplateResponse) and not result.is_rendered:
+        result.render()
+    return result
+
+
+def use_replica(func):
+    """Decorator form of :func:`replica_reads`, for sync and async functions.
+
+    Template responses are rendered inside the block.
+    """
+    if iscoroutinefunction(func):
+
+        @wraps(func)
+        async def _async_wrapper(*args, **kwargs):
+            with replica_reads():
+                return _rendered(await func(*args, **kwargs))
+
+        return _async_wrapper
+
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        with replica_reads():
+            return _rendered(func(*args, **kwargs))
+
+    return _wrapper
+
+
+def configured() -> bool:
+    return REPLICA in settings.DATABASES
+
+
+def replica_lag() -> float | None:
+    """Seconds the replica is behind, ``None`` if it cannot be queried.
+
+    Only PostgreSQL reports a lag; other backends count as current when
+    they answer.
+    """
+    connection = connections[REPLICA]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(POSTGRES_LAG_SQL)
+                lag = cursor.fetchone()[0]
+                return float(lag or 0)  # NULL: not a standby
+            cursor.execute("SELECT 1")
+            return 0.0
+    except DatabaseError:
+        return None
+
+
+def replica_available() -> bool:
+    now = time.monotonic()
+    checked = _health["checked"]
+    if checked is not None and now - checked < settings.DB_REPLICA_CHECK_INTERVAL:
+        return _health["available"]
+    if not _health_lock.acquire(blocking=False):
+        return _health["available"]  # another thread is checking
+    try:
+        lag = replica_lag()
+        _health.update(
+            checked=time.monotonic(),
+            lag=lag,
+            available=lag is not None and lag <= settings.DB_REPLICA_MAX_LAG,
+        )
+        return _health["available"]
+    finally:
+        _health_lock.release()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        if reads is None or not configured():
+            return None
+        if reads.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA if replica_available() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        reads = _reads.get()
+        if reads is not None:
+            reads.wrote = True
+        # Also for instances that were read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False  # replicated from the primary
+        return None
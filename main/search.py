@@ -0,0 +1,304 @@
+"""In-process full-text and faceted search over the furniture catalog.
+
+The active catalog is held in an inverted index built in memory. Each
+search first reads the catalog version, which is one aggregate query. The
+index is rebuilt only when that version changes, so bulk imports that
+bypass ``save()`` are still picked up.
+"""
+
+from __future__ import annotations
+
+import functools
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.db.models import Count, Max
+
+from .models import FurnitureItem
+
+# Relative weight of a term found in each field
+FIELD_WEIGHTS = {"name": 3.0, "materials": 2.0, "description": 1.0}
+
+# (key, label, lower bound inclusive, upper bound exclusive), prices in сум
+PRICE_BANDS = [
+    ("0-1m", "до 1 млн", 0, 1_000_000),
+    ("1m-3m", "1–3 млн", 1_000_000, 3_000_000),
+    ("3m-5m", "3–5 млн", 3_000_000, 5_000_000),
+    ("5m-10m", "5–10 млн", 5_000_000, 10_000_000),
+    ("10m+", "от 10 млн", 10_000_000, None),
+]
+NO_PRICE_BAND = ("none", "Цена по запросу")
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+# Inflectional endings stripped by the light stemmer, longest first
+_ENDINGS = sorted(
+    """
+    иями ями ами ого его ому ему ыми ими ией иях ах ях ам ям ом ем ов ев ей
+    ой ий ый ая яя ое ее ые ие ую юю ия ию ть ся а я о е ы и у ю ь й
+    ing es s
+    """.split(),
+    key=len,
+    reverse=True,
+)
+_MIN_STEM = 3
+# Shorter final query terms are not expanded as prefixes
+_MIN_PREFIX = 2
+# Seconds a checked catalog version is trusted before it is read again
+VERSION_CHECK_INTERVAL = 5.0
+
+
+@functools.lru_cache(maxsize=100_000)
+def stem(token: str) -> str:
+    """Strip one inflectional ending so "шкафы"/"шкафа" match "шкаф"."""
+    for ending in _ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= _MIN_STEM:
+            return token[: -len(ending)]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    return [stem(token) for token in _TOKEN.findall(text.lower().replace("ё", "е"))]
+
+
+def split_materials(value: str) -> list[str]:
+    return [part.strip().lower() for part in re.split(r"[,;/]", value) if part.strip()]
+
+
+def price_band(price) -> str:
+    if price is None:
+        return NO_PRICE_BAND[0]
+    for key, _, low, high in PRICE_BANDS:
+        if price >= low and (high is None or price < high):
+            return key
+    return NO_PRICE_BAND[0]
+
+
+def catalog_version() -> tuple:
+    """Cheap fingerprint of the searchable catalog; changes on any edit."""
+    version = FurnitureItem.objects.filter(
+        is_active=True, category__is_active=True
+    ).aggregate(
+        count=Count("id"),
+        items=Max("updated_at"),
+        categories=Max("category__updated_at"),
+    )
+    return version["count"], version["items"], version["categories"]
+
+
+@dataclass
+class SearchResult:
+    ids: list
+    scores: list
+    total: int
+    facets: dict
+
+
+@dataclass
+class CatalogIndex:
+    version: tuple
+    # Per-document columns, in catalog order (-is_featured, name)
+    ids: list = field(default_factory=list)
+    categories: list = field(default_factory=list)
+    bands: list = field(default_factory=list)
+    materials: list = field(default_factory=list)
+    # term -> {document: weighted term frequency}
+    postings: dict = field(default_factory=dict)
+    vocabulary: list = field(default_factory=list)
+    category_labels: dict = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, version: tuple) -> "CatalogIndex":
+        index = cls(version)
+        rows = (
+            FurnitureItem.objects.filter(is_active=True, category__is_active=True)
+            .order_by("-is_featured", "name", "id")
+            .values_list(
+                "id",
+                "name",
+                "description",
+                "materials",
+                "price",
+                "discount_price",
+                "category__slug",
+                "category__name",
+            )
+        )
+        for doc, (pk, name, description, materials, price, discount, slug, label) in (
+            enumerate(rows.iterator(chunk_size=2000))
+        ):
+            index.ids.append(pk)
+            index.categories.append(slug)
+            index.category_labels[slug] = label
+            index.bands.append(price_band(discount if discount is not None else price))
+            index.materials.append(tuple(split_materials(materials)))
+            weights = {}
+            for field_name, text in (
+                ("name", name),
+                ("materials", materials),
+                ("description", description),
+            ):
+                for term in tokenize(text):
+                    weights[term] = weights.get(term, 0.0) + FIELD_WEIGHTS[field_name]
+            for term, weight in weights.items():
+                index.postings.setdefault(term, {})[doc] = weight
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def _expand(self, term: str, prefix: bool) -> list[str]:
+        if not prefix:
+            return [term] if term in self.postings else []
+        # The last query term also matches longer words (search as you type)
+        start = bisect_left(self.vocabulary, term)
+        terms = []
+        for candidate in self.vocabulary[start:]:
+            if not candidate.startswith(term):
+                break
+            terms.append(candidate)
+        return terms
+
+    def _score(self, query: str) -> Optional[dict]:
+        """``{doc: score}`` of documents matching every query term.
+
+        Returns ``None`` for an empty query, meaning "all documents".
+        """
+        raw = _TOKEN.findall(query.lower().replace("ё", "е"))
+        if not raw:
+            return None
+        total = len(self.ids)
+        scores = None
+        for position, token in enumerate(raw):
+            prefix = position == len(raw) - 1 and len(token) >= _MIN_PREFIX
+            term_scores = {}
+            for term in self._expand(stem(token), prefix) or self._expand(token, prefix):
+                posting = self.postings[term]
+                idf = math.log(1 + total / len(posting))
+                for doc, weight in posting.items():
+                    # Saturate repeated terms like BM25 does
+                    value = idf * weight / (weight + 1.0)
+                    if value > term_scores.get(doc, 0.0):
+                        term_scores[doc] = value
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    doc: score + term_scores[doc]
+                    for doc, score in scores.items()
+                    if doc in term_scores
+                }
+            if not scores:
+                return {}
+        return scores
+
+    def search(
+        self,
+        query: str = "",
+        category: str = "",
+        band: str = "",
+        material: str = "",
+        offset: int = 0,
+        limit: int = 20,
+    ) -> SearchResult:
+        scores = self._score(query)
+        docs = range(len(self.ids)) if scores is None else scores.keys()
+        material = material.lower()
+
+        category_counts = {}
+        band_counts = {}
+        material_counts = {}
+        matched = []
+        # One pass: each facet counts the documents that pass every filter
+        # except its own, so choosing a value does not hide the others.
+        for doc in docs:
+            in_category = not category or self.categories[doc] == category
+            in_band = not band or self.bands[doc] == band
+            has_material = not material or material in self.materials[doc]
+            if in_band and has_material:
+                key = self.categories[doc]
+                category_counts[key] = category_counts.get(key, 0) + 1
+            if in_category and has_material:
+                key = self.bands[doc]
+                band_counts[key] = band_counts.get(key, 0) + 1
+            if in_category and in_band:
+                for key in self.materials[doc]:
+                    material_counts[key] = material_counts.get(key, 0) + 1
+                if has_material:
+                    matched.append(doc)
+
+        if scores is not None:
+            # Equal scores keep the catalog order
+            matched.sort(key=lambda doc: (-scores[doc], doc))
+        page = matched[offset : offset + limit]
+
+        band_labels = {key: label for key, label, _, _ in PRICE_BANDS}
+        band_labels[NO_PRICE_BAND[0]] = NO_PRICE_BAND[1]
+        facets = {
+            "category": [
+                {"value": key, "label": self.category_labels[key], "count": count}
+                for key, count in sorted(
+                    category_counts.items(), key=lambda kv: (-kv[1], kv[0])
+                )
+            ],
+            "price": [
+                {"value": key, "label": label, "count": band_counts[key]}
+                for key, label in band_labels.items()
+                if key in band_counts
+            ],
+            "materials": [
+                {"value": key, "label": key, "count": count}
+                for key, count in sorted(
+                    material_counts.items(), key=lambda kv: (-kv[1], kv[0])
+                )
+            ],
+        }
+        return SearchResult(
+            ids=[self.ids[doc] for doc in page],
+            scores=[round(scores[doc], 4) if scores else None for doc in page],
+            total=len(matched),
+            facets=facets,
+        )
+
+
+_index: Optional[CatalogIndex] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index() -> CatalogIndex:
+    """The catalog index, rebuilt when :func:`catalog_version` changes.
+
+    The version is read at most every ``VERSION_CHECK_INTERVAL`` seconds,
+    so edits show up in search after that delay at the latest.
+    """
+    global _index, _checked_at
+    index = _index
+    if index is not None and time.monotonic() - _checked_at < VERSION_CHECK_INTERVAL:
+        return index
+    version = catalog_version()
+    if index is not None and index.version == version:
+        _checked_at = time.monotonic()
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            _index = CatalogIndex.build(version)
+        _checked_at = time.monotonic()
+        return _index
+
+
+def search(query: str = "", **filters) -> SearchResult:
+    return get_index().search(query, **filters)
+
+
+def ordered_items(result: SearchResult) -> list[tuple]:
+    """``(FurnitureItem, score)`` pairs of a result, in its order.
+
+    Items deleted since the index was built are left out with their score.
+    """
+    items = FurnitureItem.objects.select_related("category").in_bulk(result.ids)
+    return [
+        (items[pk], score) for pk, score in zip(result.ids, result.scores) if pk in items
+    ]
@@ -0,0 +1,94 @@
+from django.urls import reverse
+from rest_framework import serializers
+
+from .images import DERIVATIVE_SIZES, derivative_url
+from .models import FurnitureCategory, FurnitureImage, FurnitureItem
+
+
+class SparseFieldsMixin:
+    """Limit the output to the comma-separated ``?fields=`` query parameter.
+
+    Only applied to the top-level serializer; unknown names are ignored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or self.parent is not None:
+            return
+        requested = requested_fields(request)
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+def requested_fields(request):
+    """Set of ``?fields=`` names, or ``None`` when all fields are wanted."""
+    value = request.query_params.get("fields", "")
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    return names or None
+
+
+def _derivatives(content_hash, request=None):
+    # Absolute like the ImageField URLs DRF renders next to them
+    if not content_hash:
+        return None
+    urls = {size: derivative_url(content_hash, size) for size in DERIVATIVE_SIZES}
+    if request is not None:
+        urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+    return urls
+
+
+class FurnitureCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FurnitureCategory
+        fields = ["id", "name", "slug", "description", "image", "order", "url", "updated_at"]
+
+    def get_url(self, obj):
+        return reverse("category_detail", args=[obj.slug])
+
+
+class FurnitureImageSerializer(serializers.ModelSerializer):
+    derivatives = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FurnitureImage
+        fields = ["id", "image", "alt_text", "order", "derivatives"]
+
+    def get_derivatives(self, obj):
+        return _derivatives(obj.content_hash, self.context.get("request"))
+
+
+class FurnitureItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    category = serializers.SlugRelatedField(slug_field="slug", read_only=True)
+    derivatives = serializers.SerializerMethodField()
+    images = FurnitureImageSerializer(many=True, read_only=True)
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FurnitureItem
+        fields = [
+            "id",
+            "category",
+            "name",
+            "slug",
+            "description",
+            "price",
+            "discount_price",
+            "main_image",
+            "derivatives",
+            "images",
+            "dimensions",
+            "materials",
+            "is_featured",
+            "url",
+            "updated_at",
+        ]
+
+    def get_derivatives(self, obj):
+        return _derivatives(obj.content_hash, self.context.get("request"))
+
+    def get_url(self, obj):
+        return reverse("furniture_detail", args=[obj.category.slug, obj.slug])
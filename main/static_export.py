@@ -0,0 +1,190 @@
+"""Render the public catalog pages to static files for nginx/CDN serving.
+
+Pages are written as ``<path>/index.html`` with precompressed ``.gz`` and,
+when the optional ``brotli`` package is installed, ``.br`` siblings. A
+matching nginx location::
+
+    location / {
+        root /var/www/gos_landing_page/static_catalog;
+        gzip_static on;
+        brotli_static on;
+        try_files $uri/index.html @django;
+    }
+
+The landing page is not exported. It is the target of the QR visit
+redirect and embeds the visit id that phone clicks are attributed to, so
+``/`` always falls through to Django.
+
+Exported pages never reach Django, so neither ``VisitTrackingMiddleware``
+nor the item view behind the "viewed together" recommendations sees
+them. Instead they carry a beacon that posts the page path to
+``PageViewBeaconView``, which records both. Visitors without JavaScript
+are therefore missing from the funnel and the co-views; leave
+``/catalog/`` out of the nginx location where that matters more than the
+rendering time saved.
+
+A manifest next to the pages records the build time and a hash per page,
+so an incremental build renders only what changed since then and rewrites
+only pages whose HTML actually differs.
+"""
+
+from __future__ import annotations
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+
+from .models import FurnitureCategory, FurnitureItem, RelatedItem
+from .views import CatalogView, CategoryDetailView, FurnitureDetailView
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip siblings are written
+    brotli = None
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def page_file(root: Path, path: str) -> Path:
+    return root / path.strip("/") / "index.html"
+
+
+def all_pages() -> dict:
+    """``{url path: (view, kwargs)}`` of every public catalog page."""
+    pages = {reverse("catalog"): (CatalogView, {})}
+    for slug in FurnitureCategory.objects.filter(is_active=True).values_list(
+        "slug", flat=True
+    ):
+        pages[reverse("category_detail", args=[slug])] = (
+            CategoryDetailView,
+            {"category_slug": slug},
+        )
+    for category_slug, slug in FurnitureItem.objects.filter(
+        is_active=True, category__is_active=True
+    ).values_list("category__slug", "slug"):
+        pages[reverse("furniture_detail", args=[category_slug, slug])] = (
+            FurnitureDetailView,
+            {"category_slug": category_slug, "item_slug": slug},
+        )
+    return pages
+
+
+def affected_paths(since: datetime.datetime) -> set:
+    """URL paths whose content may have changed after ``since``.
+
+    Deleted or deactivated rows are not listed here; their pages disappear
+    from :func:`all_pages` and are removed by comparing with the manifest.
+    """
+    paths = set()
+    categories = FurnitureCategory.objects.filter(updated_at__gt=since)
+    if categories.exists():
+        # Category names and images appear on the catalog page and in the
+        # breadcrumbs of every item page of the category.
+        paths.add(reverse("catalog"))
+        for slug in categories.values_list("slug", flat=True):
+            paths.add(reverse("category_detail", args=[slug]))
+        for category_slug, slug in FurnitureItem.objects.filter(
+            category__in=categories
+        ).values_list("category__slug", "slug"):
+            paths.add(reverse("furniture_detail", args=[category_slug, slug]))
+
+    items = FurnitureItem.objects.filter(updated_at__gt=since)
+    if items.exists():
+        paths.add(reverse("catalog"))  # featured items
+        for category_slug, slug in items.values_list("category__slug", "slug"):
+            paths.add(reverse("category_detail", args=[category_slug]))
+            paths.add(reverse("furniture_detail", args=[category_slug, slug]))
+
+    # Pages that show a changed item among their related items, and pages
+    # whose recommendations were recomputed
+    referring = RelatedItem.objects.filter(related__in=items) | RelatedItem.objects.filter(
+        computed_at__gt=since
+    )
+    for category_slug, slug in referring.values_list(
+        "item__category__slug", "item__slug"
+    ).distinct():
+        paths.add(reverse("furniture_detail", args=[category_slug, slug]))
+    return paths
+
+
+class StaticExporter:
+    def __init__(self, root, base_url="http://localhost/"):
+        self.root = Path(root)
+        self.factory = RequestFactory()
+        self.host = base_url.split("://", 1)[-1].strip("/") or "localhost"
+        self.secure = base_url.startswith("https://")
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.root / MANIFEST_NAME, encoding="utf-8") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest: dict) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / (MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.root / MANIFEST_NAME)
+
+    def render(self, path: str, view, kwargs: dict) -> bytes:
+        request = self.factory.get(path, secure=self.secure, HTTP_HOST=self.host)
+        # Adds the page view beacon (see PageViewBeaconView)
+        request.static_export = True
+        initkwargs = {"track_views": False} if view is FurnitureDetailView else {}
+        response = view.as_view(**initkwargs)(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        if response.status_code != 200:
+            raise ValueError(f"{path} returned HTTP {response.status_code}")
+        return response.content
+
+    def write(self, path: str, content: bytes) -> None:
+        target = page_file(self.root, path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        siblings = [(target, content), (Path(f"{target}.gz"), gzip.compress(content, 9, mtime=0))]
+        if brotli is not None:
+            siblings.append((Path(f"{target}.br"), brotli.compress(content)))
+        for file, data in siblings:
+            # Atomic replace: nginx never serves a half-written page
+            tmp = file.with_name(file.name + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, file)
+
+    def remove(self, path: str) -> None:
+        target = page_file(self.root, path)
+        for file in (target, Path(f"{target}.gz"), Path(f"{target}.br")):
+            file.unlink(missing_ok=True)
+        # Drop directories left empty, but never the export root
+        directory = target.parent
+        while directory != self.root and directory.is_dir() and not any(directory.iterdir()):
+            directory.rmdir()
+            directory = directory.parent
+
+    def build_chunk(self, chunk: list, pages: dict, hashes: dict) -> list:
+        """Render a list of paths; returns ``[(path, sha256, written)]``.
+
+        Runs in a worker thread, which gets its own database connection;
+        it is closed at the end so threads do not leak connections.
+        """
+        results = []
+        try:
+            for path in chunk:
+                view, kwargs = pages[path]
+                content = self.render(path, view, kwargs)
+                digest = hashlib.sha256(content).hexdigest()
+                changed = hashes.get(path) != digest or not page_file(self.root, path).exists()
+                if changed:
+                    self.write(path, content)
+                results.append((path, digest, changed))
+        finally:
+            connection.close()
+        return results
@@ -0,0 +1,254 @@
+"""``collectstatic`` post-processing: minify, bundle, image variants, precompression.
+
+Runs before and after the hashing of ``ManifestStaticFilesStorage``:
+
+1. CSS and JS files are minified; bundles from ``settings.STATIC_BUNDLES``
+   are concatenated from the minified sources.
+2. PNG/JPEG images get WebP (and AVIF, when Pillow supports it) variants
+   next to them, kept only when smaller than the original.
+3. Everything is content-hashed by Django (``name.<hash>.ext``).
+4. Hashed text assets get ``.gz`` and, with the optional ``brotli``
+   package, ``.br`` siblings.
+
+A per-asset size report is written to ``STATIC_ROOT/staticfiles-report.json``
+(see the ``static_report`` command). Hashed names never change content, so
+nginx can serve them forever::
+
+    location /static/ {
+        alias /var/www/gos_landing_page/staticfiles/;
+        gzip_static on;
+        brotli_static on;
+        expires max;
+        add_header Cache-Control "public, immutable";
+    }
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import posixpath
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from PIL import Image, features
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip siblings are written
+    brotli = None
+
+REPORT_NAME = "staticfiles-report.json"
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html", ".xml"}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+WEBP_QUALITY = 80
+AVIF_QUALITY = 60
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,])\s*")
+_CSS_COLON = re.compile(r":\s+")
+# A comment that starts and ends its lines, closed by the first "*/"
+_JS_BLOCK_COMMENT = re.compile(r"^[ \t]*/\*(?:(?!\*/).)*\*/[ \t]*$", re.DOTALL | re.MULTILINE)
+
+
+def minify_css(text: str) -> str:
+    text = _CSS_COMMENT.sub("", text)
+    text = _CSS_SPACE.sub(" ", text)
+    text = _CSS_PUNCTUATION.sub(r"\1", text)
+    # Only after the colon: a space before it is a descendant selector
+    text = _CSS_COLON.sub(":", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text: str) -> str:
+    """Conservative JS minification that needs no parser.
+
+    Drops whole-line comments, indentation and blank lines; code inside a
+    line is never touched, so strings and regex literals stay intact.
+    Template literals can span lines, so files using them are kept as is.
+    """
+    if "`" in text:
+        return text
+    text = _JS_BLOCK_COMMENT.sub("", text)
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+def image_variants(data: bytes) -> dict[str, bytes]:
+    """WebP/AVIF encodings of an image, keyed by extension."""
+    formats = [(".webp", "WEBP", {"quality": WEBP_QUALITY, "method": 6})]
+    if features.check("avif"):
+        formats.append((".avif", "AVIF", {"quality": AVIF_QUALITY}))
+    variants = {}
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        for extension, format_name, options in formats:
+            buffer = BytesIO()
+            image.save(buffer, format_name, **options)
+            variants[extension] = buffer.getvalue()
+    return variants
+
+
+class OptimizedStaticFilesStorage(ManifestStaticFilesStorage):
+    # Templates reference a few files that do not exist (favicon, CSS
+    # background); fall back to the plain name instead of failing the page.
+    manifest_strict = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.missing = set()
+        self.report = {}
+
+    def hashed_name(self, name, content=None, filename=None):
+        path = self.clean_name(name).split("?", 1)[0].split("#", 1)[0]
+        if content is None and filename is None and not self.exists(path):
+            # Referenced but missing: keep the URL as written
+            self.missing.add(path.strip())
+            return name
+        return super().hashed_name(name, content, filename)
+
+    def post_process(self, paths, dry_run=False, **options):
+        self.missing = set()
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+
+        self.report = {}
+        paths = dict(paths)
+        self._minify(paths)
+        self._bundle(paths)
+        self._image_variants(paths)
+        yield from super().post_process(paths, dry_run, **options)
+        self._precompress()
+        self._save_report()
+
+    def _entry(self, name):
+        return self.report.setdefault(name, {})
+
+    def _replace(self, name, data: bytes):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(data))
+
+    def _minify(self, paths):
+        for name, (storage, path) in list(paths.items()):
+            root, extension = posixpath.splitext(name)
+            minify = MINIFIERS.get(extension)
+            if minify is None or root.endswith(".min"):
+                continue
+            with storage.open(path) as source:
+                original = source.read()
+            minified = minify(original.decode("utf-8")).encode("utf-8")
+            entry = self._entry(name)
+            entry["original"] = len(original)
+            entry["minified"] = len(minified)
+            self._replace(name, minified)
+            # Hash and post-process the minified copy, not the source
+            paths[name] = (self, name)
+
+    def _bundle(self, paths):
+        for bundle, sources in getattr(settings, "STATIC_BUNDLES", {}).items():
+            directory = posixpath.dirname(bundle)
+            if any(posixpath.dirname(source) != directory for source in sources):
+                # Relative url() references must stay valid after concatenation
+                raise ImproperlyConfigured(
+                    f"Bundle {bundle} must be in the same directory as its sources"
+                )
+            parts = []
+            original = 0
+            for source in sources:
+                if source not in paths:
+                    raise ImproperlyConfigured(f"Bundle {bundle}: {source} not found")
+                storage, path = paths[source]
+                with storage.open(path) as file:
+                    parts.append(file.read())
+                original += self.report.get(source, {}).get("original", len(parts[-1]))
+            data = b"\n".join(parts)
+            entry = self._entry(bundle)
+            entry["original"] = original
+            entry["minified"] = len(data)
+            self._replace(bundle, data)
+            paths[bundle] = (self, bundle)
+
+    def _image_variants(self, paths):
+        for name, (storage, path) in list(paths.items()):
+            root, extension = posixpath.splitext(name)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            with storage.open(path) as source:
+                data = source.read()
+            entry = self._entry(name)
+            entry["original"] = len(data)
+            variants, reused = self._previous_variants(name, storage, path)
+            if not variants:
+                try:
+                    variants = image_variants(data)
+                except (OSError, ValueError):
+                    continue
+            for variant_extension, encoded in variants.items():
+                variant = root + variant_extension
+                if variant in paths or len(encoded) >= len(data):
+                    continue
+                if variant not in reused:
+                    self._replace(variant, encoded)
+                paths[variant] = (self, variant)
+                entry[variant_extension.lstrip(".")] = len(encoded)
+
+    def _previous_variants(self, name, storage, path):
+        """Variants of an earlier run that are newer than the source image.
+
+        Encoding (AVIF especially) is by far the slowest step of the
+        pipeline, so unchanged images are not encoded again.
+        """
+        root = posixpath.splitext(name)[0]
+        source_time = storage.get_modified_time(path)
+        variants = {}
+        for extension in (".webp", ".avif"):
+            variant = root + extension
+            if self.exists(variant) and self.get_modified_time(variant) >= source_time:
+                with self.open(variant) as file:
+                    variants[extension] = file.read()
+        return variants, {root + extension for extension in variants}
+
+    def _precompress(self):
+        for name, hashed in self.hashed_files.items():
+            if posixpath.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(hashed) as file:
+                data = file.read()
+            entry = self._entry(name)
+            entry.setdefault("original", len(data))
+            entry["hashed"] = hashed
+            encodings = [("gzip", ".gz", gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                encodings.append(("brotli", ".br", brotli.compress(data)))
+            for label, suffix, compressed in encodings:
+                if len(compressed) < len(data):
+                    self._replace(hashed + suffix, compressed)
+                    entry[label] = len(compressed)
+
+    def _save_report(self):
+        for name, hashed in self.hashed_files.items():
+            if name in self.report:
+                self.report[name]["hashed"] = hashed
+        report = {
+            "assets": self.report,
+            "missing": sorted(self.missing),
+            "brotli": brotli is not None,
+        }
+        self._replace(
+            REPORT_NAME,
+            json.dumps(report, indent=1, sort_keys=True).encode("utf-8"),
+        )
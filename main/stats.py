@@ -0,0 +1,431 @@
+"""Aggregated QR statistics shared by the admin, the REST API and the bot."""
+
+from __future__ import annotations
+
+import datetime as _dt
+import zoneinfo
+from typing import Iterable, Optional
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FilteredRelation, Max, Q, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, Trunc, TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import (
+    Location,
+    LocationFunnelStats,
+    LocationHeatmapCell,
+    LocationHourlyStats,
+    PhoneClick,
+    QRCodeScan,
+    VisitSession,
+)
+
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
+
+def stats_timezone() -> zoneinfo.ZoneInfo:
+    return zoneinfo.ZoneInfo(settings.STATS_TIME_ZONE)
+
+
+def pct_change(current: int, previous: int) -> Optional[float]:
+    """Period-over-period change in percent, ``None`` when there is no baseline."""
+    if not previous:
+        return None
+    return (current - previous) / previous * 100
+
+
+def conversion(scans: int, clicks: int) -> Optional[float]:
+    """Phone clicks per scan in percent, ``None`` when there were no scans."""
+    if not scans:
+        return None
+    return clicks / scans * 100
+
+
+def location_comparison(
+    start: _dt.datetime,
+    end: _dt.datetime,
+    location_ids: Optional[Iterable[int]] = None,
+) -> list[dict]:
+    """Scans and clicks per location for ``[start, end)`` and the period before it.
+
+    The previous period has the same length and ends at ``start``. Both
+    periods are computed by one grouped query: the scans are joined through
+    a ``FilteredRelation`` restricted to the combined window, so only rows of
+    the two periods are touched, and conditional counts split them apart.
+    Clicks are attributed to the period of the scan they belong to.
+    """
+    prev_start = start - (end - start)
+    qs = Location.objects.all()
+    if location_ids is not None:
+        qs = qs.filter(id__in=location_ids)
+
+    current = Q(period_scans__timestamp__gte=start)
+    previous = Q(period_scans__timestamp__lt=start)
+    rows = (
+        qs.annotate(
+            period_scans=FilteredRelation(
+                "scans",
+                condition=Q(
+                    scans__timestamp__gte=prev_start, scans__timestamp__lt=end
+                ),
+            )
+        )
+        .annotate(
+            scan_count=Count("period_scans", filter=current, distinct=True),
+            click_count=Count("period_scans__phone_clicks", filter=current),
+            prev_scan_count=Count("period_scans", filter=previous, distinct=True),
+            prev_click_count=Count("period_scans__phone_clicks", filter=previous),
+        )
+        .values(
+            "id",
+            "name",
+            "scan_count",
+            "click_count",
+            "prev_scan_count",
+            "prev_click_count",
+        )
+        .order_by("-scan_count", "name")
+    )
+
+    result = []
+    for row in rows:
+        row["conversion"] = conversion(row["scan_count"], row["click_count"])
+        row["scan_change"] = pct_change(row["scan_count"], row["prev_scan_count"])
+        row["click_change"] = pct_change(row["click_count"], row["prev_click_count"])
+        result.append(row)
+    return result
+
+
+# ─── Hour-of-week heatmap ─────────────────────────────────────────────────────
+
+
+def utc_hour(timestamp: _dt.datetime) -> _dt.datetime:
+    """Start of the UTC hour containing ``timestamp``."""
+    return timestamp.astimezone(_dt.timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+
+
+def heatmap_slot(timestamp: _dt.datetime) -> tuple[int, int]:
+    """``(weekday, hour)`` of a timestamp in the stats timezone, Monday is 0."""
+    local = timestamp.astimezone(stats_timezone())
+    return local.weekday(), local.hour
+
+
+def _bump(model, lookup: dict, field: str, **extra) -> None:
+    """Increment ``field`` of the rollup row identified by ``lookup``."""
+    row = model.objects.filter(**lookup)
+    if row.update(**{field: F(field) + 1}, **extra):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **{field: 1})
+    except IntegrityError:
+        # Another request created the row between our update and insert.
+        row.update(**{field: F(field) + 1}, **extra)
+
+
+def _record(location_id: int, timestamp: _dt.datetime, field: str) -> None:
+    weekday, hour = heatmap_slot(timestamp)
+    _bump(
+        LocationHeatmapCell,
+        {"location_id": location_id, "weekday": weekday, "hour": hour},
+        field,
+    )
+    _bump(
+        LocationHourlyStats,
+        {"location_id": location_id, "hour": utc_hour(timestamp)},
+        field,
+        updated_at=timezone.now(),
+    )
+
+
+def record_scan(scan: QRCodeScan) -> None:
+    """Update the precomputed statistics for a newly created scan."""
+    _record(scan.location_id, scan.timestamp, "scans")
+
+
+def record_click(click: PhoneClick) -> None:
+    """Update the precomputed statistics for a newly created phone click."""
+    _record(click.scan.location_id, click.timestamp, "clicks")
+
+
+def location_heatmap(location_ids: Optional[Iterable[int]] = None) -> list[list[dict]]:
+    """7×24 matrix of ``{"scans", "clicks"}`` summed over the given locations.
+
+    Rows are weekdays starting from Monday, columns are local hours.
+    """
+    matrix = [[{"scans": 0, "clicks": 0} for _ in range(24)] for _ in range(7)]
+    cells = LocationHeatmapCell.objects.all()
+    if location_ids is not None:
+        cells = cells.filter(location_id__in=location_ids)
+    for row in cells.values("weekday", "hour").annotate(
+        scans=Sum("scans"), clicks=Sum("clicks")
+    ):
+        matrix[row["weekday"]][row["hour"]] = {
+            "scans": row["scans"],
+            "clicks": row["clicks"],
+        }
+    return matrix
+
+
+def rebuild_heatmap(location_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute heatmap cells from the raw scans and clicks.
+
+    Used to backfill history and to repair drift; returns the number of
+    cells written.
+    """
+    tz = stats_timezone()
+    scans = QRCodeScan.objects.all()
+    clicks = PhoneClick.objects.all()
+    cells = LocationHeatmapCell.objects.all()
+    if location_ids is not None:
+        location_ids = list(location_ids)
+        scans = scans.filter(location_id__in=location_ids)
+        clicks = clicks.filter(scan__location_id__in=location_ids)
+        cells = cells.filter(location_id__in=location_ids)
+
+    counts: dict[tuple[int, int, int], dict] = {}
+    for qs, location_field, field in (
+        (scans, "location_id", "scans"),
+        (clicks, "scan__location_id", "clicks"),
+    ):
+        rows = (
+            qs.annotate(
+                loc=F(location_field),
+                isoweekday=ExtractIsoWeekDay("timestamp", tzinfo=tz),
+                hour=ExtractHour("timestamp", tzinfo=tz),
+            )
+            .values("loc", "isoweekday", "hour")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        for row in rows:
+            key = (row["loc"], row["isoweekday"] - 1, row["hour"])
+            counts.setdefault(key, {"scans": 0, "clicks": 0})[field] = row["n"]
+
+    with transaction.atomic():
+        cells.delete()
+        LocationHeatmapCell.objects.bulk_create(
+            [
+                LocationHeatmapCell(
+                    location_id=loc, weekday=weekday, hour=hour, **values
+                )
+                for (loc, weekday, hour), values in counts.items()
+            ],
+            batch_size=1000,
+        )
+    return len(counts)
+
+
+# ─── Hourly rollup and time series ────────────────────────────────────────────
+
+GRANULARITIES = {
+    "hour": relativedelta(hours=1),
+    "day": relativedelta(days=1),
+    "week": relativedelta(weeks=1),
+    "month": relativedelta(months=1),
+}
+
+
+def floor_bucket(value: _dt.datetime, granularity: str, tz) -> _dt.datetime:
+    """Start of the ``granularity`` bucket containing ``value`` in ``tz``."""
+    local = value.astimezone(tz).replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return local
+    local = local.replace(hour=0)
+    if granularity == "week":
+        local -= _dt.timedelta(days=local.weekday())
+    elif granularity == "month":
+        local = local.replace(day=1)
+    return local
+
+
+def bucket_end(value: _dt.datetime, granularity: str, tz) -> _dt.datetime:
+    """End (exclusive) of the ``granularity`` bucket containing ``value``."""
+    start = floor_bucket(value, granularity, tz).replace(tzinfo=None)
+    return (start + GRANULARITIES[granularity]).replace(tzinfo=tz)
+
+
+def bucket_starts(
+    start: _dt.datetime, end: _dt.datetime, granularity: str, tz
+) -> list[_dt.datetime]:
+    """Dense list of bucket starts covering ``[start, end)``."""
+    step = GRANULARITIES[granularity]
+    first = floor_bucket(start, granularity, tz).replace(tzinfo=None)
+    buckets = []
+    n = 0
+    while True:
+        bucket = (first + step * n).replace(tzinfo=tz)
+        if bucket >= end:
+            return buckets
+        buckets.append(bucket)
+        n += 1
+
+
+def _hourly_rows(start, end, location_ids):
+    rows = LocationHourlyStats.objects.filter(hour__gte=start, hour__lt=end)
+    if location_ids is not None:
+        rows = rows.filter(location_id__in=location_ids)
+    return rows
+
+
+def rollup_watermark(start, end, location_ids=None) -> Optional[_dt.datetime]:
+    """Last modification time of the hourly rows feeding a time series."""
+    return _hourly_rows(start, end, location_ids).aggregate(m=Max("updated_at"))["m"]
+
+
+def time_series(
+    buckets: list[_dt.datetime],
+    end: _dt.datetime,
+    granularity: str,
+    tz,
+    location_ids: Optional[Iterable[int]] = None,
+) -> dict[int, dict[str, list[int]]]:
+    """Dense per-location scan and click counts for each bucket.
+
+    ``buckets`` comes from ``bucket_starts``. Sums the hourly rollup with one
+    grouped query; buckets are computed in ``tz`` and for zones whose offset
+    is not a whole number of hours the boundaries are approximated to the
+    hour. Returns ``{location_id: {"scans": [...], "clicks": [...]}}`` for
+    the locations that have any activity.
+    """
+    if not buckets:
+        return {}
+    index = {bucket: i for i, bucket in enumerate(buckets)}
+    rows = (
+        _hourly_rows(buckets[0], end, location_ids)
+        .annotate(bucket=Trunc("hour", granularity, tzinfo=tz))
+        .values("location_id", "bucket")
+        .annotate(scan_sum=Sum("scans"), click_sum=Sum("clicks"))
+        .order_by()
+    )
+    series: dict[int, dict[str, list[int]]] = {}
+    for row in rows:
+        i = index.get(row["bucket"])
+        if i is None:
+            continue
+        data = series.setdefault(
+            row["location_id"],
+            {"scans": [0] * len(buckets), "clicks": [0] * len(buckets)},
+        )
+        data["scans"][i] += row["scan_sum"]
+        data["clicks"][i] += row["click_sum"]
+    return series
+
+
+def rebuild_hourly(location_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute the hourly rollup from the raw scans and clicks."""
+    scans = QRCodeScan.objects.all()
+    clicks = PhoneClick.objects.all()
+    rollup = LocationHourlyStats.objects.all()
+    if location_ids is not None:
+        location_ids = list(location_ids)
+        scans = scans.filter(location_id__in=location_ids)
+        clicks = clicks.filter(scan__location_id__in=location_ids)
+        rollup = rollup.filter(location_id__in=location_ids)
+
+    counts: dict[tuple[int, _dt.datetime], dict] = {}
+    for qs, location_field, field in (
+        (scans, "location_id", "scans"),
+        (clicks, "scan__location_id", "clicks"),
+    ):
+        rows = (
+            qs.annotate(
+                loc=F(location_field),
+                bucket=TruncHour("timestamp", tzinfo=_dt.timezone.utc),
+            )
+            .values("loc", "bucket")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        for row in rows:
+            key = (row["loc"], row["bucket"])
+            counts.setdefault(key, {"scans": 0, "clicks": 0})[field] = row["n"]
+
+    with transaction.atomic():
+        rollup.delete()
+        LocationHourlyStats.objects.bulk_create(
+            [
+                LocationHourlyStats(location_id=loc, hour=hour, **values)
+                for (loc, hour), values in counts.items()
+            ],
+            batch_size=1000,
+        )
+    return len(counts)
+
+
+# ─── Visit funnel ─────────────────────────────────────────────────────────────
+
+# Counters of LocationFunnelStats per stage, from the scan to the call
+FUNNEL_STAGES = ("sessions", "catalog", "item", "calls")
+FUNNEL_FIELDS = ("sessions", "returning", "catalog", "item", "calls", "page_views")
+
+
+def location_funnel(
+    location_ids: Optional[Iterable[int]] = None,
+    start: Optional[_dt.date] = None,
+    end: Optional[_dt.date] = None,
+) -> dict:
+    """Funnel totals of the locations for the days in ``[start, end)``.
+
+    Summed from the daily rollup, so the raw visit sessions are not read.
+    ``stages`` lists ``{"key", "count", "percent"}`` from the scan to the
+    call, ``percent`` relative to the scans.
+    """
+    rows = LocationFunnelStats.objects.all()
+    if location_ids is not None:
+        rows = rows.filter(location_id__in=location_ids)
+    if start is not None:
+        rows = rows.filter(day__gte=start)
+    if end is not None:
+        rows = rows.filter(day__lt=end)
+    totals = {
+        field: value or 0
+        for field, value in rows.aggregate(**{f: Sum(f) for f in FUNNEL_FIELDS}).items()
+    }
+    sessions = totals["sessions"]
+    totals["stages"] = [
+        {
+            "key": key,
+            "count": totals[key],
+            "percent": totals[key] / sessions * 100 if sessions else None,
+        }
+        for key in FUNNEL_STAGES
+    ]
+    return totals
+
+
+def rebuild_funnel(location_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute the daily funnel rollup from the visit sessions."""
+    sessions = VisitSession.objects.all()
+    rollup = LocationFunnelStats.objects.all()
+    if location_ids is not None:
+        location_ids = list(location_ids)
+        sessions = sessions.filter(location_id__in=location_ids)
+        rollup = rollup.filter(location_id__in=location_ids)
+
+    rows = (
+        sessions.annotate(day=TruncDate("started_at", tzinfo=stats_timezone()))
+        .values("location_id", "day")
+        .annotate(
+            sessions=Count("id"),
+            returning=Count("id", filter=Q(returning=True)),
+            catalog=Count("id", filter=Q(stage__gte=1)),
+            item=Count("id", filter=Q(stage__gte=2)),
+            calls=Count("id", filter=Q(stage__gte=3)),
+            page_views=Sum(
+                F("landing_views") + F("catalog_views") + F("category_views") + F("item_views")
+            ),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        rollup.delete()
+        created = LocationFunnelStats.objects.bulk_create(
+            [LocationFunnelStats(**row) for row in rows], batch_size=1000
+        )
+    return len(created)
@@ -0,0 +1,40 @@
+"""Media storage that keeps a single copy of identical catalog images."""
+
+from django.core.files.storage import FileSystemStorage
+
+from .images import fingerprint_bytes
+
+
+class DeduplicatingFileSystemStorage(FileSystemStorage):
+    """``FileSystemStorage`` that reuses an existing file with the same bytes.
+
+    Saves under the catalog upload directories are fingerprinted; when the
+    content is already stored, the existing name is returned instead of
+    writing a copy with a random suffix. Other paths behave as usual.
+    """
+
+    def save(self, name, content, max_length=None):
+        # Imported here: the storage is instantiated before apps are ready
+        from . import dedup
+
+        if name is None:
+            name = content.name
+        if not dedup.tracked(name):
+            return super().save(name, content, max_length=max_length)
+
+        data = b"".join(content.chunks())
+        sha256, phash = fingerprint_bytes(data)
+        existing = dedup.find_existing(sha256, self)
+        if existing and (max_length is None or len(existing) <= max_length):
+            return existing
+
+        name = super().save(name, content, max_length=max_length)
+        dedup.record(name, sha256, phash, len(data))
+        return name
+
+    def delete(self, name):
+        from . import dedup
+
+        super().delete(name)
+        if dedup.tracked(name):
+            dedup.forget(name)
@@ -1,4 +1,8 @@
 from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html_join
 
 register = template.Library()
 
@@ -9,3 +13,43 @@ def mul(value, arg):
         return int(value) * int(arg)
     except (ValueError, TypeError):
         return 0
+
+
+def _hashed_files():
+    # Empty with DEBUG or before collectstatic: templates fall back to sources
+    if settings.DEBUG:
+        return {}
+    return getattr(staticfiles_storage, "hashed_files", {})
+
+
+@register.simple_tag
+def static_bundle(name):
+    """Tag(s) for a bundle from ``settings.STATIC_BUNDLES``.
+
+    The hashed bundle when it was collected, the separate sources otherwise.
+    """
+    if name in _hashed_files():
+        files = [name]
+    else:
+        files = settings.STATIC_BUNDLES[name]
+    if name.endswith(".js"):
+        html = '<script src="{}" defer></script>'
+    else:
+        html = '<link rel="stylesheet" href="{}">'
+    return format_html_join("\n", html, ((static(file),) for file in files))
+
+
+@register.simple_tag
+def picture_sources(name):
+    """``<source>`` elements for the AVIF/WebP variants of a static image."""
+    root = name.rsplit(".", 1)[0]
+    hashed = _hashed_files()
+    return format_html_join(
+        "\n",
+        '<source type="{}" srcset="{}">',
+        (
+            (mime, static(variant))
+            for variant, mime in ((root + ".avif", "image/avif"), (root + ".webp", "image/webp"))
+            if variant in hashed
+        ),
+    )
@@ -1,3 +1,1146 @@
-from django.test import TestCase
+import csv
+import datetime as _dt
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import (
+    LiveServerTestCase,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from users.models import CustomUser
+
+from . import (
+    caching,
+    checks,
+    dedup,
+    exports,
+    location_import,
+    profiling,
+    qrcodes,
+    querystats,
+    ratelimit,
+    recommendations,
+    routers,
+    search,
+    stats,
+    visits,
+)
+from .management.commands.run_telegram_bot import QRStatsBot
+from .models import (
+    FurnitureCategory,
+    FurnitureImage,
+    FurnitureItem,
+    FurnitureItemView,
+    ImageFingerprint,
+    Location,
+    LocationFunnelStats,
+    LocationHourlyStats,
+    PhoneClick,
+    Profile,
+    QRCodeScan,
+    QueryStat,
+    RelatedItem,
+    VisitSession,
+)
+from .admin import RECENT_SCANS_LIMIT, QRCodeScanAdmin
+from .stats import location_comparison
+from .templatetags import main_extras
+from .views import (
+    AsyncLocationVisitView,
+    AsyncRecordPhoneClickView,
+    AsyncTokenVisitView,
+    LocationVisitView,
+    RecordPhoneClickView,
+    ScanExportAPIView,
+    TokenVisitView,
+)
+
+UTC = _dt.timezone.utc
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class CacheTestCase(TestCase):
+    """Runs on a private in-memory cache, emptied before each test."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # Buffered visit events must not reach the next test
+        self.addCleanup(visits.flush)
+
+
+def api_client():
+    user = CustomUser.objects.create_user("api", password="x")
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}")
+    return client
+
+
+def scan_at(location, moment, clicks=0):
+    scan = QRCodeScan.objects.create(location=location)
+    QRCodeScan.objects.filter(pk=scan.pk).update(timestamp=moment)
+    scan.timestamp = moment
+    for _ in range(clicks):
+        PhoneClick.objects.create(scan=scan)
+    return scan
+
+
+@override_settings(TELEGRAM_BOT_TOKEN="123456:test")
+class LocationComparisonTests(TestCase):
+    def setUp(self):
+        self.end = timezone.now().replace(microsecond=0)
+        self.start = self.end - _dt.timedelta(days=7)
+        self.location = Location.objects.create(name="Склад_1 *центр*")
+
+    def test_counts_both_periods(self):
+        scan_at(self.location, self.end - _dt.timedelta(days=1), clicks=2)
+        scan_at(self.location, self.end - _dt.timedelta(days=2))
+        scan_at(self.location, self.start - _dt.timedelta(days=1))
+        (row,) = location_comparison(self.start, self.end, [self.location.id])
+        self.assertEqual(row["scan_count"], 2)
+        self.assertEqual(row["click_count"], 2)
+        self.assertEqual(row["scan_change"], 100)
+
+    def test_names_are_escaped(self):
+        rows = location_comparison(self.start, self.end, [self.location.id])
+        text = QRStatsBot()._format_comparison(rows, "7d", 0, 1)
+        self.assertIn(r"*Склад\_1 \*центр\**", text)
+
+    @override_settings(STATS_TIME_ZONE="Asia/Tashkent")
+    def test_ranges_are_local_days(self):
+        # 00:30 in Tashkent, still the previous day in UTC
+        now = _dt.datetime(2026, 10, 18, 19, 30, tzinfo=UTC)
+        midnight = _dt.datetime(2026, 10, 18, 19, 0, tzinfo=UTC)
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            today = QRStatsBot._range_bounds("today")
+            yesterday = QRStatsBot._range_bounds("yesterday")
+        self.assertEqual(today, (midnight, midnight + _dt.timedelta(days=1)))
+        self.assertEqual(yesterday, (midnight - _dt.timedelta(days=1), midnight))
+
+    def test_back_button_only_for_admins(self):
+        bot = QRStatsBot()
+
+        def callbacks(kb):
+            return [button.callback_data for row in kb for button in row]
+
+        self.assertIn("back:", callbacks(bot._build_compare_kb("7d", 0, 1, back=True)))
+        self.assertNotIn("back:", callbacks(bot._build_compare_kb("7d", 0, 1)))
+
+
+@override_settings(STATS_TIME_ZONE="Asia/Tashkent")
+class HeatmapTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name="A")
+        # Monday 20:30 UTC is Tuesday 01:30 in Tashkent
+        moment = _dt.datetime(2026, 10, 19, 20, 30, tzinfo=UTC)
+        scan = scan_at(self.location, moment, clicks=1)
+        PhoneClick.objects.update(timestamp=moment)
+        stats.record_scan(scan)
+        stats.record_click(PhoneClick.objects.get())
+
+    def test_events_land_in_the_local_slot(self):
+        matrix = stats.location_heatmap([self.location.id])
+        self.assertEqual(matrix[1][1], {"scans": 1, "clicks": 1})
+        self.assertEqual(sum(cell["scans"] for row in matrix for cell in row), 1)
+
+    def test_rebuild_matches_the_live_counters(self):
+        live = stats.location_heatmap()
+        stats.rebuild_heatmap()
+        self.assertEqual(stats.location_heatmap(), live)
+
+
+class TimeSeriesTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = api_client()
+        self.location = Location.objects.create(name="A")
+        self.params = {
+            "granularity": "day",
+            "start": "2025-03-03T12:00",
+            "end": "2025-03-05",
+            "tz": "UTC",
+        }
+
+    def get(self, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(reverse("location_stats_api"), self.params, headers=headers)
+
+    def test_scans_are_summed_per_bucket(self):
+        for moment in ("2025-03-03T13:10:00", "2025-03-03T13:50:00", "2025-03-04T09:00:00"):
+            moment = _dt.datetime.fromisoformat(moment).replace(tzinfo=UTC)
+            stats.record_scan(scan_at(self.location, moment))
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["locations"][0]["scans"], [2, 1])
+
+    def test_etag_covers_the_start_of_the_first_bucket(self):
+        # Before start, but inside the first day bucket the series sums
+        row = LocationHourlyStats.objects.create(
+            location=self.location, hour=_dt.datetime(2025, 3, 3, 2, tzinfo=UTC), scans=5
+        )
+        first = self.get()
+        self.assertEqual(first.data["locations"][0]["scans"], [5, 0])
+        self.assertEqual(self.get(first["ETag"]).status_code, 304)
+
+        LocationHourlyStats.objects.filter(pk=row.pk).update(
+            scans=15, updated_at=row.updated_at + _dt.timedelta(seconds=1)
+        )
+        second = self.get(first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data["locations"][0]["scans"], [15, 0])
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+
+class ScanExportTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = api_client()
+        location = Location.objects.create(name="=HYPERLINK(1)")
+        scan = QRCodeScan.objects.create(
+            location=location, user_agent="=cmd|' /C calc'!A0", ip_address="10.0.0.1"
+        )
+        PhoneClick.objects.create(scan=scan)
+        PhoneClick.objects.create(scan=scan)
+
+    def export(self, output):
+        response = self.client.get(reverse("scan_export_api"), {"output": output})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode("utf-8-sig")
+
+    def test_csv_neutralizes_formulas(self):
+        header, row = csv.reader(io.StringIO(self.export("csv")))
+        record = dict(zip(header, row))
+        self.assertEqual(record["user_agent"], "'=cmd|' /C calc'!A0")
+        self.assertEqual(record["location_name"], "'=HYPERLINK(1)")
+        self.assertEqual(record["phone_clicks"], "2")
+
+    def test_ndjson_keeps_raw_values(self):
+        record = json.loads(self.export("ndjson"))
+        self.assertEqual(record["user_agent"], "=cmd|' /C calc'!A0")
+        self.assertEqual(record["phone_clicks"], 2)
+
+
+class UpdateFurnitureFromJsonTests(TestCase):
+    def setUp(self):
+        self.category = FurnitureCategory.objects.create(name="Детская мебель", slug="kids")
+        self.item = FurnitureItem.objects.create(
+            category=self.category,
+            name="children_furniture_1",
+            slug="children-furniture-1",
+            description="",
+            main_image="furniture/1.jpg",
+        )
+        data = {
+            "Детская мебель": [
+                {"old_name": "children_furniture_1", "new_name": "Сканди Уют", "description": "Светлая"},
+                {"old_name": "missing", "new_name": "Нет", "description": ""},
+            ]
+        }
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".json", encoding="utf-8", delete=False
+        ) as fp:
+            json.dump(data, fp, ensure_ascii=False)
+        self.addCleanup(os.unlink, fp.name)
+        self.path = fp.name
+
+    def run_command(self):
+        out = io.StringIO()
+        call_command("update_furniture_from_json", json_file=self.path, stdout=out)
+        return out.getvalue()
+
+    def test_renames_once(self):
+        output = self.run_command()
+        self.assertIn("Items updated: 1", output)
+        self.assertIn("Items not found: 1", output)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.name, self.item.description), ("Сканди Уют", "Светлая"))
+
+        self.assertIn("Items unchanged: 1", self.run_command())
+
+
+def png_bytes(pattern, dark=10):
+    """A small PNG whose perceptual hash follows ``pattern`` (0/1 per column)."""
+    image = Image.new("L", (90, 80))
+    for x in range(90):
+        shade = 250 if pattern[x // 10 % len(pattern)] else dark
+        for y in range(80):
+            image.putpixel((x, y), shade)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class TemporaryMediaMixin:
+    """Runs with ``MEDIA_ROOT`` in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(data)
+
+
+class FolderImportTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        photos = tempfile.TemporaryDirectory()
+        self.addCleanup(photos.cleanup)
+        self.root = photos.name
+        for name, data in (
+            ("shkaf/a.png", png_bytes([1, 0])),
+            ("shkaf/b/1.png", png_bytes([0, 1])),
+            ("shkaf/b/2.png", png_bytes([1, 1, 0])),
+            ("shkaf/c.jpg", b"not an image"),
+        ):
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fp:
+                fp.write(data)
+
+    def run_command(self):
+        output = io.StringIO()
+        call_command("import_catalog_folders", self.root, workers=1, stdout=output)
+        return output.getvalue()
+
+    def test_imports_items_with_galleries_once(self):
+        output = self.run_command()
+        self.assertIn("Skipping", output)
+        self.assertIn("Items created: 2, gallery images: 1", output)
+        self.assertEqual(FurnitureCategory.objects.get().name, "Шкафы")
+        gallery_item = FurnitureItem.objects.get(name="shkaf_2")
+        self.assertEqual(gallery_item.images.count(), 1)
+        self.assertTrue(default_storage.exists(gallery_item.main_image.name))
+
+        self.assertIn("Items created: 0, gallery images: 0, already imported: 2", self.run_command())
+        self.assertEqual(FurnitureItem.objects.count(), 2)
+
+
+class DeduplicationTests(TemporaryMediaMixin, TestCase):
+    def test_identical_uploads_share_a_file(self):
+        data = png_bytes([1, 0, 1])
+        first = default_storage.save("furniture/a.png", ContentFile(data))
+        second = default_storage.save("furniture/b.png", ContentFile(data))
+        self.assertEqual(first, second)
+        self.assertEqual(ImageFingerprint.objects.count(), 1)
+        # Other directories are stored as usual
+        self.assertNotEqual(
+            default_storage.save("other/a.png", ContentFile(data)),
+            default_storage.save("other/a.png", ContentFile(data)),
+        )
+
+    def test_near_duplicates_are_found_through_the_band_index(self):
+        dedup.record("furniture/a.png", "a" * 64, "00ff00ff00ff00ff", 1)
+        dedup.record("furniture/b.png", "b" * 64, "00ff00ff00ff00fe", 1)
+        dedup.record("furniture/c.png", "c" * 64, "ff00ff00ff00ff00", 1)
+        # Same content is shared by the storage, not reported
+        dedup.record("furniture/a2.png", "a" * 64, "00ff00ff00ff00ff", 1)
+        self.assertEqual(
+            dedup.near_duplicates(["furniture/a.png", "furniture/c.png"]),
+            {"furniture/a.png": ["furniture/b.png"]},
+        )
+
+    def test_admin_warns_about_near_duplicate_uploads(self):
+        default_storage.save("categories/old.png", ContentFile(png_bytes([1, 0, 0, 1])))
+        admin_user = CustomUser.objects.create_superuser("admin", password="x")
+        self.client.force_login(admin_user)
+        upload = SimpleUploadedFile("new.png", png_bytes([1, 0, 0, 1], dark=30), "image/png")
+        response = self.client.post(
+            reverse("admin:main_furniturecategory_add"),
+            {"name": "Шкафы", "slug": "shkafy", "order": 0, "is_active": "on", "image": upload},
+            follow=True,
+        )
+        self.assertContains(response, "looks like categories/old.png")
+
+    def test_merge_touches_the_rows_it_repoints(self):
+        data = png_bytes([1, 1, 0])
+        for name in ("furniture/chair.png", "furniture/chair_x1.png", "furniture_gallery/chair.png"):
+            self.write(name, data)
+        category = FurnitureCategory.objects.create(name="C", slug="c")
+        first = FurnitureItem.objects.create(
+            category=category, name="A", slug="a", description="", main_image="furniture/chair.png"
+        )
+        second = FurnitureItem.objects.create(
+            category=category, name="B", slug="b", description="", main_image="furniture/chair_x1.png"
+        )
+        FurnitureImage.objects.create(furniture=first, image="furniture_gallery/chair.png")
+        long_ago = timezone.now() - _dt.timedelta(days=1)
+        FurnitureItem.objects.update(updated_at=long_ago)
+
+        call_command("dedupe_media", apply=True, workers=1, stdout=io.StringIO())
+
+        self.assertEqual(
+            set(FurnitureItem.objects.values_list("main_image", flat=True)),
+            {"furniture/chair.png"},
+        )
+        self.assertEqual(FurnitureImage.objects.get().image.name, "furniture/chair.png")
+        self.assertFalse(FurnitureItem.objects.filter(updated_at=long_ago).exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "furniture/chair_x1.png")))
+
+
+class LocationAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(CustomUser.objects.create_superuser("admin", password="x"))
+        self.user = CustomUser.objects.create_user("owner", password="x", phone_number="901234567")
+
+    def add_location(self, name, scans):
+        location = Location.objects.create(name=name)
+        location.user.add(self.user)
+        for _ in range(scans):
+            stats.record_scan(QRCodeScan.objects.create(location=location))
+        return location
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:main_location_changelist"))
+        return response, len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_location("A", 3)
+        response, few = self.changelist_queries()
+        self.assertEqual(
+            [location.scan_total for location in response.context["cl"].result_list], [3]
+        )
+        for index in range(4):
+            self.add_location(f"B{index}", 1)
+        self.assertEqual(self.changelist_queries()[1], few)
+
+    def test_change_form_lists_only_recent_scans(self):
+        location = self.add_location("A", RECENT_SCANS_LIMIT + 5)
+        response = self.client.get(reverse("admin:main_location_change", args=[location.pk]))
+        (inline,) = response.context["inline_admin_formsets"]
+        self.assertEqual(len(inline.formset.forms), RECENT_SCANS_LIMIT)
+        self.assertContains(response, f"All scans ({RECENT_SCANS_LIMIT + 5})")
+
+
+class ScanChangelistTests(TestCase):
+    def setUp(self):
+        self.client.force_login(CustomUser.objects.create_superuser("admin", password="x"))
+        location = Location.objects.create(name="A")
+        moment = _dt.datetime(2025, 3, 3, 12, tzinfo=UTC)
+        # Two scans share a timestamp: the cursor must not skip either
+        self.scans = [
+            scan_at(location, moment + _dt.timedelta(minutes=minutes))
+            for minutes in (0, 5, 5, 10, 20)
+        ]
+        stats.rebuild_hourly()
+
+    def pages(self, query=""):
+        changelist_url = reverse("admin:main_qrcodescan_changelist")
+        while query is not None:
+            response = self.client.get(changelist_url + query)
+            self.assertEqual(response.status_code, 200)
+            changelist = response.context["cl"]
+            yield [scan.pk for scan in changelist.result_list]
+            query = changelist.keyset_next_url
+
+    @mock.patch.object(QRCodeScanAdmin, "list_per_page", 2)
+    def test_cursor_walks_every_row_once(self):
+        expected = [
+            scan.pk for scan in sorted(self.scans, key=lambda s: (s.timestamp, s.pk), reverse=True)
+        ]
+        pages = list(self.pages())
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_period_filter_uses_local_days(self):
+        (page,) = self.pages("?period=2025-03-03")
+        self.assertEqual(len(page), 5)
+        self.assertEqual(list(self.pages("?period=2025-03-04")), [[]])
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        search._index = None
+        self.addCleanup(setattr, search, "_index", None)
+        category = FurnitureCategory.objects.create(name="Шкафы", slug="shkafy")
+        self.items = {
+            name: FurnitureItem.objects.create(
+                category=category,
+                name=name,
+                slug=slug,
+                description=description,
+                main_image=f"furniture/{slug}.jpg",
+            )
+            for name, slug, description in (
+                ("Шкаф белый", "a", "шкаф шкаф шкаф"),
+                ("Шкаф дуб", "b", "шкаф шкаф"),
+                ("Шкаф узкий", "c", "шкаф"),
+            )
+        }
+
+    def results(self):
+        response = self.client.get(reverse("catalog_search_api"), {"q": "шкаф"})
+        self.assertEqual(response.status_code, 200)
+        return {row["name"]: row["score"] for row in response.json()["results"]}
+
+    def test_results_are_ranked(self):
+        response = self.client.get(reverse("catalog_search_api"), {"q": "шкаф"})
+        names = [row["name"] for row in response.json()["results"]]
+        self.assertEqual(names, ["Шкаф белый", "Шкаф дуб", "Шкаф узкий"])
+
+    def test_scores_stay_with_their_items_after_a_delete(self):
+        scores = self.results()
+        # Still in the index until its version is checked again
+        self.items["Шкаф дуб"].delete()
+        self.assertEqual(
+            self.results(),
+            {"Шкаф белый": scores["Шкаф белый"], "Шкаф узкий": scores["Шкаф узкий"]},
+        )
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.categories = [
+            FurnitureCategory.objects.create(name=name, slug=name) for name in ("a", "b")
+        ]
+        self.items = [
+            FurnitureItem.objects.create(
+                category=self.categories[i % 2],
+                name=f"Стул {i}",
+                slug=f"item-{i}",
+                description="стул",
+                main_image=f"furniture/{i}.jpg",
+            )
+            for i in range(6)
+        ]
+        visits = [(0, 1), (0, 1, 2), (1, 3), (2, 3, 4), (3, 5), (4, 5), (5,)]
+        for items in visits:
+            visitor = uuid.uuid4()
+            for i in items:
+                FurnitureItemView.objects.create(item=self.items[i], visitor_id=visitor)
+
+    def test_scoped_coviews_match_the_full_computation(self):
+        since = timezone.now() - _dt.timedelta(days=1)
+        full = recommendations.coview_scores(since)
+        scope = [item.id for item in self.items if item.category == self.categories[0]]
+        self.assertEqual(
+            recommendations.coview_scores(since, scope),
+            {item: scores for item, scores in full.items() if item in scope},
+        )
+
+    def test_refresh_writes_ranked_related_items(self):
+        written = recommendations.refresh_categories([self.categories[0].id], top_k=2)
+        self.assertEqual(written, {self.categories[0].id: 6})
+        first = self.items[0]
+        related = list(first.recommendations.values_list("related_id", flat=True))
+        # Item 1 is in the other category, but was viewed together with it
+        self.assertEqual(set(related), {self.items[1].id, self.items[2].id})
+        self.assertFalse(RelatedItem.objects.filter(item__category=self.categories[1]).exists())
+
+    def test_old_views_are_purged(self):
+        old = timezone.now() - _dt.timedelta(days=recommendations.COVIEW_DAYS + 1)
+        FurnitureItemView.objects.filter(item=self.items[5]).update(timestamp=old)
+        self.assertEqual(recommendations.purge_views(batch_size=2), 3)
+        self.assertEqual(FurnitureItemView.objects.count(), 12)
+
+
+class CatalogAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = FurnitureCategory.objects.create(name="C", slug="c")
+        self.items = [
+            FurnitureItem.objects.create(
+                category=self.category, name=f"I{n}", slug=f"i{n}", description="", main_image=""
+            )
+            for n in range(3)
+        ]
+
+    def test_cursor_pages_and_field_selection(self):
+        url = reverse("catalog_item_list_api")
+        response = self.client.get(url, {"page_size": 2, "fields": "id,slug"})
+        self.assertEqual(
+            response.data["results"],
+            [{"id": item.id, "slug": item.slug} for item in self.items[:2]],
+        )
+        response = self.client.get(response.data["next"])
+        self.assertEqual([row["slug"] for row in response.data["results"]], ["i2"])
+        self.assertIsNone(response.data["next"])
+
+    def test_conditional_get_follows_the_category(self):
+        url = reverse("catalog_item_detail_api", args=["i0"])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        cached = self.client.get(url, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+
+        FurnitureCategory.objects.update(updated_at=timezone.now() + _dt.timedelta(seconds=1))
+        second = self.client.get(url, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+
+class StaticPipelineTests(TestCase):
+    def setUp(self):
+        sources = tempfile.TemporaryDirectory()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(sources.cleanup)
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        for name, text in (
+            ("css/a.css", "/* header */\n" + ".menu  a {\n  color: red;\n}\n" * 20),
+            ("css/b.css", ".card:hover { margin : 0 }\n"),
+            ("js/app.js", "// setup\n  var url = 'http://example.com';\n"),
+        ):
+            path = os.path.join(sources.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fp:
+                fp.write(text)
+        override = override_settings(
+            STATICFILES_DIRS=[sources.name],
+            STATIC_ROOT=self.root,
+            STATIC_BUNDLES={"css/all.bundle.css": ["css/a.css", "css/b.css"]},
+            # Only the files above, not the admin's
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), "rb") as fp:
+            return fp.read()
+
+    def test_collectstatic_minifies_bundles_and_precompresses(self):
+        call_command("collectstatic", interactive=False, verbosity=0)
+        hashed = staticfiles_storage.hashed_files
+        bundle = self.read(hashed["css/all.bundle.css"])
+        self.assertEqual(bundle, b".menu a{color:red}" * 20 + b"\n.card:hover{margin :0}")
+        self.assertEqual(self.read(hashed["js/app.js"]), b"var url = 'http://example.com';\n")
+        self.assertEqual(gzip.decompress(self.read(hashed["css/all.bundle.css"] + ".gz")), bundle)
+        report = json.loads(self.read("staticfiles-report.json"))
+        entry = report["assets"]["css/all.bundle.css"]
+        self.assertEqual(entry["hashed"], hashed["css/all.bundle.css"])
+        self.assertLess(entry["gzip"], entry["minified"])
+
+        with override_settings(DEBUG=False):
+            tag = main_extras.static_bundle("css/all.bundle.css")
+        self.assertIn(hashed["css/all.bundle.css"], tag)
+        with override_settings(DEBUG=True):
+            self.assertIn("css/a.css", main_extras.static_bundle("css/all.bundle.css"))
+
+
+# Pages are rendered in threads, which need the data committed
+class StaticExportTests(TemporaryMediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.output = os.path.join(self.media_root, "static_catalog")
+        category = FurnitureCategory.objects.create(name="Шкафы", slug="shkafy")
+        FurnitureItem.objects.create(
+            category=category, name="Шкаф", slug="shkaf", description="", main_image="furniture/a.jpg"
+        )
+
+    def export(self, **options):
+        call_command(
+            "export_static_catalog", output=self.output, workers=1, stdout=io.StringIO(), **options
+        )
+        with open(os.path.join(self.output, ".manifest.json"), encoding="utf-8") as fp:
+            return json.load(fp)["pages"]
+
+    def test_catalog_pages_are_exported_but_not_the_landing_page(self):
+        pages = self.export(full=True)
+        self.assertEqual(set(pages), {"/catalog/", "/catalog/shkafy/", "/catalog/shkafy/shkaf/"})
+        self.assertTrue(os.path.exists(os.path.join(self.output, "catalog/shkafy/shkaf/index.html.gz")))
+        self.assertFalse(os.path.exists(os.path.join(self.output, "index.html")))
+
+    def test_landing_page_of_an_older_export_is_removed(self):
+        self.export(full=True)
+        manifest_path = os.path.join(self.output, ".manifest.json")
+        with open(manifest_path, encoding="utf-8") as fp:
+            manifest = json.load(fp)
+        manifest["pages"]["/"] = "0" * 64
+        with open(manifest_path, "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp)
+        self.write("static_catalog/index.html", b"<html></html>")
+
+        self.assertNotIn("/", self.export())
+        self.assertFalse(os.path.exists(os.path.join(self.output, "index.html")))
+
+    def test_exported_pages_report_their_views(self):
+        self.addCleanup(visits.flush)
+        self.export(full=True)
+        with open(os.path.join(self.output, "catalog/shkafy/shkaf/index.html"), encoding="utf-8") as fp:
+            self.assertIn(reverse("page_view_beacon"), fp.read())
+        self.assertNotIn(reverse("page_view_beacon"), self.client.get("/catalog/shkafy/shkaf/").content.decode())
+
+
+class PhoneClickTests(CacheTestCase):
+    views = {
+        "sync": RecordPhoneClickView.as_view(),
+        "async": async_to_sync(AsyncRecordPhoneClickView.as_view()),
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.scan = QRCodeScan.objects.create(location=Location.objects.create(name="A"))
+
+    def post(self, kind, data):
+        request = RequestFactory().post(
+            reverse("record_phone_click"), json.dumps(data), content_type="application/json"
+        )
+        response = self.views[kind](request)
+        if hasattr(response, "render"):
+            response.render()
+        return response.status_code, json.loads(response.content)
+
+    def test_both_views_answer_alike(self):
+        cases = [
+            ({}, 400),
+            ({"visit_id": "nope"}, 400),
+            ({"visit_id": ["x"]}, 400),
+            ({"visit_id": str(uuid.uuid4())}, 404),
+            ({"visit_id": str(self.scan.visit_id).upper()}, 201),
+        ]
+        for kind in self.views:
+            for data, expected in cases:
+                with self.subTest(kind=kind, data=data):
+                    code, body = self.post(kind, data)
+                    self.assertEqual(code, expected)
+                    self.assertNotIn("valid UUID", json.dumps(body))
+        self.assertEqual(PhoneClick.objects.filter(scan=self.scan).count(), 2)
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMITS={"visit": {"ip": "2/m", "location": "3/m"}},
+    CLIENT_IP_HEADER="",
+)
+class RateLimitTests(CacheTestCase):
+    def request(self, address, **headers):
+        request = RequestFactory().get("/", REMOTE_ADDR=address, headers=headers)
+        return ratelimit.check("visit", ip=ratelimit.client_ip(request), location=1)
+
+    def test_without_client_ip_header_only_the_location_bucket_applies(self):
+        self.assertEqual([self.request("10.0.0.1") for _ in range(3)], [None] * 3)
+        self.assertIsNotNone(self.request("10.0.0.1"))
+
+    @override_settings(CLIENT_IP_HEADER="X-Real-IP")
+    def test_ip_bucket_is_keyed_by_the_forwarded_address(self):
+        self.assertIsNone(self.request("10.0.0.1", x_real_ip="1.1.1.1"))
+        self.assertIsNone(self.request("10.0.0.1", x_real_ip="1.1.1.1"))
+        self.assertIsNotNone(self.request("10.0.0.1", x_real_ip="1.1.1.1"))
+        # Same proxy, another visitor: only the location bucket is shared
+        self.assertIsNone(self.request("10.0.0.1", x_real_ip="2.2.2.2"))
+
+
+class SeedFunnelDataTests(TestCase):
+    def test_seeds_history_and_rebuilds_statistics(self):
+        # The test runner turns DEBUG off
+        call_command(
+            "seed_funnel_data",
+            locations=3,
+            users=2,
+            days=5,
+            scans_per_day=20,
+            force=True,
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(Location.objects.count(), 3)
+        self.assertTrue(QRCodeScan.objects.exists())
+        now = timezone.now()
+        self.assertFalse(QRCodeScan.objects.filter(timestamp__gt=now).exists())
+        hourly = LocationHourlyStats.objects.aggregate(scans=Sum("scans"), clicks=Sum("clicks"))
+        self.assertEqual(hourly["scans"], QRCodeScan.objects.count())
+        self.assertEqual(hourly["clicks"], PhoneClick.objects.count())
+
+    def test_refuses_production_without_force(self):
+        with self.assertRaises(CommandError):
+            call_command("seed_funnel_data", locations=1, stdout=io.StringIO())
+
+
+@override_settings(RATE_LIMITS={"visit": {"location": "3/m"}}, VISIT_TRACKING_ENABLED=False)
+class LoadTestTests(LiveServerTestCase):
+    def run_loadtest(self, output):
+        location = Location.objects.create(name="A")
+        stdout = io.StringIO()
+        call_command(
+            "loadtest",
+            url=self.live_server_url,
+            location=[location.id],
+            scenario="visit",
+            concurrency=2,
+            duration=0.5,
+            warmup=0,
+            output=output,
+            stdout=stdout,
+        )
+        with open(output) as fp:
+            return json.load(fp), stdout.getvalue()
+
+    def test_refused_visits_are_reported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results, output = self.run_loadtest(os.path.join(directory, "run.json"))
+        self.assertGreater(results["errors"]["visit refused"], 0)
+        self.assertIn("mostly measure the rate limiter", output)
+        # Only the first few got through; concurrent ones may share the last token
+        self.assertLess(QRCodeScan.objects.count(), results["requests"])
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=False, QR_SIGNING_KEY="new", QR_SIGNING_KEY_FALLBACKS=["old"]
+)
+class SignedVisitTests(CacheTestCase):
+    views = {
+        "sync": (TokenVisitView.as_view(), LocationVisitView.as_view()),
+        "async": (
+            async_to_sync(AsyncTokenVisitView.as_view()),
+            async_to_sync(AsyncLocationVisitView.as_view()),
+        ),
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.location = Location.objects.create(name="A")
+
+    def visit(self, kind, token=None, location_id=None):
+        token_view, legacy_view = self.views[kind]
+        request = RequestFactory().get("/")
+        if token is not None:
+            return token_view(request, token=token)["Location"]
+        return legacy_view(request, location_id=location_id)["Location"]
+
+    def test_tokens_round_trip_under_current_and_fallback_keys(self):
+        token = qrcodes.make_token(self.location.id, 3)
+        self.assertEqual(qrcodes.read_token(token), (self.location.id, 3))
+        with override_settings(QR_SIGNING_KEY="old", QR_SIGNING_KEY_FALLBACKS=[]):
+            old = qrcodes.make_token(self.location.id, 3)
+        self.assertEqual(qrcodes.read_token(old), (self.location.id, 3))
+        tampered = token[:-1] + ("B" if token.endswith("A") else "A")
+        self.assertIsNone(qrcodes.read_token(tampered))
+        self.assertIsNone(qrcodes.read_token(token + "x"))
+
+    def test_reissued_codes_stop_recording_scans(self):
+        for kind in self.views:
+            with self.subTest(kind):
+                Location.objects.filter(pk=self.location.pk).update(qr_version=1)
+                qrcodes.forget_versions([self.location.id])
+                token = qrcodes.make_token(self.location.id, 1)
+                self.assertTrue(self.visit(kind, token).startswith("/?visit_id="))
+                Location.objects.filter(pk=self.location.pk).update(qr_version=2)
+                qrcodes.forget_versions([self.location.id])
+                scans = QRCodeScan.objects.count()
+                self.assertEqual(self.visit(kind, token), "/")
+                self.assertEqual(QRCodeScan.objects.count(), scans)
+
+    def test_legacy_urls_can_be_turned_off(self):
+        for kind in self.views:
+            with self.subTest(kind):
+                self.assertTrue(
+                    self.visit(kind, location_id=self.location.id).startswith("/?visit_id=")
+                )
+                self.assertEqual(self.visit(kind, location_id=self.location.id + 1), "/")
+                with override_settings(QR_LEGACY_VISITS=False):
+                    self.assertEqual(self.visit(kind, location_id=self.location.id), "/")
+
+
+class LocationImportTests(TestCase):
+    def test_phone_key_is_the_national_number(self):
+        for phone in ("+998 90 356-43-34", "998903564334", "90 356 43 34", "(90) 356 43 34"):
+            self.assertEqual(location_import.phone_key(phone), "903564334")
+        self.assertEqual(location_import.phone_key("356 43 34"), "")
+
+    def test_admin_import_links_users_without_prerendering(self):
+        user = CustomUser.objects.create_user(
+            "owner", password="x", phone_number="+998 (90) 356-43-34"
+        )
+        self.client.force_login(CustomUser.objects.create_superuser("admin", password="x"))
+        upload = SimpleUploadedFile(
+            "locations.csv", "name,phones\nКафе,90 356 43 34\n".encode(), "text/csv"
+        )
+        with mock.patch("main.qrcodes.prerender") as prerender:
+            response = self.client.post(reverse("admin:location-import"), {"file": upload})
+        self.assertContains(response, "Locations created: 1 of 1 rows, user links: 1")
+        self.assertEqual(list(Location.objects.get(name="Кафе").user.all()), [user])
+        prerender.assert_not_called()
+
+    def test_xlsx_workbook_is_closed_after_reading(self):
+        from openpyxl import Workbook
+
+        book = Workbook()
+        book.active.append(["Название", "Телефоны"])
+        book.active.append(["Кафе", "90 356 43 34"])
+        upload = io.BytesIO()
+        book.save(upload)
+        upload.seek(0)
+        with mock.patch("openpyxl.workbook.workbook.Workbook.close", autospec=True) as close:
+            rows = location_import.read_rows(upload, "locations.xlsx")
+        self.assertEqual([row["name"] for row in rows], ["Кафе"])
+        close.assert_called_once()
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    # Not a TestCase: its transaction would keep every read on the primary
+    @mock.patch.object(routers, "configured", return_value=True)
+    @mock.patch.object(routers, "replica_available", return_value=True)
+    def test_reads_use_the_replica_only_inside_the_block(self, available, configured):
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Location))
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Location), "replica")
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Location), "default")
+            self.assertEqual(router.db_for_write(Location), "default")
+            # It sees its own writes from now on
+            self.assertEqual(router.db_for_read(Location), "default")
+        available.return_value = False
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Location), "default")
+
+    @mock.patch.object(routers, "configured", return_value=True)
+    @mock.patch.object(routers, "replica_available", return_value=True)
+    def test_streamed_export_reads_from_the_replica(self, available, configured):
+        request = APIRequestFactory().get(reverse("scan_export_api"))
+        # No token lookup: the test database has no replica alias
+        force_authenticate(request, user=CustomUser(username="api"))
+        with mock.patch.object(exports, "export_response", return_value=HttpResponse()) as export:
+            self.assertEqual(ScanExportAPIView.as_view()(request).status_code, 200)
+        # Evaluated after the view returned, as the streaming response does
+        (scans, _), _ = export.call_args
+        self.assertEqual(scans.db, "replica")
+
+    @override_settings(DB_REPLICA_MAX_LAG=5, DB_REPLICA_CHECK_INTERVAL=60)
+    def test_lagging_replica_is_skipped_until_the_next_check(self):
+        self.addCleanup(routers._health.update, dict(routers._health))
+        routers._health.update(checked=None)
+        with mock.patch.object(routers, "replica_lag", return_value=10.0) as lag:
+            self.assertFalse(routers.replica_available())
+            self.assertFalse(routers.replica_available())
+        lag.assert_called_once()
+
+
+class ProfilingTests(TestCase):
+    def test_sampler_counts_the_profiled_thread(self):
+        with profiling.Sampler({threading.get_ident()}, interval_ms=1) as sampler:
+            busy(0.05)
+        self.assertGreater(sampler.samples, 0)
+        (leaf, _), *_ = profiling.hot_functions(sampler.collapsed())
+        self.assertEqual(leaf, "main.tests:busy")
+
+    def test_collapsed_profiles_merge_and_truncate(self):
+        merged = profiling.merge(["a;b 2\na;c 1", "a;b 3"])
+        self.assertEqual(merged, "a;b 5\na;c 1\n")
+        sampler = profiling.Sampler()
+        sampler.stacks.update({"a;b": 5, "a;c": 1, "a;d": 1})
+        self.assertEqual(sampler.collapsed(limit=1), "a;b 5\n[truncated] 2")
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_INTERVAL_MS=0.5, PROFILING_MAX_PROFILES=1)
+    def test_staff_header_profiles_the_request(self):
+        self.client.force_login(CustomUser.objects.create_superuser("admin", password="x"))
+        for _ in range(2):
+            response = self.client.get(
+                reverse("admin:main_location_changelist"), headers={"X-Profile": "1"}
+            )
+        profile = Profile.objects.get()
+        self.assertEqual(response["X-Profile-Id"], str(profile.pk))
+        self.assertEqual(profile.trigger, "header")
+        self.assertEqual(profile.source, "GET admin:main_location_changelist")
+
+
+class QueryStatsTests(TestCase):
+    def test_fingerprint_ignores_values(self):
+        first = querystats.fingerprint("SELECT * FROM t WHERE a = 5 AND b IN (%s, %s) AND c = 'x'")
+        second = querystats.fingerprint("SELECT * FROM t WHERE a = 7 AND b IN (%s) AND c = 'y'")
+        self.assertEqual(first, second)
+        self.assertEqual(first[1], "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?")
+
+    @override_settings(QUERY_STATS_EXPLAIN_THRESHOLD_MS=0)
+    def test_captured_queries_are_merged_with_a_plan(self):
+        querystats.install_all()
+        for _ in range(2):
+            with querystats.capture("test:locations"):
+                list(Location.objects.filter(name="A"))
+        Location.objects.count()  # outside capture()
+        querystats.flush()
+        (row,) = QueryStat.objects.filter(source="test:locations")
+        self.assertEqual(row.count, 2)
+        self.assertIn('"name" = ?', row.sql)
+        self.assertTrue(row.explain_plan)
+        self.assertEqual(sum(row.buckets), 2)
+        self.assertEqual(querystats.p95([0] * 3 + [1]), querystats.BUCKETS_MS[3])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        snapshots = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshots.cleanup)
+        self.snapshots = snapshots.name
+        override = override_settings(METRICS_TOKEN="secret", METRICS_DIR=snapshots.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def scrape(self, token="secret"):
+        return self.client.get(reverse("metrics"), headers={"Authorization": f"Bearer {token}"})
+
+    def sample(self, text, series):
+        for line in text.splitlines():
+            name, _, value = line.rpartition(" ")
+            if name == series:
+                return float(value)
+        return 0.0
+
+    def test_requests_are_counted_per_view(self):
+        series = 'gos_db_queries_per_request_count{view="catalog"}'
+        before = self.sample(self.scrape().content.decode(), series)
+        self.client.get(reverse("catalog"))
+        self.assertEqual(self.sample(self.scrape().content.decode(), series), before + 1)
+
+    def test_snapshots_of_other_processes_are_added(self):
+        series = 'gos_bot_command_errors_total{command="stats"}'
+        with open(os.path.join(self.snapshots, "bot-1.json"), "w") as fp:
+            counter = ["gos_bot_command_errors_total", [["command", "stats"]], 2]
+            json.dump({"counters": [counter], "histograms": []}, fp)
+        self.assertEqual(self.sample(self.scrape().content.decode(), series), 2)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.scrape("wrong").status_code, 401)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.scrape("").status_code, 404)
+
+
+class VisitFunnelTests(CacheTestCase):
+    def test_visit_is_written_in_one_flush(self):
+        location = Location.objects.create(name="A")
+        category = FurnitureCategory.objects.create(name="C", slug="c")
+        item = FurnitureItem.objects.create(
+            category=category, name="I", slug="i", description="", main_image="furniture/i.png"
+        )
+        response = self.client.get(f"/v/{qrcodes.make_token(location.id, location.qr_version)}/")
+        visit_id = response.cookies["visit_id"].value
+        self.assertEqual(self.client.get(reverse("furniture_detail", args=["c", "i"])).status_code, 200)
+        visits.record_call(visit_id)
+        self.assertFalse(FurnitureItemView.objects.exists())
+
+        self.assertEqual(visits.flush(), 1)
+        session = VisitSession.objects.get(visit_id=visit_id)
+        self.assertEqual((session.stage, session.item_views, session.calls), (3, 1, 1))
+        funnel = LocationFunnelStats.objects.get(location=location)
+        self.assertEqual((funnel.sessions, funnel.item, funnel.calls), (1, 1, 1))
+        self.assertEqual(list(FurnitureItemView.objects.values_list("item", flat=True)), [item.pk])
+
+    def test_beacon_of_an_exported_page_counts_like_a_page_view(self):
+        location = Location.objects.create(name="A")
+        category = FurnitureCategory.objects.create(name="C", slug="c")
+        item = FurnitureItem.objects.create(
+            category=category, name="I", slug="i", description="", main_image="furniture/i.png"
+        )
+        response = self.client.get(f"/v/{qrcodes.make_token(location.id, location.qr_version)}/")
+        visit_id = response.cookies["visit_id"].value
+        beacon = reverse("page_view_beacon")
+        self.assertEqual(self.client.post(beacon, "/catalog/c/i/", content_type="text/plain").status_code, 204)
+        self.assertEqual(self.client.post(beacon, "/", content_type="text/plain").status_code, 400)
+
+        visits.flush()
+        self.assertEqual(VisitSession.objects.get(visit_id=visit_id).item_views, 1)
+        self.assertEqual(list(FurnitureItemView.objects.values_list("item", flat=True)), [item.pk])
+
+    def test_new_visitor_gets_one_id_per_request(self):
+        location = Location.objects.create(name="A")
+        category = FurnitureCategory.objects.create(name="C", slug="c")
+        FurnitureItem.objects.create(
+            category=category, name="I", slug="i", description="", main_image="furniture/i.png"
+        )
+        self.client.get(f"/v/{qrcodes.make_token(location.id, location.qr_version)}/")
+        del self.client.cookies["visitor_id"]
+
+        response = self.client.get(reverse("furniture_detail", args=["c", "i"]))
+        visitor_id = uuid.UUID(response.cookies["visitor_id"].value)
+        visits.flush()
+        self.assertEqual(FurnitureItemView.objects.get().visitor_id, visitor_id)
+        self.assertEqual(VisitSession.objects.get().visitor_hash, visits.visitor_hash(visitor_id))
+
+    def test_idle_flush_is_scheduled_until_flushed(self):
+        scan = QRCodeScan.objects.create(location=Location.objects.create(name="A"))
+        visits.record_call(scan.visit_id)
+        self.assertIsNotNone(visits._timer)
+        visits.flush()
+        self.assertIsNone(visits._timer)
+        self.assertEqual(VisitSession.objects.get().calls, 1)
+
+
+class NamespaceCacheTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.namespace = caching.Namespace("test", 60)
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        return self.computed
+
+    def test_value_is_computed_once_until_it_expires(self):
+        self.assertEqual(self.namespace.get_or_set(self.compute, "a", beta=0), 1)
+        self.assertEqual(self.namespace.get_or_set(self.compute, "a", beta=0), 1)
+        self.assertEqual(cache.get("test:a")[0], 1)
+        with mock.patch("main.caching.time.time", return_value=time.time() + 61):
+            self.assertEqual(self.namespace.get_or_set(self.compute, "a", beta=0), 2)
+
+    @mock.patch("main.caching.random.random", return_value=0.5)
+    def test_slow_values_are_refreshed_before_they_expire(self, _):
+        self.namespace.put("old", "slow", delta=0.01)
+        self.assertEqual(self.namespace.get_or_set(self.compute, "slow"), "old")
+        # Took ten minutes to compute: refreshed well before its minute is up
+        self.namespace.put("old", "slow", delta=600)
+        self.assertEqual(self.namespace.get_or_set(self.compute, "slow"), 1)
+
+
+class DeployCheckTests(TestCase):
+    def test_local_cache_is_reported(self):
+        self.assertEqual([warning.id for warning in checks.check_shared_cache(None)], ["main.W001"])
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}}
+    )
+    def test_redis_passes(self):
+        self.assertEqual(checks.check_shared_cache(None), [])
+
+    @override_settings(RATE_LIMIT_ENABLED=True, CLIENT_IP_HEADER="")
+    def test_missing_client_ip_header_is_reported(self):
+        self.assertEqual(
+            [warning.id for warning in checks.check_client_ip_header(None)], ["main.W002"]
+        )
+
+    @override_settings(RATE_LIMIT_ENABLED=True, CLIENT_IP_HEADER="X-Real-IP")
+    def test_client_ip_header_passes(self):
+        self.assertEqual(checks.check_client_ip_header(None), [])
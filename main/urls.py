@@ -1,36 +1,94 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
 
 from .views import (
+    AsyncLandingPageView,
+    AsyncLocationVisitView,
+    AsyncRecordPhoneClickView,
+    AsyncTokenVisitView,
+    CatalogCategoryDetailAPIView,
+    CatalogCategoryListAPIView,
+    CatalogItemDetailAPIView,
+    CatalogItemListAPIView,
+    CatalogSearchAPIView,
+    CatalogSearchView,
     CatalogView,
     CategoryDetailView,
     FurnitureDetailView,
     LandingPageView,
+    LocationHeatmapAPIView,
     LocationQRCodeListView,
     LocationQRCodeView,
     LocationStatsAPIView,
     LocationVisitView,
+    MetricsView,
+    PageViewBeaconView,
     RecordPhoneClickView,
+    ScanExportAPIView,
+    TokenVisitView,
 )
 
+if settings.ASYNC_VIEWS:
+    landing_view = AsyncLandingPageView
+    visit_view = AsyncLocationVisitView
+    token_visit_view = AsyncTokenVisitView
+    phone_click_view = AsyncRecordPhoneClickView
+else:
+    landing_view = LandingPageView
+    visit_view = LocationVisitView
+    token_visit_view = TokenVisitView
+    phone_click_view = RecordPhoneClickView
+
 urlpatterns = [
-    path("", LandingPageView.as_view(), name="main_page"),
+    path("", landing_view.as_view(), name="main_page"),
     path("qrcode/<int:pk>/", LocationQRCodeView.as_view(), name="location_qrcode"),
+    path("v/<str:token>/", token_visit_view.as_view(), name="location_token_visit"),
     path(
-        "visit/<int:location_id>/", LocationVisitView.as_view(), name="location_visit"
+        "visit/<int:location_id>/", visit_view.as_view(), name="location_visit"
     ),
     path("qrcodes/", LocationQRCodeListView.as_view(), name="qrcode_list"),
     path(
         "api/location-stats/", LocationStatsAPIView.as_view(), name="location_stats_api"
     ),
+    path(
+        "api/location-stats/<int:location_id>/heatmap/",
+        LocationHeatmapAPIView.as_view(),
+        name="location_heatmap_api",
+    ),
+    path("api/scans/export/", ScanExportAPIView.as_view(), name="scan_export_api"),
     path("api/token/", obtain_auth_token, name="api_token"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
     path(
         "api/record-phone-click/",
-        RecordPhoneClickView.as_view(),
+        phone_click_view.as_view(),
         name="record_phone_click",
     ),
+    path("api/page-view/", PageViewBeaconView.as_view(), name="page_view_beacon"),
     # Furniture catalog URLs
     path("catalog/", CatalogView.as_view(), name="catalog"),
+    path("search/", CatalogSearchView.as_view(), name="catalog_search"),
+    path(
+        "api/catalog/search/", CatalogSearchAPIView.as_view(), name="catalog_search_api"
+    ),
+    path(
+        "api/catalog/categories/",
+        CatalogCategoryListAPIView.as_view(),
+        name="catalog_category_list_api",
+    ),
+    path(
+        "api/catalog/categories/<slug:category_slug>/",
+        CatalogCategoryDetailAPIView.as_view(),
+        name="catalog_category_detail_api",
+    ),
+    path(
+        "api/catalog/items/", CatalogItemListAPIView.as_view(), name="catalog_item_list_api"
+    ),
+    path(
+        "api/catalog/items/<slug:item_slug>/",
+        CatalogItemDetailAPIView.as_view(),
+        name="catalog_item_detail_api",
+    ),
     path(
         "catalog/<slug:category_slug>/",
         CategoryDetailView.as_view(),
@@ -1,19 +1,88 @@
+from asgiref.sync import sync_to_async
+from django.views import View
 from django.views.generic import TemplateView, DetailView, RedirectView, ListView
-from django.http import HttpResponse
-from django.db.models import Count, Q
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.db.models import Count, Max, Prefetch, Q
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db import router, transaction
+from django.shortcuts import get_object_or_404, render
+from django.urls import Resolver404, resolve, reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import http_date
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 import datetime
-import qrcode
-from io import BytesIO
+import hashlib
+import hmac
+import json
+import math
+import uuid
+import zoneinfo
 
-from .models import Location, QRCodeScan, PhoneClick, FurnitureCategory, FurnitureItem
+from . import exports, metrics, qrcodes, ratelimit, search, stats, visits
+from .caching import PAGES, STATS, VISITS
+from .models import Location, QRCodeScan, PhoneClick, FurnitureCategory, FurnitureImage, FurnitureItem, RelatedItem
+from .routers import use_replica
+from .serializers import FurnitureCategorySerializer, FurnitureItemSerializer, requested_fields
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import generics, status
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny, IsAuthenticated
+
+
+def _parse_moment(value, tz):
+    """Parse an ISO date or datetime; naive values are taken in ``tz``."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(moment):
+        moment = moment.replace(tzinfo=tz)
+    return moment
+
+
+# The hot public endpoints keep small lookups in the cache (main.caching),
+# shared by the sync views and their ASGI-native counterparts
+# (settings.ASYNC_VIEWS)
+LANDING_CATEGORIES = ("landing", "categories")
+
+
+def landing_categories():
+    return FurnitureCategory.objects.filter(is_active=True).order_by('order', 'name')
+
+
+async def _alanding_categories():
+    return [category async for category in landing_categories()]
+
+
+def _record_visit(location_id, ip_address, user_agent):
+    with transaction.atomic():
+        scan = QRCodeScan.objects.create(
+            location_id=location_id,
+            ip_address=ip_address,
+            user_agent=user_agent,
+        )
+        stats.record_scan(scan)
+    return scan
+
+
+def _record_click(scan_id, location_id):
+    # A pk-only scan is enough for the stats and saves a query
+    with transaction.atomic():
+        click = PhoneClick.objects.create(
+            scan=QRCodeScan(pk=scan_id, location_id=location_id)
+        )
+        stats.record_click(click)
+    return click
 
 
 class LandingPageView(TemplateView):
@@ -26,55 +95,143 @@ class LandingPageView(TemplateView):
             context['visit_id'] = visit_id
             
         # Add furniture categories to the context
-        context['categories'] = FurnitureCategory.objects.filter(is_active=True).order_by('order', 'name')
+        context['categories'] = PAGES.get_or_set(
+            lambda: list(landing_categories()), *LANDING_CATEGORIES
+        )
         return context
 
 
+class AsyncLandingPageView(View):
+    """ASGI-native :class:`LandingPageView`.
+
+    The template is rendered right away, in the event loop: it only
+    touches the prefetched categories, so it needs no worker thread.
+    """
+
+    template_name = LandingPageView.template_name
+
+    async def get(self, request, *args, **kwargs):
+        categories = await PAGES.aget_or_set(_alanding_categories, *LANDING_CATEGORIES)
+        context = {"view": self, "categories": categories}
+        visit_id = request.GET.get('visit_id')
+        if visit_id:
+            context['visit_id'] = visit_id
+        return render(request, self.template_name, context)
+
+
 class LocationQRCodeView(DetailView):
     model = Location
     
     def get(self, request, *args, **kwargs):
         location = self.get_object()
-        
-        # Generate the URL with location parameter
-        site_url = request.build_absolute_uri('/').rstrip('/')
-        redirect_url = f"{site_url}/visit/{location.id}/"
-        
-        # Generate QR code
-        img = qrcode.make(redirect_url)
-        
-        # Save QR code to BytesIO object
-        buffer = BytesIO()
-        img.save(buffer)
-        buffer.seek(0)
-        
+        site_url = request.build_absolute_uri('/')
         # Return the QR code as an image
-        return HttpResponse(buffer, content_type='image/png')
+        return HttpResponse(qrcodes.location_png(site_url, location), content_type='image/png')
 
 
 class LocationVisitView(RedirectView):
+    """Record the scan of a QR code and redirect to the landing page.
+
+    Serves the unsigned ``/visit/<id>/`` URLs of codes printed before the
+    signed tokens (:class:`TokenVisitView`), while ``QR_LEGACY_VISITS``.
+    """
+
     permanent = False
-    
+
+    def get(self, request, *args, **kwargs):
+        self.scan = None
+        response = super().get(request, *args, **kwargs)
+        if self.scan is not None:
+            visits.start(request, response, self.scan)
+        return response
+
+    def get_claim(self, **kwargs):
+        """``(location id, QR version)`` the URL claims, ``None`` if it is refused."""
+        if not settings.QR_LEGACY_VISITS:
+            return None
+        return kwargs['location_id'], None
+
+    def is_valid(self, location_id, version):
+        return qrcodes.location_exists(location_id)
+
     def get_redirect_url(self, *args, **kwargs):
-        location_id = kwargs.get('location_id')
-        scan = None  # Initialize scan to None
-        try:
-            location = Location.objects.get(id=location_id)
-            
-            # Record the visit
-            scan = QRCodeScan.objects.create(
-                location=location,
-                ip_address=self.request.META.get('REMOTE_ADDR'),
-                user_agent=self.request.META.get('HTTP_USER_AGENT', '')
-            )
-            
-        except Location.DoesNotExist:
-            pass
-            
-        # Redirect to the homepage with visit_id if available
-        if scan and scan.visit_id:
-            return f'/?visit_id={scan.visit_id}'
-        return '/'
+        claim = self.get_claim(**kwargs)
+        if claim is None:
+            return '/'
+        location_id, version = claim
+        ip_address = ratelimit.client_ip(self.request)
+        # Over budget: plain redirect, nothing recorded
+        if ratelimit.check('visit', ip=ip_address, location=location_id):
+            return '/'
+        if not self.is_valid(location_id, version):
+            return '/'
+        scan = self.scan = _record_visit(
+            location_id,
+            ip_address,
+            self.request.META.get('HTTP_USER_AGENT', ''),
+        )
+        VISITS.set((scan.pk, scan.location_id), scan.visit_id)
+        return f'/?visit_id={scan.visit_id}'
+
+
+class TokenVisitView(LocationVisitView):
+    """:class:`LocationVisitView` of a signed QR token (main.qrcodes).
+
+    The signature vouches for the location; only its current QR version
+    is read, from the cache.
+    """
+
+    def get_claim(self, **kwargs):
+        return qrcodes.read_token(kwargs['token'])
+
+    def is_valid(self, location_id, version):
+        return qrcodes.current_version(location_id) == version
+
+
+class AsyncLocationVisitView(View):
+    """ASGI-native :class:`LocationVisitView`.
+
+    The scan and its statistics are written in one transaction, which the
+    async ORM cannot open, so only that part runs in a worker thread.
+    """
+
+    def get_claim(self, **kwargs):
+        if not settings.QR_LEGACY_VISITS:
+            return None
+        return kwargs['location_id'], None
+
+    async def is_valid(self, location_id, version):
+        return await qrcodes.alocation_exists(location_id)
+
+    async def get(self, request, **kwargs):
+        claim = self.get_claim(**kwargs)
+        if claim is None:
+            return HttpResponseRedirect('/')
+        location_id, version = claim
+        ip_address = ratelimit.client_ip(request)
+        if await ratelimit.acheck('visit', ip=ip_address, location=location_id):
+            return HttpResponseRedirect('/')
+        if not await self.is_valid(location_id, version):
+            return HttpResponseRedirect('/')
+        scan = await sync_to_async(_record_visit)(
+            location_id,
+            ip_address,
+            request.META.get('HTTP_USER_AGENT', ''),
+        )
+        await VISITS.aset((scan.pk, scan.location_id), scan.visit_id)
+        response = HttpResponseRedirect(f'/?visit_id={scan.visit_id}')
+        visits.start(request, response, scan)
+        return response
+
+
+class AsyncTokenVisitView(AsyncLocationVisitView):
+    """ASGI-native :class:`TokenVisitView`."""
+
+    def get_claim(self, **kwargs):
+        return qrcodes.read_token(kwargs['token'])
+
+    async def is_valid(self, location_id, version):
+        return await qrcodes.acurrent_version(location_id) == version
 
 
 @method_decorator(staff_member_required, name='dispatch')
@@ -84,11 +241,17 @@ class LocationQRCodeListView(ListView):
     context_object_name = 'locations'
 
 
+@method_decorator(use_replica, name='dispatch')
 class LocationStatsAPIView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
-    
+    # Upper bound on buckets x locations in one time-series response
+    max_series_cells = 50000
+
     def get(self, request):
+        if 'granularity' in request.query_params:
+            return self.get_time_series(request)
+
         # Get period from query params (default: last 30 days)
         days = int(request.query_params.get('days', 30))
         start_date = timezone.now() - datetime.timedelta(days=days)
@@ -101,37 +264,489 @@ class LocationStatsAPIView(APIView):
         
         return Response(locations)
 
+    def get_time_series(self, request):
+        """Dense scans/clicks per bucket, summed from the hourly rollup.
 
-class RecordPhoneClickView(APIView):
-    def post(self, request, *args, **kwargs):
-        visit_id = request.data.get('visit_id')
+        Query params: ``granularity`` (hour/day/week/month), ``start`` and
+        ``end`` (ISO date or datetime, end exclusive, default last 30 days),
+        ``tz`` (IANA name, default ``STATS_TIME_ZONE``) and ``locations``
+        (comma-separated ids, default all). Supports ``If-None-Match``.
+        """
+        params = request.query_params
+        granularity = params['granularity']
+        if granularity not in stats.GRANULARITIES:
+            return Response(
+                {"error": "granularity must be one of: " + ", ".join(stats.GRANULARITIES)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            tz = zoneinfo.ZoneInfo(params.get('tz') or stats.stats_timezone().key)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            return Response({"error": "Unknown timezone"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Default to the end of the current bucket so the ETag stays stable
+            end = _parse_moment(params.get('end'), tz) or stats.bucket_end(
+                timezone.now(), granularity, tz
+            )
+            start = _parse_moment(params.get('start'), tz) or end - datetime.timedelta(days=30)
+            location_ids = sorted({
+                int(value) for value in params.get('locations', '').split(',') if value
+            }) or None
+        except ValueError:
+            return Response(
+                {"error": "Invalid start, end or locations parameter"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if start >= end:
+            return Response({"error": "start must be before end"}, status=status.HTTP_400_BAD_REQUEST)
+
+        locations = Location.objects.order_by('id')
+        if location_ids is not None:
+            locations = locations.filter(id__in=location_ids)
+        locations = list(locations.values('id', 'name'))
 
-        if not visit_id:
+        # Reject oversized requests before generating any bucket
+        approx_buckets = (end - start) / datetime.timedelta(days=1) * {
+            'hour': 24, 'day': 1, 'week': 1 / 7, 'month': 1 / 28,
+        }[granularity]
+        if approx_buckets * max(len(locations), 1) > self.max_series_cells:
             return Response(
-                {"error": "visit_id is required"},
+                {"error": f"Response too large: reduce the range, the number of "
+                          f"locations or use a coarser granularity "
+                          f"(limit {self.max_series_cells} values per series set)"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            scan = QRCodeScan.objects.get(visit_id=visit_id)
-            PhoneClick.objects.create(scan=scan)
+        ids = [location['id'] for location in locations]
+        buckets = stats.bucket_starts(start, end, granularity, tz)
+        # Over the rows the series sums: the first bucket may begin before start
+        watermark = stats.rollup_watermark(buckets[0] if buckets else start, end, ids)
+        etag = '"%s"' % hashlib.sha1(
+            f"{ids}|{start.isoformat()}|{end.isoformat()}|{granularity}|{tz.key}|"
+            f"{watermark.isoformat() if watermark else ''}".encode()
+        ).hexdigest()
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        series = stats.time_series(buckets, end, granularity, tz, ids)
+        empty = [0] * len(buckets)
+        return Response({
+            "granularity": granularity,
+            "timezone": tz.key,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "buckets": [bucket.isoformat() for bucket in buckets],
+            "locations": [
+                {
+                    "id": location['id'],
+                    "name": location['name'],
+                    "scans": series.get(location['id'], {}).get('scans', empty),
+                    "clicks": series.get(location['id'], {}).get('clicks', empty),
+                }
+                for location in locations
+            ],
+        }, headers={'ETag': etag})
+
+
+@method_decorator(use_replica, name='dispatch')
+class LocationHeatmapAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, location_id):
+        location = get_object_or_404(Location, id=location_id)
+        matrix = STATS.get_or_set(
+            lambda: stats.location_heatmap([location.id]), "heatmap", location.id
+        )
+
+        return Response({
+            "location": {"id": location.id, "name": location.name},
+            "timezone": stats.stats_timezone().key,
+            "weekdays": list(stats.WEEKDAYS),
+            "scans": [[cell["scans"] for cell in row] for row in matrix],
+            "clicks": [[cell["clicks"] for cell in row] for row in matrix],
+        })
+
+
+@method_decorator(use_replica, name='dispatch')
+class ScanExportAPIView(APIView):
+    """Stream raw scans with location names and phone-click counts.
+
+    Query params: ``output`` (csv or ndjson), ``start``/``end`` (ISO date or
+    datetime in ``STATS_TIME_ZONE``) and ``locations`` (comma-separated ids).
+    The body is gzipped on the fly when the client accepts it.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        # ``format`` is reserved by DRF for content negotiation
+        fmt = params.get('output', 'csv')
+        if fmt not in exports.EXPORT_FORMATS:
             return Response(
-                {"status": "success", "message": "Phone click recorded"},
-                status=status.HTTP_201_CREATED
+                {"error": "output must be one of: " + ", ".join(exports.EXPORT_FORMATS)},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        except QRCodeScan.DoesNotExist:
+        tz = stats.stats_timezone()
+        # The rows are streamed after dispatch() has left use_replica, so the
+        # alias is chosen now
+        scans = QRCodeScan.objects.using(router.db_for_read(QRCodeScan))
+        try:
+            start = _parse_moment(params.get('start'), tz)
+            end = _parse_moment(params.get('end'), tz)
+            location_ids = [int(value) for value in params.get('locations', '').split(',') if value]
+        except ValueError:
             return Response(
-                {"error": "QRCodeScan not found for the provided visit_id"},
-                status=status.HTTP_404_NOT_FOUND
+                {"error": "Invalid start, end or locations parameter"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        except Exception as e:
-            # Generic exception handler for unexpected errors
+        if start:
+            scans = scans.filter(timestamp__gte=start)
+        if end:
+            scans = scans.filter(timestamp__lt=end)
+        if location_ids:
+            scans = scans.filter(location_id__in=location_ids)
+
+        return exports.export_response(scans, fmt, compress=exports.accepts_gzip(request))
+
+
+def _parse_visit_id(value):
+    """``(visit id, None)`` in canonical form, or ``(None, error message)``."""
+    if not value:
+        return None, "visit_id is required"
+    try:
+        return str(uuid.UUID(str(value))), None
+    except ValueError:
+        return None, "visit_id must be a UUID"
+
+
+class RecordPhoneClickView(APIView):
+    # Called by anonymous visitors from the landing page
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        retry_after = ratelimit.check('click', ip=ratelimit.client_ip(request))
+        if retry_after:
             return Response(
-                {"error": "An unexpected error occurred: " + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "Too many requests"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        visit_id, error = _parse_visit_id(request.data.get('visit_id'))
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Usually cached by the visit redirect a moment earlier
+        scan = VISITS.get(visit_id)
+        if scan is None:
+            scan = QRCodeScan.objects.filter(visit_id=visit_id).values_list(
+                'pk', 'location_id'
+            ).first()
+            if scan is None:
+                return Response(
+                    {"error": "QRCodeScan not found for the provided visit_id"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        _record_click(*scan)
+        visits.record_call(visit_id)
+        return Response(
+            {"status": "success", "message": "Phone click recorded"},
+            status=status.HTTP_201_CREATED
+        )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRecordPhoneClickView(View):
+    """ASGI-native :class:`RecordPhoneClickView` with the same responses.
+
+    The scan of a visit is usually in the cache, put there by the visit
+    view a moment earlier.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        retry_after = await ratelimit.acheck('click', ip=ratelimit.client_ip(request))
+        if retry_after:
+            return JsonResponse(
+                {"error": "Too many requests"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                return JsonResponse(
+                    {"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            data = request.POST
+        visit_id, error = _parse_visit_id(data.get('visit_id'))
+        if error:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        scan = await VISITS.aget(visit_id)
+        if scan is None:
+            scan = await QRCodeScan.objects.filter(visit_id=visit_id).values_list(
+                'pk', 'location_id'
+            ).afirst()
+            if scan is None:
+                return JsonResponse(
+                    {"error": "QRCodeScan not found for the provided visit_id"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            await VISITS.aset(tuple(scan), visit_id)
+
+        await sync_to_async(_record_click)(*scan)
+        visits.record_call(visit_id)
+        return JsonResponse(
+            {"status": "success", "message": "Phone click recorded"},
+            status=status.HTTP_201_CREATED
+        )
+
+
+class MetricsView(View):
+    """Prometheus scrape endpoint, see main.metrics.
+
+    404 while ``METRICS_TOKEN`` is not set, so the endpoint is not even
+    discoverable.
+    """
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if not token:
+            raise Http404
+        scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(given.encode(), token.encode()):
+            response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+            response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+            return response
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+def _search_params(params, max_page_size=50):
+    """Search keyword arguments and page number from query parameters."""
+    try:
+        page = max(int(params.get("page", 1)), 1)
+        page_size = min(max(int(params.get("page_size", 20)), 1), max_page_size)
+    except ValueError:
+        page, page_size = 1, 20
+    return {
+        "query": params.get("q", "").strip()[:200],
+        "category": params.get("category", ""),
+        "band": params.get("price", ""),
+        "material": params.get("material", ""),
+        "offset": (page - 1) * page_size,
+        "limit": page_size,
+    }, page
+
+
+@method_decorator(use_replica, name='dispatch')
+class CatalogSearchAPIView(APIView):
+    """Ranked catalog search with category, price band and material facets.
+
+    Query params: ``q``, ``category`` (slug), ``price`` (band key),
+    ``material``, ``page``, ``page_size`` (at most 50).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        params, page = _search_params(request.query_params)
+        result = search.search(**params)
+        return Response({
+            "query": params["query"],
+            "count": result.total,
+            "page": page,
+            "results": [
+                {
+                    "id": item.id,
+                    "name": item.name,
+                    "slug": item.slug,
+                    "category": item.category.slug,
+                    "url": reverse("furniture_detail", args=[item.category.slug, item.slug]),
+                    "price": item.price,
+                    "discount_price": item.discount_price,
+                    "image": item.main_image.url if item.main_image else None,
+                    "score": score,
+                }
+                for item, score in search.ordered_items(result)
+            ],
+            "facets": result.facets,
+        })
+
+
+class CatalogCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'id'
+
+
+class CategoryCursorPagination(CatalogCursorPagination):
+    # Same order as the catalog page
+    ordering = ('order', 'id')
+
+
+class ConditionalCatalogMixin:
+    """Public, read-only catalog endpoint with ETag/Last-Modified validators.
+
+    The validators come from one aggregate query (row count and the
+    ``updated_at`` maxima of ``last_modified_fields``), so a matching
+    ``If-None-Match``/``If-Modified-Since`` is answered with 304 before any
+    row is loaded or serialized. Reads may go to the replica (main.routers).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    last_modified_fields = ('updated_at',)
+    cache_max_age = 60
+
+    @method_decorator(use_replica)
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_version_queryset(self):
+        return self.get_queryset()
+
+    def get_version(self):
+        version = self.get_version_queryset().order_by().aggregate(
+            count=Count('pk'),
+            **{f'max_{i}': Max(field) for i, field in enumerate(self.last_modified_fields)}
+        )
+        moments = [value for key, value in version.items() if key != 'count' and value]
+        return version['count'], max(moments, default=None)
+
+    def get(self, request, *args, **kwargs):
+        count, last_modified = self.get_version()
+        etag = '"%s"' % hashlib.sha1(
+            f"{request.get_full_path()}|{count}|"
+            f"{last_modified.isoformat() if last_modified else ''}".encode()
+        ).hexdigest()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_cache_control(response, public=True, max_age=self.cache_max_age)
+        return response
+
+
+class CatalogCategoryListAPIView(ConditionalCatalogMixin, generics.ListAPIView):
+    serializer_class = FurnitureCategorySerializer
+    pagination_class = CategoryCursorPagination
+
+    def get_queryset(self):
+        return FurnitureCategory.objects.filter(is_active=True)
+
+
+class CatalogCategoryDetailAPIView(ConditionalCatalogMixin, generics.RetrieveAPIView):
+    serializer_class = FurnitureCategorySerializer
+    lookup_field = 'slug'
+    lookup_url_kwarg = 'category_slug'
+
+    def get_queryset(self):
+        return FurnitureCategory.objects.filter(is_active=True)
+
+    def get_version_queryset(self):
+        return self.get_queryset().filter(slug=self.kwargs['category_slug'])
+
+
+class CatalogItemQuerysetMixin:
+    last_modified_fields = ('updated_at', 'category__updated_at')
+
+    def get_queryset(self):
+        queryset = FurnitureItem.objects.filter(
+            is_active=True, category__is_active=True
+        ).select_related('category')
+        fields = requested_fields(self.request)
+        # The gallery costs one extra query per page; skip it when not asked for
+        if fields is None or 'images' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('images', queryset=FurnitureImage.objects.order_by('order', 'id'))
             )
+        return queryset
+
+
+class CatalogItemListAPIView(CatalogItemQuerysetMixin, ConditionalCatalogMixin, generics.ListAPIView):
+    """Active items; ``?category=<slug>`` and ``?featured=1`` filter the list."""
+    serializer_class = FurnitureItemSerializer
+    pagination_class = CatalogCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category = self.request.query_params.get('category')
+        if category:
+            queryset = queryset.filter(category__slug=category)
+        if self.request.query_params.get('featured') in ('1', 'true'):
+            queryset = queryset.filter(is_featured=True)
+        return queryset
+
+
+class CatalogItemDetailAPIView(CatalogItemQuerysetMixin, ConditionalCatalogMixin, generics.RetrieveAPIView):
+    serializer_class = FurnitureItemSerializer
+    lookup_field = 'slug'
+    lookup_url_kwarg = 'item_slug'
 
+    def get_version_queryset(self):
+        return self.get_queryset().filter(slug=self.kwargs['item_slug'])
 
+
+@method_decorator(use_replica, name='dispatch')
+class CatalogSearchView(TemplateView):
+    template_name = 'catalog/search.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        params, page = _search_params(self.request.GET)
+        result = search.search(**params)
+        querystring = self.request.GET.copy()
+        querystring.pop('page', None)
+
+        # Each facet value links to the current search with that value
+        # toggled, so the page works without JavaScript.
+        selected = {
+            'category': params['category'],
+            'price': params['band'],
+            'material': params['material'].lower(),
+        }
+        facets = []
+        for facet, param, title in (
+            ('category', 'category', 'Категория'),
+            ('price', 'price', 'Цена'),
+            ('materials', 'material', 'Материалы'),
+        ):
+            values = []
+            for value in result.facets[facet]:
+                toggled = querystring.copy()
+                is_selected = value['value'] == selected[param]
+                if is_selected:
+                    toggled.pop(param, None)
+                else:
+                    toggled[param] = value['value']
+                values.append({**value, 'selected': is_selected, 'url': '?' + toggled.urlencode()})
+            facets.append({'title': title, 'values': values})
+
+        context.update({
+            'query': params['query'],
+            'items': [item for item, _ in search.ordered_items(result)],
+            'total': result.total,
+            'facets': facets,
+            'page': page,
+            'has_next': params['offset'] + params['limit'] < result.total,
+            'querystring': querystring.urlencode(),
+        })
+        return context
+
+
+@method_decorator(use_replica, name='dispatch')
 class CatalogView(ListView):
     model = FurnitureCategory
     template_name = 'catalog/catalog.html'
@@ -146,6 +761,7 @@ class CatalogView(ListView):
         return context
 
 
+@method_decorator(use_replica, name='dispatch')
 class CategoryDetailView(DetailView):
     model = FurnitureCategory
     template_name = 'catalog/category_detail.html'
@@ -165,12 +781,72 @@ class FurnitureDetailView(DetailView):
     context_object_name = 'item'
     slug_url_kwarg = 'item_slug'
 
+    related_count = 4
+    # Disabled by the static export, which renders pages nobody viewed
+    track_views = True
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if not self.track_views:
+            return response
+        # An anonymous visitor id ties views together for "viewed together"
+        # recommendations; written in batches with the visit events
+        visits.record_item_view(self.object.pk, visits.visitor(request, response))
+        return response
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        item = self.get_object()
+        item = self.object
         context['images'] = item.images.all().order_by('order')
-        context['related_items'] = FurnitureItem.objects.filter(
-            category=item.category, 
-            is_active=True
-        ).exclude(id=item.id)[:4]
+        # Precomputed by refresh_recommendations; one indexed query
+        related = [
+            recommendation.related
+            for recommendation in RelatedItem.objects.filter(
+                item=item, related__is_active=True
+            ).select_related('related__category')[:self.related_count]
+        ]
+        if not related:
+            # Not computed yet (e.g. a new item): same-category items
+            related = FurnitureItem.objects.filter(
+                category=item.category,
+                is_active=True
+            ).select_related('category').exclude(id=item.id)[:self.related_count]
+        context['related_items'] = related
         return context
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class PageViewBeaconView(View):
+    """Views of the statically exported catalog pages (see main.static_export).
+
+    nginx serves those pages without Django, so each one posts its path
+    here: the view counts in the visit funnel and, for item pages, in the
+    "viewed together" recommendations, as if the page had been rendered.
+    """
+
+    # URL names of the exported pages
+    pages = ('catalog', 'category_detail', 'furniture_detail')
+
+    def post(self, request, *args, **kwargs):
+        retry_after = ratelimit.check('page_view', ip=ratelimit.client_ip(request))
+        if retry_after:
+            return HttpResponse(
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        try:
+            match = resolve(request.body.decode())
+        except (Resolver404, UnicodeDecodeError):
+            match = None
+        if match is None or match.url_name not in self.pages:
+            return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+        response = HttpResponse(status=status.HTTP_204_NO_CONTENT)
+        if visits.enabled():
+            visits.track_page(request, response, match.url_name)
+        if match.url_name == 'furniture_detail':
+            item_id = FurnitureItem.objects.filter(
+                slug=match.kwargs['item_slug']
+            ).values_list('pk', flat=True).first()
+            if item_id is not None:
+                visits.record_item_view(item_id, visits.visitor(request, response))
+        return response
@@ -0,0 +1,399 @@
+"""Visit sessions: what a visitor does after scanning a QR code.
+
+The visit redirect opens a session for the new scan. It sets a
+``visit_id`` cookie, which expires ``VISIT_SESSION_TIMEOUT`` seconds
+after the last page view, and the long-lived ``visitor_id`` cookie.
+``VisitTrackingMiddleware`` then adds the landing, catalog, category and
+item page views of the visit; the click API adds its phone clicks.
+Catalog pages served from the static export (``main.static_export``)
+report their views through the page view beacon instead, which needs
+JavaScript.
+
+Nothing is written per request. Events are summed per visit in memory,
+and the item page views behind the "viewed together" recommendations
+(``FurnitureItemView``) are buffered with them. Every
+``VISIT_FLUSH_INTERVAL`` seconds, or once ``VISIT_FLUSH_SIZE`` visits are
+pending, one flush writes the batch: the ``VisitSession`` rows get a
+``bulk_update``, the funnel stages they newly reached are added to the
+``LocationFunnelStats`` day rows, and the item views are bulk-created.
+The session rows are locked meanwhile, so concurrent flushes of several
+workers count each stage once.
+
+The flush runs inline in the request that makes it due. A timer thread
+flushes an idle worker ``VISIT_FLUSH_INTERVAL`` seconds after its first
+pending event, and an exit handler flushes a worker that is shut down or
+recycled; only the events of a killed process are lost.
+
+A session is returning when its visitor had an earlier session. Only a
+keyed hash of the visitor cookie is stored.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from . import stats
+from .models import (
+    FurnitureItem,
+    FurnitureItemView,
+    LocationFunnelStats,
+    QRCodeScan,
+    VisitSession,
+)
+
+logger = logging.getLogger(__name__)
+
+VISIT_COOKIE = "visit_id"
+VISITOR_COOKIE = "visitor_id"
+VISITOR_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+# URL name: page kind
+PAGES = {
+    "main_page": "landing",
+    "catalog": "catalog",
+    "catalog_search": "catalog",
+    "category_detail": "category",
+    "furniture_detail": "item",
+}
+# Event: (VisitSession counter, funnel stage)
+EVENTS = {
+    "landing": ("landing_views", 0),
+    "catalog": ("catalog_views", 1),
+    "category": ("category_views", 1),
+    "item": ("item_views", 2),
+    "call": ("calls", 3),
+}
+# LocationFunnelStats counter of each stage after the scan
+STAGE_COUNTERS = (None, "catalog", "item", "calls")
+PAGE_COUNTERS = ("landing_views", "catalog_views", "category_views", "item_views")
+
+_pending = {}
+_item_views = []
+_pending_lock = threading.Lock()
+_next_flush = 0.0
+_timer = None
+
+
+def enabled() -> bool:
+    return settings.VISIT_TRACKING_ENABLED
+
+
+def visitor(request, response) -> uuid.UUID:
+    """The visitor id of the request's cookie; a new one is set on ``response``.
+
+    Kept on the request, so every caller of one request gets the same id.
+    """
+    visitor_id = getattr(request, "_visitor_id", None)
+    if visitor_id is not None:
+        return visitor_id
+    try:
+        visitor_id = uuid.UUID(request.COOKIES.get(VISITOR_COOKIE, ""))
+    except ValueError:
+        visitor_id = uuid.uuid4()
+        # Anonymous, carries no personal data
+        response.set_cookie(
+            VISITOR_COOKIE,
+            str(visitor_id),
+            max_age=VISITOR_COOKIE_MAX_AGE,
+            httponly=True,
+            samesite="Lax",
+        )
+    request._visitor_id = visitor_id
+    return visitor_id
+
+
+def visitor_hash(visitor_id: uuid.UUID) -> str:
+    return salted_hmac("main.visits.visitor", visitor_id.hex).hexdigest()[:32]
+
+
+def _visit_id(value) -> str | None:
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def _keep_visit(response, visit_id):
+    # Re-set on every page view: the session times out after the last one
+    response.set_cookie(
+        VISIT_COOKIE,
+        visit_id,
+        max_age=settings.VISIT_SESSION_TIMEOUT,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def start(request, response, scan: QRCodeScan) -> None:
+    """Open the session of a new scan on its visit redirect ``response``."""
+    if not enabled():
+        return
+    visit_id = str(scan.visit_id)
+    _add(
+        visit_id,
+        None,
+        scan.timestamp,
+        location_id=scan.location_id,
+        started_at=scan.timestamp,
+        visitor=visitor_hash(visitor(request, response)),
+    )
+    _keep_visit(response, visit_id)
+
+
+def track(request, response) -> None:
+    """Add a page view to the visit of the request, if it belongs to one."""
+    if request.method != "GET" or response.status_code != 200:
+        return
+    match = request.resolver_match
+    if match is not None:
+        track_page(request, response, match.url_name)
+
+
+def track_page(request, response, url_name) -> None:
+    """Add a view of the ``url_name`` page to the visit of the request.
+
+    Also called by the page view beacon of the statically exported pages,
+    which nginx serves without Django.
+    """
+    page = PAGES.get(url_name)
+    if page is None:
+        return
+    visit_id = _visit_id(request.COOKIES.get(VISIT_COOKIE))
+    if visit_id is None and page == "landing":
+        # Without cookies the landing page still gets it in the URL
+        visit_id = _visit_id(request.GET.get("visit_id"))
+    if visit_id is None:
+        return
+    _add(
+        visit_id,
+        page,
+        timezone.now(),
+        visitor=visitor_hash(visitor(request, response)),
+    )
+    _keep_visit(response, visit_id)
+
+
+def record_call(visit_id) -> None:
+    """Add a phone click to its visit."""
+    visit_id = _visit_id(visit_id)
+    if enabled() and visit_id is not None:
+        _add(visit_id, "call", timezone.now())
+
+
+def record_item_view(item_id, visitor_id: uuid.UUID) -> None:
+    """Add a view of an item page, for the "viewed together" recommendations."""
+    if not enabled():
+        # Nothing flushes the buffer without VisitTrackingMiddleware
+        FurnitureItemView.objects.create(item_id=item_id, visitor_id=visitor_id)
+        return
+    with _pending_lock:
+        # Timestamped when written, at most one flush interval late
+        _item_views.append(FurnitureItemView(item_id=item_id, visitor_id=visitor_id))
+        _schedule()
+
+
+def _add(visit_id, event, moment, **fields):
+    with _pending_lock:
+        _schedule()
+        entry = _pending.get(visit_id)
+        if entry is None:
+            entry = _pending[visit_id] = {
+                "location_id": None,
+                "started_at": None,
+                "visitor": "",
+                "last_seen": moment,
+                "stage": 0,
+                **{counter: 0 for counter, _ in EVENTS.values()},
+            }
+        entry.update((key, value) for key, value in fields.items() if value)
+        entry["last_seen"] = max(entry["last_seen"], moment)
+        if event is not None:
+            counter, stage = EVENTS[event]
+            entry[counter] += 1
+            entry["stage"] = max(entry["stage"], stage)
+
+
+def _schedule():
+    # Called under _pending_lock: a worker that gets no more requests
+    # still writes its events
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(settings.VISIT_FLUSH_INTERVAL, _flush_idle)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _flush_idle():
+    global _timer
+    with _pending_lock:
+        _timer = None
+    try:
+        flush()
+    finally:
+        # The timer thread's own connections
+        connections.close_all()
+
+
+def flush_due() -> bool:
+    """True once per ``VISIT_FLUSH_INTERVAL`` or when the batch is full."""
+    global _next_flush
+    now = time.monotonic()
+    size = max(len(_pending), len(_item_views))
+    if now < _next_flush and size < settings.VISIT_FLUSH_SIZE:
+        return False
+    _next_flush = now + settings.VISIT_FLUSH_INTERVAL
+    return True
+
+
+def flush() -> int:
+    """Write the pending events; returns the number of sessions updated."""
+    global _pending, _item_views, _timer
+    with _pending_lock:
+        pending, _pending = _pending, {}
+        item_views, _item_views = _item_views, []
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if item_views:
+        _write_item_views(item_views)
+    if not pending:
+        return 0
+    try:
+        with transaction.atomic():
+            return _write(pending)
+    except DatabaseError:
+        # Analytics must never break a request
+        logger.warning("Lost the events of %d visits", len(pending), exc_info=True)
+        return 0
+
+
+# A worker that is shut down or recycled writes what it still holds
+atexit.register(flush)
+
+
+def _write_item_views(item_views) -> None:
+    try:
+        # Items deleted since their view was recorded are skipped
+        existing = set(
+            FurnitureItem.objects.filter(
+                pk__in={view.item_id for view in item_views}
+            ).values_list("pk", flat=True)
+        )
+        FurnitureItemView.objects.bulk_create(
+            [view for view in item_views if view.item_id in existing], batch_size=500
+        )
+    except DatabaseError:
+        logger.warning("Lost %d item views", len(item_views), exc_info=True)
+
+
+def _locked(visit_ids) -> dict:
+    # Always locked in primary key order, so concurrent flushes cannot deadlock
+    return {
+        str(session.visit_id): session
+        for session in VisitSession.objects.select_for_update()
+        .filter(visit_id__in=visit_ids)
+        .order_by("pk")
+    }
+
+
+def _create(visit_ids, pending) -> None:
+    """Create the missing sessions, from the scan event or the scan itself."""
+    starts = {
+        visit_id: (pending[visit_id]["location_id"], pending[visit_id]["started_at"])
+        for visit_id in visit_ids
+        if pending[visit_id]["location_id"] is not None
+    }
+    unknown = [visit_id for visit_id in visit_ids if visit_id not in starts]
+    if unknown:
+        # Scanned in another process; ids matching no scan are dropped
+        for visit_id, location_id, timestamp in QRCodeScan.objects.filter(
+            visit_id__in=unknown
+        ).values_list("visit_id", "location_id", "timestamp"):
+            starts[str(visit_id)] = (location_id, timestamp)
+    hashes = {pending[visit_id]["visitor"] for visit_id in starts} - {""}
+    seen = set(
+        VisitSession.objects.filter(visitor_hash__in=hashes)
+        .values_list("visitor_hash", flat=True)
+        .distinct()
+    )
+    sessions = []
+    for visit_id, (location_id, started_at) in sorted(starts.items(), key=lambda item: item[1][1]):
+        visitor_hash = pending[visit_id]["visitor"]
+        sessions.append(
+            VisitSession(
+                visit_id=visit_id,
+                location_id=location_id,
+                started_at=started_at,
+                last_seen_at=started_at,
+                visitor_hash=visitor_hash,
+                returning=visitor_hash in seen,
+            )
+        )
+        if visitor_hash:
+            seen.add(visitor_hash)
+    # Another worker may create the same session at the same time
+    VisitSession.objects.bulk_create(sessions, ignore_conflicts=True)
+
+
+def _write(pending) -> int:
+    sessions = _locked(list(pending))
+    missing = [visit_id for visit_id in pending if visit_id not in sessions]
+    if missing:
+        _create(missing, pending)
+        sessions.update(_locked(missing))
+
+    tz = stats.stats_timezone()
+    funnel = {}
+    for visit_id, session in sessions.items():
+        entry = pending[visit_id]
+        for counter, _ in EVENTS.values():
+            setattr(session, counter, getattr(session, counter) + entry[counter])
+        session.last_seen_at = max(session.last_seen_at, entry["last_seen"])
+        session.visitor_hash = session.visitor_hash or entry["visitor"]
+
+        day = timezone.localtime(session.started_at, tz).date()
+        deltas = funnel.setdefault((session.location_id, day), Counter())
+        reached = session.stage
+        if reached is None:
+            deltas["sessions"] += 1
+            deltas["returning"] += session.returning
+            reached = 0
+        session.stage = max(reached, entry["stage"])
+        for stage in range(reached + 1, session.stage + 1):
+            deltas[STAGE_COUNTERS[stage]] += 1
+        deltas["page_views"] += sum(entry[counter] for counter in PAGE_COUNTERS)
+
+    VisitSession.objects.bulk_update(
+        sessions.values(),
+        ["last_seen_at", "visitor_hash", "stage", *(counter for counter, _ in EVENTS.values())],
+        batch_size=500,
+    )
+    for (location_id, day), deltas in sorted(funnel.items()):
+        if any(deltas.values()):
+            _add_funnel({"location_id": location_id, "day": day}, deltas)
+    return len(sessions)
+
+
+def _add_funnel(lookup, deltas):
+    """Add ``deltas`` to the funnel row of ``lookup``, creating it if needed."""
+    row = LocationFunnelStats.objects.filter(**lookup)
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if row.update(**increments, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            LocationFunnelStats.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Another worker created the row between our update and insert
+        row.update(**increments, updated_at=timezone.now())
@@ -22,7 +22,7 @@ async function handlePhoneClick(event, phoneNumber) {
 
     if (visitId) {
         try {
-            const response = await fetch("/record-phone-click/", {
+            const response = await fetch("/api/record-phone-click/", {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',